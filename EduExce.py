@@ -9,23 +9,78 @@
 # - MODO RÍGIDO: Validaciones estrictas, sin fallbacks, sin tolerancia a errores
 # - Compatible con: gpt-4o, gpt-5-pro, o1-preview, y otros modelos OpenAI
 # - Endpoints: /icfes/catalogo, /icfes/validar, /icfes/generar, /icfes/generar_pack, /debug/raw,
-#              /icfes/doc_justificacion
+#              /icfes/doc_justificacion, /icfes/metricas, /icfes/rutas, /icfes/banco,
+#              /icfes/simulacro, /icfes/estimar, /icfes/buscar, /icfes/generar_kolb, /icfes/generar_mixto,
+#              /debug/profile
+# - Hedging opcional: petición de respaldo si una generación supera el p90 de su área
+# - Enrutamiento opt-in de modelo por área/subtema (rápido/fuerte) con escalado si falla el esquema
+# - max_tokens adaptativo: percentil alto de completion_tokens observados por celda
+# - Reparación dirigida: si el JSON no cumple el esquema se piden solo los campos fallidos
+# - Exposición por estudiante: filtro de Bloom rotativo para no repetir ítems ya vistos
+# - Banco local de ítems generados (JSONL) y ensamblado de simulacros completos por cuotas
+# - Índice del banco en arreglos NumPy memory-mapped (banco_indice.py): muestreo vectorizado por celda
+# - Puntaje de calidad vectorizado del banco (calidad_banco.py); el muestreo omite ítems débiles
+# - Planificador justo (WFQ) por colegio/tenant delante de las llamadas al proveedor
+# - Coalescencia (single-flight) de peticiones idénticas concurrentes a /icfes/generar
+# - Estimación previa de tokens, costo y latencia de un pack (/icfes/estimar), sin llamar al proveedor
+# - Control de admisión: bajo carga se sirve desde el banco (meta.source) y sobre el límite duro 503 + Retry-After
+# - Deadlines (deadline_ms o X-Deadline-Ms) propagados como timeout de cada llamada; packs parciales con `truncado`
+# - Cancelación si el cliente se desconecta (pack y simulacro): se cortan las llamadas en curso y lo pagado va al banco
+# - Generación masiva offline del banco: ver generar_banco.py (pool de procesos, checkpoint, Batch API)
+# - Estado compartido entre workers (estado_compartido.py, SQLite WAL o memoria): exposición, dedup del banco,
+#   sobrantes de la coalescencia y rate limit (RPM/TPM) hacia el proveedor
+# - Búsqueda de texto completo en el banco (/icfes/buscar): índice invertido BM25 incremental (busqueda_banco.py)
+# - Variantes de los 4 estilos Kolb de un subtema en una sola llamada (/icfes/generar_kolb)
+# - Packs mixtos de varias celdas (/icfes/generar_mixto): plan stock → banco → proveedor en paralelo
+# - Respuestas estáticas (/, /icfes/catalogo, /icfes/doc_justificacion) serializadas y comprimidas una vez,
+#   con ETag fuerte, Cache-Control y 304 (If-None-Match)
+# - Perfilador por muestreo bajo demanda (/debug/profile, protegido con DEBUG_TOKEN): pilas "collapsed"
+#   para flame graphs y tiempo de pared vs CPU por función (perfilador.py)
+# - Corpus de respuestas del proveedor: grabación (GRABAR_CORPUS, gzip, secretos redactados) y replay
+#   sin red (REPLAY_CORPUS); corpus_replay.py mide parseo/validación y compara salidas entre versiones
+# - Verificación local de la clave en Matemáticas (verificador_matematicas.py): corrige la letra o rechaza el ítem
+#   solo si el cálculo del enunciado y la explicación coinciden
 # ------------------------------------------------------------
 
 
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv, find_dotenv
 from openai import OpenAI
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
 import os
 import json
+import gzip
 import re
 import random
+import shutil
+import asyncio
+import atexit
+import hashlib
+import hmac
+import math
+import tempfile
+import threading
 import unicodedata
+import struct
 import time
 
+from banco_indice import IndiceBanco
+from busqueda_banco import IndiceBusqueda
+from corpus_respuestas import ClienteGrabador, ClienteReplay, abrir_grabador, etiqueta_corpus
+from estado_compartido import abrir_estado
+from perfilador import PerfiladorMuestreo, PerfiladorOcupado
+from verificador_matematicas import verificar as verificar_matematicas
+from ia_preguntas_service import CARACTERISTICAS_ESTILO
+from icfes_saber11_fuentes import ICFES_AREA_ALIAS, ICFES_SABER11_FUENTES
+
 # ===================== Documentación oficial ICFES (bloque para Confluence) =====================
 
 ICFES_DOC_CONFLUENCE = """
@@ -203,25 +258,137 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o") 
 STRICT_MODE = True  # Siempre en modo estricto - más rígido
 DEBUG_JSON = os.getenv("DEBUG_JSON", "0") == "1"
+# /debug/profile solo responde con la cabecera X-Debug-Token igual a este valor (vacío = deshabilitado)
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
 SEED_RANDOMIZE = os.getenv("SEED_RANDOMIZE", "1") == "1"
 
-# Validación estricta de API Key
-if not OPENAI_API_KEY or not OPENAI_API_KEY.strip():
-    raise ValueError("OPENAI_API_KEY es requerida y no puede estar vacía")
-
-# Validación estricta del formato de API Key
-if not OPENAI_API_KEY.startswith(("sk-", "sk-proj-")):
-    raise ValueError("OPENAI_API_KEY debe comenzar con 'sk-' o 'sk-proj-'")
+# Hedging (opt-in): si una generación no responde antes del percentil HEDGE_PERCENTIL de latencia
+# observado para su área, se lanza una segunda petición y se usa la primera que responda.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTIL = float(os.getenv("HEDGE_PERCENTIL", "0.9"))
+HEDGE_MIN_MUESTRAS = int(os.getenv("HEDGE_MIN_MUESTRAS", "20"))
+# Presupuesto de tokens extra como tasa: cubo de HEDGE_PRESUPUESTO_TOKENS que se rellena por
+# completo cada HEDGE_PRESUPUESTO_VENTANA_S segundos
+HEDGE_PRESUPUESTO_TOKENS = int(os.getenv("HEDGE_PRESUPUESTO_TOKENS", "200000"))
+HEDGE_PRESUPUESTO_VENTANA_S = float(os.getenv("HEDGE_PRESUPUESTO_VENTANA_S", "3600"))
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "16"))
+
+# Enrutamiento de modelos: cada (área, subtema) usa un nivel; si la salida del nivel rápido
+# no pasa ensure_schema, el ítem se escala al siguiente nivel (más fuerte). Opt-in: con
+# ROUTING_ENABLED=0 todo va al nivel "fuerte" (OPENAI_MODEL_FUERTE, por defecto OPENAI_MODEL).
+ROUTING_ENABLED = os.getenv("ROUTING_ENABLED", "0") == "1"
+OPENAI_MODEL_RAPIDO = os.getenv("OPENAI_MODEL_RAPIDO", "gpt-4o-mini")
+OPENAI_MODEL_FUERTE = os.getenv("OPENAI_MODEL_FUERTE", OPENAI_MODEL)
+
+# max_tokens adaptativo: si el cliente no fija max_tokens_item, se usa el percentil
+# MAX_TOKENS_PERCENTIL de completion_tokens observados para (área, subtema, longitud) más un margen.
+MAX_TOKENS_ADAPTATIVO = os.getenv("MAX_TOKENS_ADAPTATIVO", "1") == "1"
+MAX_TOKENS_PERCENTIL = float(os.getenv("MAX_TOKENS_PERCENTIL", "0.95"))
+MAX_TOKENS_MARGEN = float(os.getenv("MAX_TOKENS_MARGEN", "1.15"))
+MAX_TOKENS_MIN_MUESTRAS = int(os.getenv("MAX_TOKENS_MIN_MUESTRAS", "10"))
+# Una salida truncada (finish_reason "length") solo dice que hacía falta más que el tope: se registra
+# como tope × MAX_TOKENS_FACTOR_TRUNCADO para que el percentil suba en vez de quedar censurado
+MAX_TOKENS_FACTOR_TRUNCADO = float(os.getenv("MAX_TOKENS_FACTOR_TRUNCADO", "2"))
+
+# Reparación dirigida: en vez de regenerar el ítem, se devuelve el JSON roto al modelo
+# pidiendo solo los campos que fallan, con un max_tokens pequeño.
+REPARACION_ENABLED = os.getenv("REPARACION_ENABLED", "1") == "1"
+REPARACION_MAX_TOKENS = int(os.getenv("REPARACION_MAX_TOKENS", "250"))
+# Verificación local de la clave en Matemáticas (verificador_matematicas.py): si el valor calculado
+# del enunciado coincide con el de la explicación, corrige la letra cuando exactamente una opción
+# coincide y rechaza el ítem si ninguna o varias; sin ese respaldo el ítem pasa sin cambios
+VERIFICAR_MATEMATICAS = os.getenv("VERIFICAR_MATEMATICAS", "1") == "1"
+
+# Exposición por estudiante: conjunto de ítems vistos (filtro de Bloom rotativo, memoria acotada)
+EXPOSICION_CAPACIDAD = int(os.getenv("EXPOSICION_CAPACIDAD", "2000"))         # ítems por generación del filtro
+EXPOSICION_FP = float(os.getenv("EXPOSICION_FP", "0.01"))                    # tasa de falsos positivos objetivo
+EXPOSICION_TTL_S = float(os.getenv("EXPOSICION_TTL_S", str(30 * 24 * 3600)))  # se olvida al estudiante inactivo
+
+# Banco local de ítems generados (JSONL, una pregunta por línea). BANCO_PATH vacío = banco temporal.
+BANCO_PATH = os.getenv("BANCO_PATH", "banco_preguntas.jsonl")
+BANCO_GUARDAR = os.getenv("BANCO_GUARDAR", "1") == "1"
+# Filas nuevas que se acumulan en memoria antes de reescribir el índice <BANCO_PATH>.idx/
+# (la reescritura es O(filas del banco), ver IndiceBanco.actualizar, y corre en segundo plano;
+# las pendientes ya se muestrean)
+BANCO_INDICE_FLUSH = int(os.getenv("BANCO_INDICE_FLUSH", "2048"))
+# Puntaje mínimo (calidad_banco.py, 0–1) para servir un ítem desde el banco
+BANCO_CALIDAD_MIN = float(os.getenv("BANCO_CALIDAD_MIN", "0.5"))
+
+# Hilos para generar en paralelo (simulacros y trabajos que combinan varias celdas)
+GENERACION_WORKERS = int(os.getenv("GENERACION_WORKERS", "10"))
+
+# Planificador justo: colas por tenant (colegio) servidas con weighted fair queuing;
+# las peticiones interactivas (/icfes/generar) pasan antes que los packs.
+SCHED_ENABLED = os.getenv("SCHED_ENABLED", "1") == "1"
+SCHED_MAX_CONCURRENCIA = int(os.getenv("SCHED_MAX_CONCURRENCIA", "16"))  # llamadas simultáneas al proveedor
+SCHED_MAX_POR_TENANT = int(os.getenv("SCHED_MAX_POR_TENANT", "6"))
+SCHED_PESOS: Dict[str, float] = json.loads(os.getenv("SCHED_PESOS_JSON", "{}"))  # {"tenant": peso}, por defecto 1
+SCHED_HEADER_TENANT = os.getenv("SCHED_HEADER_TENANT", "X-Tenant-Id")
+
+# Coalescencia: peticiones idénticas que llegan mientras otra igual está en curso esperan su
+# resultado. En modo aleatorio (SEED_RANDOMIZE) el líder genera un lote del tamaño de la demanda
+# observada y cada seguidor recibe un ítem distinto; los sobrantes se guardan COALESCE_TTL_S.
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1") == "1"
+COALESCE_LOTE_MAX = int(os.getenv("COALESCE_LOTE_MAX", "8"))
+COALESCE_TTL_S = float(os.getenv("COALESCE_TTL_S", "120"))
+# Packs mixtos (/icfes/generar_mixto): ítems por llamada al pedir varios de la misma entrada
+MIXTO_LOTE_MAX = int(os.getenv("MIXTO_LOTE_MAX", "5"))
+# Control de admisión: peticiones generadoras en vuelo y espera del ítem más antiguo en la cola
+# del planificador. Sobre el límite suave se sirve desde el banco; sobre el duro, 503 + Retry-After.
+ADMISION_ENABLED = os.getenv("ADMISION_ENABLED", "1") == "1"
+ADMISION_SUAVE_EN_VUELO = int(os.getenv("ADMISION_SUAVE_EN_VUELO", "24"))
+ADMISION_DURO_EN_VUELO = int(os.getenv("ADMISION_DURO_EN_VUELO", "64"))
+ADMISION_SUAVE_ESPERA_MS = float(os.getenv("ADMISION_SUAVE_ESPERA_MS", "3000"))
+ADMISION_DURO_ESPERA_MS = float(os.getenv("ADMISION_DURO_ESPERA_MS", "15000"))
+ADMISION_RETRY_AFTER_S = int(os.getenv("ADMISION_RETRY_AFTER_S", "5"))
+
+# Estado compartido entre workers de uvicorn: "memoria" (un solo worker) o ruta de un archivo SQLite (WAL)
+ESTADO_COMPARTIDO = os.getenv("ESTADO_COMPARTIDO", "memoria")
+ESTADO_MEMORIA_MAX_CLAVES = int(os.getenv("ESTADO_MEMORIA_MAX_CLAVES", "20000"))
+# Rate limit hacia el proveedor, común a todos los workers (cubos de tokens). 0 = sin límite.
+LIMITE_RPM = float(os.getenv("LIMITE_RPM", "0"))
+LIMITE_TPM = float(os.getenv("LIMITE_TPM", "0"))
+
+# Corpus de respuestas del proveedor (corpus_respuestas.py): GRABAR_CORPUS graba cada llamada en un
+# JSONL gzip (secretos redactados); REPLAY_CORPUS responde desde un corpus sin red ni API key.
+GRABAR_CORPUS = os.getenv("GRABAR_CORPUS", "")
+REPLAY_CORPUS = os.getenv("REPLAY_CORPUS", "")
+
+if not REPLAY_CORPUS:
+    # Validación estricta de API Key
+    if not OPENAI_API_KEY or not OPENAI_API_KEY.strip():
+        raise ValueError("OPENAI_API_KEY es requerida y no puede estar vacía")
+
+    # Validación estricta del formato de API Key
+    if not OPENAI_API_KEY.startswith(("sk-", "sk-proj-")):
+        raise ValueError("OPENAI_API_KEY debe comenzar con 'sk-' o 'sk-proj-'")
 
 # Validación estricta del modelo
 MODELOS_VALIDOS = [
     "gpt-4o", "gpt-4o-mini", "gpt-4-turbo", "gpt-4", "gpt-3.5-turbo",
     "gpt-5-pro", "gpt-5", "o1-preview", "o1-mini", "o3-mini"
 ]
-if OPENAI_MODEL not in MODELOS_VALIDOS and not OPENAI_MODEL.startswith("gpt-"):
-    raise ValueError(f"Modelo '{OPENAI_MODEL}' no reconocido. Modelos válidos: {', '.join(MODELOS_VALIDOS)}")
+for _modelo in (OPENAI_MODEL, OPENAI_MODEL_RAPIDO, OPENAI_MODEL_FUERTE):
+    if _modelo not in MODELOS_VALIDOS and not _modelo.startswith("gpt-"):
+        raise ValueError(f"Modelo '{_modelo}' no reconocido. Modelos válidos: {', '.join(MODELOS_VALIDOS)}")
+
+# Niveles de modelo, de más rápido a más fuerte (orden de escalado)
+MODEL_TIERS: Dict[str, str] = {"rapido": OPENAI_MODEL_RAPIDO, "fuerte": OPENAI_MODEL_FUERTE}
+TIER_ORDEN = ["rapido", "fuerte"]
+
+# Precio aproximado en USD por millón de tokens (entrada, salida); se puede ajustar con PRECIOS_MODELO_JSON
+PRECIOS_MODELO: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+PRECIOS_MODELO.update({k: tuple(v) for k, v in json.loads(os.getenv("PRECIOS_MODELO_JSON", "{}")).items()})
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = ClienteReplay(REPLAY_CORPUS) if REPLAY_CORPUS else OpenAI(api_key=OPENAI_API_KEY)
+if GRABAR_CORPUS:
+    client = ClienteGrabador(client, abrir_grabador(GRABAR_CORPUS), origen="eduexce")
 
 app = FastAPI(
     title="EduExcel - Generador de Preguntas ICFES (Modo Rígido)",
@@ -246,6 +413,101 @@ def _dbg(msg: str):
     if DEBUG_JSON:
         print(str(msg)[:2000])
 
+# ===================== Métricas =====================
+_METRICAS_LOCK = threading.Lock()
+METRICAS: Dict[str, float] = {}
+
+def _metrica_inc(nombre: str, valor: float = 1) -> None:
+    """Incrementa un contador de métricas del proceso (thread-safe)."""
+    with _METRICAS_LOCK:
+        METRICAS[nombre] = METRICAS.get(nombre, 0) + valor
+
+def _percentil(valores: List[float], q: float) -> Optional[float]:
+    """Percentil por rango más cercano (q entre 0 y 1). None si no hay valores."""
+    if not valores:
+        return None
+    orden = sorted(valores)
+    idx = min(len(orden) - 1, max(0, int(round(q * (len(orden) - 1)))))
+    return orden[idx]
+
+def metricas_snapshot() -> dict:
+    """Copia consistente de las métricas, con tasas derivadas."""
+    with _METRICAS_LOCK:
+        contadores = dict(METRICAS)
+    llamadas = contadores.get("llamadas_openai", 0)
+    lanzados = contadores.get("hedge_lanzados", 0)
+    return {
+        "contadores": contadores,
+        "hedging": {
+            "habilitado": HEDGE_ENABLED,
+            "percentil": HEDGE_PERCENTIL,
+            "hedge_rate": round(lanzados / llamadas, 4) if llamadas else 0.0,
+            "ganados_por_respaldo": contadores.get("hedge_ganados", 0),
+            "tokens_extra": contadores.get("hedge_tokens_extra", 0),
+            "presupuesto_tokens": HEDGE_PRESUPUESTO_TOKENS,
+            "presupuesto_ventana_s": HEDGE_PRESUPUESTO_VENTANA_S,
+            "presupuesto_disponible": round(PRESUPUESTO_HEDGE.nivel()),
+            "umbrales_ms": LATENCIAS.umbrales(HEDGE_PERCENTIL),
+        },
+        "max_tokens": {
+            "adaptativo": MAX_TOKENS_ADAPTATIVO,
+            "percentil": MAX_TOKENS_PERCENTIL,
+            "truncaciones": contadores.get("truncaciones", 0),
+            "celdas": TOKENS_COMPLETION.snapshot(),
+        },
+        "planificador": dict(PLANIFICADOR.snapshot(), habilitado=SCHED_ENABLED),
+        "admision": dict(
+            ADMISION.snapshot(),
+            normales=contadores.get("admision_normales", 0),
+            degradadas=contadores.get("admision_degradadas", 0),
+            rechazadas=contadores.get("admision_rechazadas", 0),
+            servidas_banco=contadores.get("admision_servidas_banco", 0),
+        ),
+        "coalescencia": {
+            "habilitada": COALESCE_ENABLED,
+            "solicitudes": contadores.get("coalescencia_solicitudes", 0),
+            "compartidas": contadores.get("coalescencia_compartidas", 0),
+            "ratio": (
+                round(contadores.get("coalescencia_compartidas", 0) / contadores["coalescencia_solicitudes"], 4)
+                if contadores.get("coalescencia_solicitudes") else 0.0
+            ),
+        },
+        "exposicion": dict(EXPOSICION.snapshot(), descartes=contadores.get("exposicion_descartes", 0)),
+        "estado_compartido": ESTADO.snapshot(),
+        "verificacion_matematicas": dict(
+            habilitada=VERIFICAR_MATEMATICAS,
+            **{e: contadores.get(f"verificacion_{e}", 0)
+               for e in ("verificado", "corregido", "rechazado", "no_verificable")},
+        ),
+        "cupo_proveedor": {
+            "rpm": LIMITE_RPM,
+            "tpm": LIMITE_TPM,
+            "esperas": contadores.get("cupo_esperas", 0),
+            "espera_total_s": round(contadores.get("cupo_espera_s", 0), 3),
+        },
+        "cancelacion": {
+            "peticiones_desconectadas": contadores.get("cancelacion_peticiones", 0),
+            "llamadas_abortadas": contadores.get("cancelacion_llamadas_abortadas", 0),
+            "items_omitidos": contadores.get("cancelacion_items_omitidos", 0),
+            "tokens_ahorrados_estimados": contadores.get("cancelacion_tokens_ahorrados", 0),
+        },
+        "reparacion": {
+            "habilitada": REPARACION_ENABLED,
+            "intentadas": contadores.get("reparaciones_intentadas", 0),
+            "exitosas": contadores.get("reparaciones_exitosas", 0),
+            "tasa_exito": (
+                round(contadores.get("reparaciones_exitosas", 0) / contadores["reparaciones_intentadas"], 4)
+                if contadores.get("reparaciones_intentadas") else 0.0
+            ),
+            "tokens_usados": contadores.get("reparacion_tokens", 0),
+            "tokens_ahorrados": contadores.get("reparacion_tokens_ahorrados", 0),
+        },
+    }
+
+# ===================== Estado compartido entre workers =====================
+# Exposición, dedup del banco, sobrantes de la coalescencia y cubos de rate limit (estado_compartido.py)
+ESTADO = abrir_estado(ESTADO_COMPARTIDO, ESTADO_MEMORIA_MAX_CLAVES)
+
 # ===================== Catálogo de Áreas, Subtemas y Estilos =====================
 ALLOWED: Dict[str, List[str]] = {
     "sociales": [
@@ -348,6 +610,38 @@ SUBTEMA_GUIDE = {
     },
 }
 
+# Tabla de enrutamiento: nivel de modelo por área y subtema ("*" = resto de subtemas del área).
+# Por defecto todo va al nivel fuerte; las celdas que toleran el modelo rápido (p. ej. ítems cortos
+# de gramática) se activan con ROUTING_ENABLED=1 y MODEL_ROUTING_JSON, p. ej.
+# {"Inglés": {"*": "rapido"}, "Matemáticas": {"Operaciones con números enteros": "rapido"}}.
+MODEL_ROUTING: Dict[str, Dict[str, str]] = {
+    "Inglés": {"*": "fuerte"},
+    "Matemáticas": {"*": "fuerte"},
+    "Lenguaje": {"*": "fuerte"},
+    "sociales": {"*": "fuerte"},
+    "Ciencias Naturales": {"*": "fuerte"},
+}
+for _area, _rutas in json.loads(os.getenv("MODEL_ROUTING_JSON", "{}")).items():
+    MODEL_ROUTING.setdefault(_area, {}).update(_rutas)
+
+def nivel_modelo(area: str, subtema: str) -> str:
+    """Nivel de modelo ("rapido"/"fuerte") que corresponde a un área/subtema según MODEL_ROUTING."""
+    if not ROUTING_ENABLED:
+        return "fuerte"
+    rutas = MODEL_ROUTING.get(area, {})
+    nivel = rutas.get(subtema) or rutas.get("*") or "fuerte"
+    if nivel not in MODEL_TIERS:
+        raise ValueError(f"Nivel de modelo desconocido en MODEL_ROUTING: '{nivel}'")
+    return nivel
+
+def nivel_superior(nivel: str) -> Optional[str]:
+    """Siguiente nivel más fuerte con un modelo distinto, o None si ya es el más fuerte."""
+    i = TIER_ORDEN.index(nivel)
+    for siguiente in TIER_ORDEN[i + 1:]:
+        if MODEL_TIERS[siguiente] != MODEL_TIERS[nivel]:
+            return siguiente
+    return None
+
 # ===================== Utilidades de Normalización =====================
 def _norm(s: str) -> str:
     """Normaliza un string eliminando acentos y espacios extra."""
@@ -426,6 +720,7 @@ class GenInput(BaseModel):
     longitud_max: int = Field(350, ge=100, le=1000, description="Longitud máxima en palabras (ICFES: 200-350)")
     max_tokens_item: int = Field(600, ge=100, le=4000, description="Máximo de tokens por item")
     temperatura: float = Field(0.2, ge=0.0, le=2.0, description="Temperatura de generación (0-2)")
+    deadline_ms: Optional[int] = Field(None, ge=100, le=600_000, description="Tiempo máximo de la petición (ms); también cabecera X-Deadline-Ms")
     
     @classmethod
     def validate_longitud(cls, v, values):
@@ -466,6 +761,44 @@ class ItemOut(BaseModel):
         validate_assignment = True
         str_strip_whitespace = True
 
+class SimulacroInput(BaseModel):
+    """Parámetros para ensamblar un simulacro completo tipo Saber 11."""
+    cantidad_total: int = Field(50, ge=5, le=254, description="Total de preguntas (254 = examen completo)")
+    areas: Optional[List[str]] = Field(None, description="Áreas a incluir (por defecto las 5)")
+    estilo_kolb: Optional[str] = Field(None, max_length=20, description="Estilo de aprendizaje de Kolb")
+    id_estudiante: Optional[str] = Field(None, max_length=100, description="Omite ítems que el estudiante ya vio")
+    usar_banco: bool = Field(True, description="Tomar primero ítems del banco antes de generar")
+    longitud_min: int = Field(200, ge=50, le=500, description="Longitud mínima en palabras")
+    longitud_max: int = Field(350, ge=100, le=1000, description="Longitud máxima en palabras")
+    temperatura: float = Field(0.2, ge=0.0, le=2.0, description="Temperatura de generación (0-2)")
+    deadline_ms: Optional[int] = Field(None, ge=100, le=600_000, description="Tiempo máximo de la petición (ms); también cabecera X-Deadline-Ms")
+
+    class Config:
+        str_strip_whitespace = True
+
+class EntradaMixta(BaseModel):
+    """Una celda de un pack mixto."""
+    area: str = Field(..., min_length=3, max_length=50, description="Área de conocimiento")
+    subtema: str = Field(..., min_length=5, max_length=200, description="Subtema específico")
+    estilo_kolb: Optional[str] = Field(None, max_length=20, description="Estilo de aprendizaje de Kolb")
+    cantidad: int = Field(1, ge=1, le=100, description="Preguntas de esta entrada")
+
+    class Config:
+        str_strip_whitespace = True
+
+class MixtoInput(BaseModel):
+    """Pack con varias (área, subtema, estilo_kolb, cantidad); máximo 100 preguntas en total."""
+    entradas: List[EntradaMixta] = Field(..., min_length=1, max_length=25, description="Celdas del pack, en orden")
+    id_estudiante: Optional[str] = Field(None, max_length=100, description="Omite ítems que el estudiante ya vio")
+    usar_banco: bool = Field(True, description="Tomar primero ítems del banco antes de generar")
+    longitud_min: int = Field(200, ge=50, le=500, description="Longitud mínima en palabras")
+    longitud_max: int = Field(350, ge=100, le=1000, description="Longitud máxima en palabras")
+    temperatura: float = Field(0.2, ge=0.0, le=2.0, description="Temperatura de generación (0-2)")
+    deadline_ms: Optional[int] = Field(None, ge=100, le=600_000, description="Tiempo máximo de la petición (ms); también cabecera X-Deadline-Ms")
+
+    class Config:
+        str_strip_whitespace = True
+
 # ===================== Parser y Normalización de JSON =====================
 def ensure_schema(d: dict):
     """Valida estrictamente que el diccionario tenga la estructura correcta."""
@@ -529,6 +862,36 @@ def ensure_schema(d: dict):
         raise ValueError("'meta' debe ser un objeto/diccionario")
     d["meta"] = meta
 
+def diagnosticar_item(d: dict) -> List[str]:
+    """
+    Lista TODOS los problemas de esquema de un ítem (ensure_schema se detiene en el primero).
+    Cada entrada empieza por el campo afectado, p. ej. "opciones.C: faltante o vacía".
+    """
+    if not isinstance(d, dict):
+        return ["raiz: la salida no es un objeto JSON"]
+    errores = []
+    pregunta = d.get("pregunta")
+    if not isinstance(pregunta, str):
+        errores.append("pregunta: faltante o no es texto")
+    elif len(pregunta.strip()) < 10:
+        errores.append("pregunta: debe tener al menos 10 caracteres")
+    opciones = d.get("opciones")
+    if not isinstance(opciones, dict):
+        errores.append("opciones: debe ser un objeto con claves A, B, C y D")
+    else:
+        for k in ("A", "B", "C", "D"):
+            v = opciones.get(k)
+            if not isinstance(v, str) or not v.strip():
+                errores.append(f"opciones.{k}: faltante o vacía")
+        for k in sorted(set(opciones.keys()) - {"A", "B", "C", "D"}):
+            errores.append(f"opciones.{k}: clave no permitida (solo A, B, C, D)")
+    respuesta = str(d.get("respuesta_correcta") or "").strip().upper()
+    if respuesta not in ("A", "B", "C", "D"):
+        errores.append(f"respuesta_correcta: '{d.get('respuesta_correcta')}' no es A, B, C o D")
+    if d.get("explicacion") is not None and not isinstance(d.get("explicacion"), str):
+        errores.append("explicacion: debe ser texto")
+    return errores
+
 def parse_json_min(text: str) -> dict:
     """Parsea JSON desde el texto del modelo con validación estricta."""
     if not text or not isinstance(text, str):
@@ -755,6 +1118,9 @@ def build_explanation_per_area(area: str, correcta: str) -> str:
         ]
     return " ".join(base)
 
+# Explicaciones de plantilla (todas las áreas y letras): calidad_banco.py las penaliza
+PLANTILLAS_EXPLICACION = {build_explanation_per_area(a, L) for a in ALLOWED for L in "ABCD"}
+
 def fix_explanation_coherence(explicacion: str, correcta: str, area: str) -> str:
     """Asegura coherencia de la explicación y que esté en español para Inglés."""
     # Para área de Inglés, asegurar que la explicación esté en español
@@ -811,9 +1177,8 @@ def system_prompt(area: str = None) -> str:
     else:
         return base + " Reglas: Todo en ESPAÑOL (pregunta, opciones y explicación)."
 
-def user_prompt(cfg):
-    """Genera el prompt del usuario con la configuración específica."""
-    estilo = cfg.estilo_kolb or "Convergente"
+def _instrucciones_celda(cfg) -> str:
+    """Parte del prompt de usuario común a todos los modos: enfoque del subtema, notas por área y longitud."""
     guide = SUBTEMA_GUIDE.get(cfg.area, {}).get(cfg.subtema, "Incluye un mini-caso realista de 2–3 frases.")
     sociales_note = ""
     if "sociales" in _norm(cfg.area):
@@ -834,8 +1199,6 @@ def user_prompt(cfg):
         )
     
     return (
-        f"Genera UNA pregunta del área {cfg.area}, subtema EXACTO {cfg.subtema}. "
-        f"Estilo Kolb: {estilo}. "
         f"Usa este enfoque: {guide}{sociales_note}{mates_note}{ingles_note} "
         "Alinea la competencia, el componente temático y el nivel cognitivo con las especificaciones oficiales del examen Saber 11 del ICFES. "
         f"IMPORTANTE: La pregunta debe tener entre {cfg.longitud_min} y {cfg.longitud_max} palabras (longitud típica de ICFES). "
@@ -845,12 +1208,483 @@ def user_prompt(cfg):
         "Varía números, nombres y contexto; evita repetir patrones."
     )
 
+def user_prompt(cfg, cantidad: int = 1):
+    """Genera el prompt del usuario con la configuración específica (cantidad > 1: lote en 'items')."""
+    estilo = cfg.estilo_kolb or "Convergente"
+    if cantidad > 1:
+        encabezado = (
+            f"Genera {cantidad} preguntas DISTINTAS entre sí del área {cfg.area}, subtema EXACTO {cfg.subtema}, "
+            "en el formato {\"items\":[OBJ1,...,OBJN]}. "
+        )
+    else:
+        encabezado = f"Genera UNA pregunta del área {cfg.area}, subtema EXACTO {cfg.subtema}. "
+    return encabezado + f"Estilo Kolb: {estilo}. " + _instrucciones_celda(cfg)
+
+def user_prompt_kolb(cfg, estilos: List[str]) -> str:
+    """Una pregunta por estilo Kolb de la misma celda, en una sola respuesta y en el orden de `estilos`."""
+    variantes = " ".join(f"- {e}: {CARACTERISTICAS_ESTILO.get(e, '')}" for e in estilos)
+    return (
+        f"Genera {len(estilos)} preguntas DISTINTAS entre sí del área {cfg.area}, subtema EXACTO {cfg.subtema}, "
+        "una por cada estilo de aprendizaje Kolb, en el formato {\"items\":[OBJ1,...,OBJN]} y en este orden. "
+        "Cada objeto lleva en 'estilo_kolb' el nombre exacto de su estilo y debe seguir su enfoque: "
+        f"{variantes} " + _instrucciones_celda(cfg)
+    )
+
+# ===================== Planificación justa entre tenants =====================
+_TENANT: ContextVar[str] = ContextVar("tenant", default="anonimo")
+_PRIORIDAD: ContextVar[str] = ContextVar("prioridad", default="lote")  # "interactiva" | "lote"
+
+def tenant_de_request(request: Request) -> str:
+    """Tenant = cabecera SCHED_HEADER_TENANT o, si no viene, un resumen de la API key del cliente."""
+    tenant = request.headers.get(SCHED_HEADER_TENANT)
+    if tenant:
+        return tenant.strip()[:64]
+    api_key = request.headers.get("X-API-Key") or request.headers.get("Authorization")
+    if api_key:
+        return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+    return "anonimo"
+
+def middleware_asgi(fn):
+    """
+    Registra `fn(request, siguiente)` como middleware ASGI puro. A diferencia de
+    @app.middleware("http") (BaseHTTPMiddleware) no envuelve `receive`, así que
+    request.is_disconnected() sigue viendo cuándo el cliente cierra la conexión.
+    `await siguiente()` ejecuta el resto de la app; si `fn` devuelve una Response, se envía esa.
+    """
+    class _Middleware:
+        def __init__(self, app_asgi):
+            self.app = app_asgi
+
+        async def __call__(self, scope, receive, send):
+            if scope["type"] != "http":
+                return await self.app(scope, receive, send)
+
+            async def siguiente():
+                await self.app(scope, receive, send)
+
+            respuesta = await fn(Request(scope, receive), siguiente)
+            if respuesta is not None:
+                await respuesta(scope, receive, send)
+
+    app.add_middleware(_Middleware)
+    return fn
+
+@middleware_asgi
+async def _contexto_tenant(request: Request, siguiente):
+    token = _TENANT.set(tenant_de_request(request))
+    try:
+        await siguiente()
+    finally:
+        _TENANT.reset(token)
+
+def _enviar(pool: ThreadPoolExecutor, fn, *args):
+    """pool.submit conservando el contexto (tenant, prioridad, deadline) de la petición actual."""
+    return pool.submit(copy_context().run, fn, *args)
+
+def _en_hilo(fn, *args) -> Future:
+    """Como _enviar, pero en un hilo propio: la llamada arranca ya, sin esperar cola en un pool."""
+    fut: Future = Future()
+    ctx = copy_context()
+
+    def correr() -> None:
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            fut.set_result(ctx.run(fn, *args))
+        except BaseException as e:
+            fut.set_exception(e)
+
+    threading.Thread(target=correr, daemon=True, name="hedge-principal").start()
+    return fut
+
+# ===================== Deadlines por petición =====================
+# Instante (time.monotonic) en que la petición deja de interesar al cliente; None = sin límite.
+_DEADLINE: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+class DeadlineExcedido(Exception):
+    """Se agotó el deadline_ms de la petición; no tiene sentido seguir llamando al proveedor."""
+
+def fijar_deadline(ms: Optional[int]) -> None:
+    """Fija (o acorta) el deadline de la petición actual a `ms` milisegundos desde ahora."""
+    if not ms:
+        return
+    limite = time.monotonic() + ms / 1000.0
+    actual = _DEADLINE.get()
+    _DEADLINE.set(limite if actual is None else min(actual, limite))
+
+def tiempo_restante_s() -> Optional[float]:
+    limite = _DEADLINE.get()
+    return None if limite is None else limite - time.monotonic()
+
+def timeout_llamada() -> dict:
+    """
+    {"timeout": s} para la próxima llamada al proveedor ({} sin deadline: se respeta el timeout
+    por defecto del SDK). DeadlineExcedido si ya no queda tiempo.
+    """
+    restante = tiempo_restante_s()
+    if restante is None:
+        return {}
+    if restante <= 0:
+        _metrica_inc("deadline_excedidos")
+        raise DeadlineExcedido("Deadline de la petición excedido")
+    return {"timeout": restante}
+
+@middleware_asgi
+async def _contexto_deadline(request: Request, siguiente):
+    token = _DEADLINE.set(None)
+    try:
+        cabecera = request.headers.get("X-Deadline-Ms")
+        if cabecera and cabecera.strip().isdigit():
+            fijar_deadline(int(cabecera))
+        await siguiente()
+    finally:
+        _DEADLINE.reset(token)
+
+# ===================== Cancelación por desconexión del cliente =====================
+# Evento de la petición actual: se activa si el cliente cierra la conexión (None = no cancelable)
+_CANCELACION: ContextVar[Optional[threading.Event]] = ContextVar("cancelacion", default=None)
+_DESCONEXION_POLL_S = 0.25
+
+def peticion_cancelada() -> bool:
+    evento = _CANCELACION.get()
+    return evento is not None and evento.is_set()
+
+async def ejecutar_cancelable(request: Request, fn, *args):
+    """
+    Ejecuta `fn` (síncrona) en el threadpool mientras se vigila request.is_disconnected().
+    Si el cliente se va, se activa el evento de cancelación: las llamadas en streaming se
+    cierran y no se lanzan más; se espera a que `fn` termine para que guarde lo ya pagado.
+    """
+    evento = threading.Event()
+    token = _CANCELACION.set(evento)
+    try:
+        tarea = asyncio.ensure_future(run_in_threadpool(copy_context().run, fn, *args))
+        while not tarea.done():
+            await asyncio.wait({tarea}, timeout=_DESCONEXION_POLL_S)
+            if not tarea.done() and await request.is_disconnected():
+                evento.set()
+                _metrica_inc("cancelacion_peticiones")
+                _dbg(f"CANCEL>> cliente desconectado en {request.url.path}; cancelando generación")
+                break
+        return await tarea
+    finally:
+        _CANCELACION.reset(token)
+
+def _contar_cancelados(cfg: 'GenInput', omitidos: int) -> None:
+    """Métricas de trabajo no realizado: ítems omitidos y tokens estimados que no se pagaron."""
+    if omitidos <= 0:
+        return
+    _metrica_inc("cancelacion_items_omitidos", omitidos)
+    _metrica_inc("cancelacion_tokens_ahorrados", estimar_generacion(cfg, omitidos)["pack"]["total_tokens"])
+
+class _Turno:
+    __slots__ = ("tenant", "prioridad", "etiqueta", "seq", "t_encolado")
+
+    def __init__(self, tenant: str, prioridad: str, etiqueta: float, seq: int):
+        self.tenant, self.prioridad, self.etiqueta, self.seq = tenant, prioridad, etiqueta, seq
+        self.t_encolado = time.perf_counter()
+
+class PlanificadorJusto:
+    """
+    Start-time fair queuing por tenant: cada turno recibe la etiqueta max(V, última del tenant)
+    y el tenant avanza 1/peso; se atiende la etiqueta menor entre los tenants bajo su límite de
+    concurrencia. La prioridad "interactiva" siempre va antes que "lote".
+    """
+    def __init__(self, max_concurrencia: int, max_por_tenant: int, pesos: Dict[str, float]):
+        self.max_concurrencia, self.max_por_tenant, self.pesos = max_concurrencia, max_por_tenant, pesos
+        self._cond = threading.Condition()
+        self._pendientes: List[_Turno] = []
+        self._ultima: Dict[str, float] = {}
+        self._en_curso: Dict[str, int] = {}
+        self._servidos: Dict[str, int] = {}
+        self._espera_ms: Dict[str, float] = {}
+        self._v = 0.0
+        self._seq = 0
+
+    def _siguiente(self) -> Optional[_Turno]:
+        if sum(self._en_curso.values()) >= self.max_concurrencia:
+            return None
+        elegibles = [t for t in self._pendientes if self._en_curso.get(t.tenant, 0) < self.max_por_tenant]
+        if not elegibles:
+            return None
+        return min(elegibles, key=lambda t: (t.prioridad != "interactiva", t.etiqueta, t.seq))
+
+    def adquirir(self, tenant: str, prioridad: str, limite: Optional[float] = None) -> _Turno:
+        """Espera turno; con `limite` (time.monotonic) abandona la cola y lanza DeadlineExcedido."""
+        with self._cond:
+            self._seq += 1
+            inicio = max(self._v, self._ultima.get(tenant, 0.0))
+            self._ultima[tenant] = inicio + 1.0 / float(self.pesos.get(tenant, 1.0))
+            turno = _Turno(tenant, prioridad, inicio, self._seq)
+            self._pendientes.append(turno)
+            while self._siguiente() is not turno:
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    self._pendientes.remove(turno)
+                    self._cond.notify_all()
+                    _metrica_inc("deadline_excedidos")
+                    raise DeadlineExcedido("Deadline excedido esperando turno en el planificador")
+                self._cond.wait(timeout=restante)
+            self._pendientes.remove(turno)
+            self._v = turno.etiqueta
+            self._en_curso[tenant] = self._en_curso.get(tenant, 0) + 1
+            self._servidos[tenant] = self._servidos.get(tenant, 0) + 1
+            self._espera_ms[tenant] = self._espera_ms.get(tenant, 0.0) + (time.perf_counter() - turno.t_encolado) * 1000
+            self._cond.notify_all()
+        return turno
+
+    def liberar(self, turno: _Turno) -> None:
+        with self._cond:
+            self._en_curso[turno.tenant] -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def turno(self, tenant: str, prioridad: str, limite: Optional[float] = None):
+        t = self.adquirir(tenant, prioridad, limite)
+        try:
+            yield t
+        finally:
+            self.liberar(t)
+
+    def espera_actual_ms(self) -> float:
+        """Antigüedad del turno más viejo aún en cola (0 si no hay cola)."""
+        with self._cond:
+            if not self._pendientes:
+                return 0.0
+            return (time.perf_counter() - min(t.t_encolado for t in self._pendientes)) * 1000
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            tenants = set(self._en_curso) | {t.tenant for t in self._pendientes}
+            return {
+                "max_concurrencia": self.max_concurrencia,
+                "max_por_tenant": self.max_por_tenant,
+                "en_curso": sum(self._en_curso.values()),
+                "en_cola": len(self._pendientes),
+                "tenants": {
+                    t: {
+                        "en_cola": sum(1 for p in self._pendientes if p.tenant == t),
+                        "en_cola_interactiva": sum(1 for p in self._pendientes if p.tenant == t and p.prioridad == "interactiva"),
+                        "en_curso": self._en_curso.get(t, 0),
+                        "servidos": self._servidos.get(t, 0),
+                        "espera_promedio_ms": round(self._espera_ms.get(t, 0.0) / self._servidos[t], 1) if self._servidos.get(t) else 0.0,
+                        "peso": float(self.pesos.get(t, 1.0)),
+                    }
+                    for t in sorted(tenants)
+                },
+            }
+
+PLANIFICADOR = PlanificadorJusto(SCHED_MAX_CONCURRENCIA, SCHED_MAX_POR_TENANT, SCHED_PESOS)
+
+def esperar_cupo_proveedor(kwargs: dict) -> None:
+    """
+    Rate limit común a todos los workers: toma 1 petición (LIMITE_RPM) y los tokens estimados
+    de la llamada (prompt + max_tokens, LIMITE_TPM) de los cubos de ESTADO; si no alcanzan, espera.
+    Se llama antes del planificador para no ocupar un turno mientras tanto.
+    """
+    if not (LIMITE_RPM or LIMITE_TPM):
+        return
+    pedidos = []
+    if LIMITE_RPM:
+        pedidos.append(("cupo:rpm", 1, LIMITE_RPM, LIMITE_RPM / 60))
+    if LIMITE_TPM:
+        tokens = estimar_tokens_mensajes(kwargs["messages"]) + int(kwargs.get("max_tokens", 0))
+        pedidos.append(("cupo:tpm", tokens, LIMITE_TPM, LIMITE_TPM / 60))
+    while True:
+        espera = ESTADO.tomar(pedidos)
+        if espera <= 0:
+            return
+        restante = tiempo_restante_s()
+        if restante is not None and espera >= restante:
+            _metrica_inc("deadline_excedidos")
+            raise DeadlineExcedido("El rate limit del proveedor no deja cupo antes del deadline")
+        if peticion_cancelada():
+            raise GeneracionCancelada("Generación cancelada esperando cupo del proveedor")
+        _metrica_inc("cupo_esperas")
+        _metrica_inc("cupo_espera_s", min(espera, 1.0))
+        time.sleep(min(espera, 1.0))
+
+def _llamar_proveedor(kwargs: dict):
+    """
+    Llamada (sin streaming) al proveedor; pasa por el rate limit compartido y por el planificador
+    si está activo. Con deadline, el tiempo restante se usa como timeout de la espera y de la llamada.
+    """
+    esperar_cupo_proveedor(kwargs)
+    if not SCHED_ENABLED:
+        return client.chat.completions.create(**kwargs, **timeout_llamada())
+    timeout_llamada()
+    with PLANIFICADOR.turno(_TENANT.get(), _PRIORIDAD.get(), _DEADLINE.get()):
+        return client.chat.completions.create(**kwargs, **timeout_llamada())
+
+# ===================== Control de admisión =====================
+# Rutas que terminan en llamadas al proveedor (las demás nunca se rechazan)
+RUTAS_GENERADORAS = {"/icfes/generar", "/icfes/generar_pack", "/icfes/simulacro", "/icfes/generar_kolb",
+                     "/icfes/generar_mixto", "/debug/raw"}
+_DEGRADADO: ContextVar[bool] = ContextVar("degradado", default=False)
+
+class ControlAdmision:
+    """
+    Decide por petición: "normal", "degradado" (límite suave: servir desde el banco si se puede)
+    o "rechazo" (límite duro: 503). La espera se mide en vivo (turno más viejo en cola), así que
+    el estado se recupera solo en cuanto la cola se vacía.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.en_vuelo = 0
+
+    def estado(self) -> Tuple[str, float]:
+        espera = PLANIFICADOR.espera_actual_ms() if SCHED_ENABLED else 0.0
+        if self.en_vuelo >= ADMISION_DURO_EN_VUELO or espera >= ADMISION_DURO_ESPERA_MS:
+            return "rechazo", espera
+        if self.en_vuelo >= ADMISION_SUAVE_EN_VUELO or espera >= ADMISION_SUAVE_ESPERA_MS:
+            return "degradado", espera
+        return "normal", espera
+
+    def retry_after_s(self, espera_ms: float) -> int:
+        return max(ADMISION_RETRY_AFTER_S, int(math.ceil(espera_ms / 1000)))
+
+    @contextmanager
+    def admitida(self):
+        with self._lock:
+            self.en_vuelo += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.en_vuelo -= 1
+
+    def snapshot(self) -> dict:
+        estado, espera = self.estado()
+        return {
+            "habilitado": ADMISION_ENABLED,
+            "estado": estado,
+            "en_vuelo": self.en_vuelo,
+            "espera_cola_ms": round(espera, 1),
+            "limites": {
+                "suave_en_vuelo": ADMISION_SUAVE_EN_VUELO, "duro_en_vuelo": ADMISION_DURO_EN_VUELO,
+                "suave_espera_ms": ADMISION_SUAVE_ESPERA_MS, "duro_espera_ms": ADMISION_DURO_ESPERA_MS,
+            },
+        }
+
+ADMISION = ControlAdmision()
+
+@middleware_asgi
+async def _control_admision(request: Request, siguiente):
+    if not ADMISION_ENABLED or request.url.path not in RUTAS_GENERADORAS:
+        return await siguiente()
+    estado, espera = ADMISION.estado()
+    if estado == "rechazo":
+        _metrica_inc("admision_rechazadas")
+        segundos = ADMISION.retry_after_s(espera)
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(segundos)},
+            content={"ok": False, "generadas": 0, "resultados": [],
+                     "errores": [{"index": 0, "aviso": f"Servicio saturado; reintenta en {segundos} s"}]},
+        )
+    _metrica_inc("admision_degradadas" if estado == "degradado" else "admision_normales")
+    token = _DEGRADADO.set(estado == "degradado")
+    try:
+        with ADMISION.admitida():
+            await siguiente()
+    finally:
+        _DEGRADADO.reset(token)
+
+def _desde_banco_degradado(cfg: 'GenInput', n: int, exposicion: Optional['_BloomRotativo'] = None) -> List[dict]:
+    """Bajo el límite suave: hasta n ítems del banco para la celda (marcados meta.degradado)."""
+    if not _DEGRADADO.get():
+        return []
+    items = BANCO.muestrear(cfg.area, cfg.subtema, cfg.estilo_kolb or "Convergente", n, exposicion)
+    for it in items:
+        it["meta"]["degradado"] = True
+    _metrica_inc("admision_servidas_banco", len(items))
+    return items
+
 # ===================== Integración con OpenAI =====================
-def chat_openai(messages: List[dict], max_tokens: int, temperature: float) -> Tuple[str, Dict[str, int]]:
+class GeneracionCancelada(Exception):
+    """La llamada al modelo se abortó antes de terminar (p. ej. perdió frente a su respaldo)."""
+    def __init__(self, mensaje: str, tokens_estimados: int = 0):
+        super().__init__(mensaje)
+        self.tokens_estimados = tokens_estimados
+
+def _consumir_stream(kwargs: dict, cancelar: threading.Event) -> Tuple[str, Dict[str, int]]:
+    """
+    Ejecuta la llamada en modo streaming para poder abortarla: si `cancelar` se activa,
+    se cierra la conexión y el proveedor deja de generar (y de facturar) tokens.
+    """
+    if cancelar.is_set() or peticion_cancelada():
+        raise GeneracionCancelada("Generación cancelada antes de iniciar")
+    partes: List[str] = []
+    usage = None
+    finish_reason = None
+    timeout_llamada()
+    esperar_cupo_proveedor(kwargs)
+    turno = PLANIFICADOR.adquirir(_TENANT.get(), _PRIORIDAD.get(), _DEADLINE.get()) if SCHED_ENABLED else None
+    try:
+        stream = client.chat.completions.create(**kwargs, stream=True, stream_options={"include_usage": True},
+                                                **timeout_llamada())
+    except Exception:
+        if turno is not None:
+            PLANIFICADOR.liberar(turno)
+        raise
+    try:
+        for chunk in stream:
+            if cancelar.is_set() or peticion_cancelada():
+                if peticion_cancelada():
+                    _metrica_inc("cancelacion_llamadas_abortadas")
+                raise GeneracionCancelada(
+                    "Generación cancelada", tokens_estimados=len("".join(partes)) // 4
+                )
+            timeout_llamada()  # el timeout del SDK es por lectura; el deadline es total
+            if chunk.choices:
+                delta = chunk.choices[0].delta
+                if delta is not None and delta.content:
+                    partes.append(delta.content)
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+    finally:
+        stream.close()
+        if turno is not None:
+            PLANIFICADOR.liberar(turno)
+    usage_info = {
+        "prompt_tokens": usage.prompt_tokens if usage else 0,
+        "completion_tokens": usage.completion_tokens if usage else 0,
+        "total_tokens": usage.total_tokens if usage else 0,
+        "finish_reason": finish_reason
+    }
+    return "".join(partes), usage_info
+
+def kwargs_chat(messages: List[dict], max_tokens: int, temperature: float,
+                modelo: str, seed_val: int = 42) -> dict:
+    """Parámetros de chat.completions.create (también se usan para el archivo de la Batch API)."""
+    # Configuración para modelos que soportan JSON mode
+    kwargs = {
+        "model": modelo,
+        "messages": messages,
+        "temperature": float(temperature),
+        "max_tokens": int(max_tokens),
+    }
+    
+    # Algunos modelos (como o1-preview) no soportan response_format
+    # GPT-5 PRO y modelos recientes deberían soportarlo
+    if modelo not in ["o1-preview", "o1-mini", "o3-mini"]:
+        kwargs["response_format"] = {"type": "json_object"}
+    
+    # Seed solo para modelos que lo soportan (si no randomizamos)
+    if modelo not in ["o1-preview", "o1-mini", "o3-mini"] and not SEED_RANDOMIZE:
+        kwargs["seed"] = seed_val
+    return kwargs
+
+def chat_openai(messages: List[dict], max_tokens: int, temperature: float,
+                cancelar: Optional[threading.Event] = None,
+                modelo: Optional[str] = None) -> Tuple[str, Dict[str, int]]:
     """
     Llama a la API de OpenAI Chat Completions con validación estricta.
     messages: [{'role':'system'|'user'|'assistant', 'content':'...'}, ...]
-    Devuelve una tupla: (contenido JSON como string, información de uso de tokens)
+    cancelar: si se pasa, la llamada se hace en streaming y se aborta al activarse el evento.
+    modelo: modelo a usar (por defecto OPENAI_MODEL); ver MODEL_ROUTING.
+    Devuelve una tupla: (contenido JSON como string, información de uso de tokens y finish_reason)
     """
     # Validación estricta de parámetros
     if not isinstance(messages, list) or len(messages) == 0:
@@ -870,27 +1704,23 @@ def chat_openai(messages: List[dict], max_tokens: int, temperature: float) -> Tu
     if not isinstance(temperature, (int, float)) or temperature < 0 or temperature > 2:
         raise ValueError(f"temperature debe estar entre 0 y 2. Recibido: {temperature}")
     
+    modelo = modelo or OPENAI_MODEL
     seed_val = random.randint(1, 10_000_000) if SEED_RANDOMIZE else 42
+    if cancelar is None and _CANCELACION.get() is not None:
+        # Petición cancelable: streaming para poder cortar la llamada si el cliente se desconecta
+        cancelar = _CANCELACION.get()
     
     try:
-        # Configuración para modelos que soportan JSON mode
-        kwargs = {
-            "model": OPENAI_MODEL,
-            "messages": messages,
-            "temperature": float(temperature),
-            "max_tokens": int(max_tokens),
-        }
-        
-        # Algunos modelos (como o1-preview) no soportan response_format
-        # GPT-5 PRO y modelos recientes deberían soportarlo
-        if OPENAI_MODEL not in ["o1-preview", "o1-mini", "o3-mini"]:
-            kwargs["response_format"] = {"type": "json_object"}
+        kwargs = kwargs_chat(messages, max_tokens, temperature, modelo, seed_val)
         
-        # Seed solo para modelos que lo soportan (si no randomizamos)
-        if OPENAI_MODEL not in ["o1-preview", "o1-mini", "o3-mini"] and not SEED_RANDOMIZE:
-            kwargs["seed"] = seed_val
+        if cancelar is not None:
+            content, usage_info = _consumir_stream(kwargs, cancelar)
+            if not content.strip():
+                raise ValueError("Contenido de respuesta está vacío")
+            _dbg(f"RAW(JSON/stream)>> modelo={modelo} seed={seed_val} tokens={usage_info['total_tokens']} :: " + content[:1000])
+            return content.strip(), usage_info
         
-        response = client.chat.completions.create(**kwargs)
+        response = _llamar_proveedor(kwargs)
         
         if not response or not response.choices:
             raise ValueError("Respuesta vacía de OpenAI API")
@@ -910,17 +1740,166 @@ def chat_openai(messages: List[dict], max_tokens: int, temperature: float) -> Tu
         usage_info = {
             "prompt_tokens": response.usage.prompt_tokens if response.usage else 0,
             "completion_tokens": response.usage.completion_tokens if response.usage else 0,
-            "total_tokens": response.usage.total_tokens if response.usage else 0
+            "total_tokens": response.usage.total_tokens if response.usage else 0,
+            "finish_reason": response.choices[0].finish_reason
         }
         
-        _dbg(f"RAW(JSON)>> modelo={OPENAI_MODEL} seed={seed_val} tokens={usage_info['total_tokens']} :: " + content[:1000])
+        _dbg(f"RAW(JSON)>> modelo={modelo} seed={seed_val} tokens={usage_info['total_tokens']} :: " + content[:1000])
         return content.strip(), usage_info
         
+    except (GeneracionCancelada, DeadlineExcedido):
+        raise
     except Exception as e:
-        error_msg = f"Error en OpenAI API (modelo: {OPENAI_MODEL}): {str(e)}"
+        restante = tiempo_restante_s()
+        if restante is not None and restante <= 0:
+            _metrica_inc("deadline_excedidos")
+            raise DeadlineExcedido(f"Deadline excedido durante la llamada a {modelo}") from e
+        error_msg = f"Error en OpenAI API (modelo: {modelo}): {str(e)}"
         _dbg(error_msg)
         raise Exception(error_msg)
 
+# ===================== Hedging (latencia de cola) =====================
+class _VentanaLatencias:
+    """Ventana deslizante de latencias (ms) por clave; sirve para calcular umbrales adaptativos."""
+    def __init__(self, tamano: int = 200):
+        self._tamano = tamano
+        self._datos: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, clave: str, ms: float) -> None:
+        with self._lock:
+            self._datos.setdefault(clave, deque(maxlen=self._tamano)).append(ms)
+
+    def percentil(self, clave: str, q: float) -> Optional[float]:
+        """Percentil q de la clave, o None si aún no hay HEDGE_MIN_MUESTRAS observaciones."""
+        with self._lock:
+            valores = list(self._datos.get(clave, ()))
+        if len(valores) < HEDGE_MIN_MUESTRAS:
+            return None
+        return _percentil(valores, q)
+
+    def umbrales(self, q: float) -> Dict[str, Optional[float]]:
+        with self._lock:
+            claves = list(self._datos.keys())
+        return {c: self.percentil(c, q) for c in claves}
+
+LATENCIAS = _VentanaLatencias()
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+class _CuboTokens:
+    """
+    Cubo de tokens: hasta `capacidad`, se rellena a capacidad / ventana_s por segundo. El cobro
+    llega cuando termina la petición perdedora, así que el nivel puede quedar negativo (deuda).
+    """
+    def __init__(self, capacidad: int, ventana_s: float):
+        self.capacidad = float(capacidad)
+        self.tasa = self.capacidad / max(ventana_s, 1e-3)
+        self._nivel = self.capacidad
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _rellenar(self) -> None:
+        ahora = time.monotonic()
+        self._nivel = min(self.capacidad, self._nivel + (ahora - self._t) * self.tasa)
+        self._t = ahora
+
+    def nivel(self) -> float:
+        with self._lock:
+            self._rellenar()
+            return self._nivel
+
+    def disponible(self) -> bool:
+        return self.nivel() > 0
+
+    def cobrar(self, tokens: int) -> None:
+        with self._lock:
+            self._rellenar()
+            self._nivel -= tokens
+
+PRESUPUESTO_HEDGE = _CuboTokens(HEDGE_PRESUPUESTO_TOKENS, HEDGE_PRESUPUESTO_VENTANA_S)
+
+def _cobrar_hedge(gastados: int) -> None:
+    _metrica_inc("hedge_tokens_extra", gastados)
+    PRESUPUESTO_HEDGE.cobrar(gastados)
+
+def _cobrar_perdedor(fut, prompt_tokens: int) -> None:
+    """Suma al gasto de hedging los tokens consumidos por la petición que perdió la carrera."""
+    try:
+        _, usage = fut.result()
+        gastados = usage["total_tokens"]
+    except GeneracionCancelada as e:
+        gastados = prompt_tokens + e.tokens_estimados
+    except Exception:
+        gastados = prompt_tokens
+    _cobrar_hedge(gastados)
+
+def chat_openai_hedged(messages: List[dict], max_tokens: int, temperature: float,
+                       clave: str, modelo: Optional[str] = None) -> Tuple[str, Dict[str, int]]:
+    """
+    Igual que chat_openai, pero si HEDGE_ENABLED y la llamada supera el percentil de latencia
+    de `clave` (área y modelo), lanza una petición de respaldo y devuelve la primera que
+    responda bien; la otra se cancela. El gasto extra queda limitado por el cubo PRESUPUESTO_HEDGE.
+    La principal corre en un hilo propio (la cola del pool no cuenta como su latencia) y quien
+    llama espera a las dos con wait(FIRST_COMPLETED): si gana el respaldo se devuelve al
+    instante, aunque la principal siga bloqueada antes de su primer token. La perdedora se
+    cancela y termina en segundo plano; sus tokens se cobran al presupuesto al terminar.
+    """
+    _metrica_inc("llamadas_openai")
+    umbral_ms = LATENCIAS.percentil(clave, HEDGE_PERCENTIL) if HEDGE_ENABLED else None
+    t0 = time.perf_counter()
+
+    if umbral_ms is None or not PRESUPUESTO_HEDGE.disponible():
+        raw, usage = chat_openai(messages, max_tokens=max_tokens, temperature=temperature, modelo=modelo)
+        LATENCIAS.registrar(clave, (time.perf_counter() - t0) * 1000)
+        return raw, usage
+
+    cancelar_a, cancelar_b = threading.Event(), threading.Event()
+    fut_a = _en_hilo(chat_openai, messages, max_tokens, temperature, cancelar_a, modelo)
+    try:
+        wait([fut_a], timeout=umbral_ms / 1000.0)
+        if fut_a.done() or not PRESUPUESTO_HEDGE.disponible():
+            raw, usage = fut_a.result()
+            LATENCIAS.registrar(clave, (time.perf_counter() - t0) * 1000)
+            return raw, usage
+    except BaseException:
+        cancelar_a.set()  # error propio de la principal o interrupción de quien llama
+        raise
+
+    _metrica_inc("hedge_lanzados")
+    _dbg(f"HEDGE>> clave={clave} umbral={umbral_ms:.0f}ms, lanzando petición de respaldo")
+    fut_b = _enviar(_HEDGE_POOL, chat_openai, messages, max_tokens, temperature, cancelar_b, modelo)
+    pendientes = {fut_a, fut_b}
+    ganador: Optional[Future] = None
+    error: Optional[BaseException] = None
+    try:
+        while ganador is None:
+            if not pendientes:
+                raise error  # las dos fallaron: se propaga el primer error
+            listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for fut in (f for f in (fut_a, fut_b) if f in listos):
+                e = fut.exception()
+                if e is None:
+                    ganador = fut
+                    break
+                if fut is fut_a and isinstance(e, (GeneracionCancelada, DeadlineExcedido)):
+                    raise e  # cliente desconectado o deadline agotado: el respaldo tampoco sirve
+                error = error or e  # la principal falló: se sigue esperando al respaldo
+    except BaseException:
+        cancelar_a.set()
+        cancelar_b.set()
+        raise
+
+    raw, usage = ganador.result()
+    perdedor, cancelar_perdedor = (fut_b, cancelar_b) if ganador is fut_a else (fut_a, cancelar_a)
+    if not perdedor.done() or perdedor.exception() is None:
+        # Sigue en curso (o terminó bien): se corta y sus tokens cuentan como gasto de hedging
+        cancelar_perdedor.set()
+        perdedor.add_done_callback(lambda f, pt=usage["prompt_tokens"]: _cobrar_perdedor(f, pt))
+    if ganador is fut_b:
+        _metrica_inc("hedge_ganados")
+    LATENCIAS.registrar(clave, (time.perf_counter() - t0) * 1000)
+    return raw, usage
+
 # ===================== Validación de Entrada =====================
 def validar_input(cfg: 'GenInput') -> Tuple['GenInput', List[str]]:
     """Valida y normaliza todos los parámetros de entrada con validación estricta."""
@@ -968,49 +1947,516 @@ def validar_input(cfg: 'GenInput') -> Tuple['GenInput', List[str]]:
     if errores:
         return cfg, errores
     
-    # Crear configuración validada
-    cfg2 = GenInput(
-        area=area_ok,
-        subtema=sub_ok,
-        estilo_kolb=kolb_ok,
-        longitud_min=cfg.longitud_min,
-        longitud_max=cfg.longitud_max,
-        max_tokens_item=cfg.max_tokens_item,
-        temperatura=cfg.temperatura,
-    )
+    # Crear configuración validada (model_copy conserva qué campos fijó el cliente,
+    # p. ej. para no sobrescribir un max_tokens_item explícito con el adaptativo)
+    cfg2 = cfg.model_copy(update={"area": area_ok, "subtema": sub_ok, "estilo_kolb": kolb_ok})
     return cfg2, []
 
+# ===================== Estadísticas por ruta de modelo =====================
+class _EstadisticasRutas:
+    """Latencia, costo y fallos de esquema por (área, subtema, modelo) para ajustar MODEL_ROUTING."""
+    def __init__(self, ventana: int = 200):
+        self._ventana = ventana
+        self._datos: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, area: str, subtema: str, modelo: str, ms: float,
+                  usage: Dict[str, int], ok: bool) -> None:
+        entrada, salida = PRECIOS_MODELO.get(modelo, (0.0, 0.0))
+        costo = (usage.get("prompt_tokens", 0) * entrada + usage.get("completion_tokens", 0) * salida) / 1_000_000
+        with self._lock:
+            r = self._datos.setdefault(f"{area}|{subtema}|{modelo}", {
+                "area": area, "subtema": subtema, "modelo": modelo,
+                "llamadas": 0, "fallos_esquema": 0, "costo_usd": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0,
+                "latencias": deque(maxlen=self._ventana),
+            })
+            r["llamadas"] += 1
+            r["fallos_esquema"] += 0 if ok else 1
+            r["costo_usd"] += costo
+            r["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            r["completion_tokens"] += usage.get("completion_tokens", 0)
+            r["latencias"].append(ms)
+
+    def latencias(self, area: str, subtema: str, modelo: str) -> List[float]:
+        with self._lock:
+            r = self._datos.get(f"{area}|{subtema}|{modelo}")
+            return list(r["latencias"]) if r else []
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            copias = [dict(r, latencias=list(r["latencias"])) for r in self._datos.values()]
+        out = []
+        for r in copias:
+            lat = r.pop("latencias")
+            n = r["llamadas"]
+            r["tasa_fallo"] = round(r["fallos_esquema"] / n, 4) if n else 0.0
+            r["costo_promedio_usd"] = round(r["costo_usd"] / n, 6) if n else 0.0
+            r["costo_usd"] = round(r["costo_usd"], 6)
+            r["latencia_p50_ms"] = _percentil(lat, 0.5)
+            r["latencia_p90_ms"] = _percentil(lat, 0.9)
+            out.append(r)
+        return out
+
+RUTAS = _EstadisticasRutas()
+
+# ===================== max_tokens adaptativo =====================
+class _DistribucionTokens:
+    """completion_tokens observados y truncaciones por (área, subtema, longitud_min, longitud_max)."""
+    def __init__(self, ventana: int = 200):
+        self._ventana = ventana
+        self._datos: Dict[Tuple[str, str, int, int], deque] = {}
+        self._truncaciones: Dict[Tuple[str, str, int, int], int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clave(cfg: 'GenInput') -> Tuple[str, str, int, int]:
+        return (cfg.area, cfg.subtema, cfg.longitud_min, cfg.longitud_max)
+
+    def registrar(self, cfg: 'GenInput', completion_tokens: int, truncado: bool) -> None:
+        """Con `truncado`, completion_tokens es el tope alcanzado y se registra escalado."""
+        k = self.clave(cfg)
+        if truncado:
+            completion_tokens = int(completion_tokens * MAX_TOKENS_FACTOR_TRUNCADO)
+        with self._lock:
+            self._datos.setdefault(k, deque(maxlen=self._ventana)).append(completion_tokens)
+            if truncado:
+                self._truncaciones[k] = self._truncaciones.get(k, 0) + 1
+
+    def percentil(self, cfg: 'GenInput', q: float) -> Optional[float]:
+        with self._lock:
+            valores = list(self._datos.get(self.clave(cfg), ()))
+        if len(valores) < MAX_TOKENS_MIN_MUESTRAS:
+            return None
+        return _percentil(valores, q)
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            datos = {k: list(v) for k, v in self._datos.items()}
+            trunc = dict(self._truncaciones)
+        return [
+            {
+                "area": k[0], "subtema": k[1], "longitud_min": k[2], "longitud_max": k[3],
+                "muestras": len(v),
+                "p50": _percentil(v, 0.5),
+                "p95": _percentil(v, 0.95),
+                "truncaciones": trunc.get(k, 0),
+            }
+            for k, v in datos.items()
+        ]
+
+TOKENS_COMPLETION = _DistribucionTokens()
+
+def max_tokens_para(cfg: 'GenInput') -> int:
+    """
+    max_tokens de la llamada: el valor explícito del cliente si lo fijó; si no, el percentil alto
+    observado para la celda con margen (acotado a 100..4000); sin historial, cfg.max_tokens_item.
+    """
+    if not MAX_TOKENS_ADAPTATIVO or "max_tokens_item" in cfg.model_fields_set:
+        return cfg.max_tokens_item
+    p = TOKENS_COMPLETION.percentil(cfg, MAX_TOKENS_PERCENTIL)
+    if p is None:
+        return cfg.max_tokens_item
+    return max(100, min(4000, int(p * MAX_TOKENS_MARGEN) + 1))
+
+# ===================== Exposición por estudiante =====================
+def hash_item(item: dict) -> int:
+    """
+    Hash de contenido de 64 bits: enunciado y textos de opciones normalizados con _norm.
+    Las opciones se ordenan para que el barajado de letras no cambie el hash.
+    """
+    opciones = item.get("opciones") or {}
+    base = _norm(item.get("pregunta", "")) + "\x1f" + "\x1f".join(sorted(_norm(v) for v in opciones.values()))
+    return int.from_bytes(hashlib.blake2b(base.encode("utf-8"), digest_size=8).digest(), "big")
+
+class _BloomRotativo:
+    """
+    Filtro de Bloom con dos generaciones (actual y anterior). Cuando la actual se llena,
+    la anterior se descarta: la memoria queda acotada y se "olvidan" los ítems más antiguos.
+    Cada generación usa fp/2 para que la tasa combinada no supere `fp`.
+    """
+    def __init__(self, capacidad: int, fp: float):
+        self.capacidad = capacidad
+        self.m = max(64, int(math.ceil(-capacidad * math.log(fp / 2) / (math.log(2) ** 2))))
+        self.k = max(1, int(round(self.m / capacidad * math.log(2))))
+        self.actual = bytearray((self.m + 7) // 8)
+        self.anterior: Optional[bytearray] = None
+        self.n_actual = 0
+
+    def _posiciones(self, h: int):
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    @staticmethod
+    def _contiene(bits: bytearray, posiciones) -> bool:
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in posiciones)
+
+    def __contains__(self, h: int) -> bool:
+        pos = self._posiciones(h)
+        return self._contiene(self.actual, pos) or (self.anterior is not None and self._contiene(self.anterior, pos))
+
+    def agregar(self, h: int) -> None:
+        if self.n_actual >= self.capacidad:
+            self.anterior, self.actual, self.n_actual = self.actual, bytearray(len(self.actual)), 0
+        for p in self._posiciones(h):
+            self.actual[p >> 3] |= 1 << (p & 7)
+        self.n_actual += 1
+
+    def generaciones(self) -> Tuple[int, int, List[bytes]]:
+        """(m, k, [bits...]) para consultas vectorizadas en el banco (banco_indice.bloom_contiene)."""
+        return self.m, self.k, [bytes(self.actual)] + ([bytes(self.anterior)] if self.anterior is not None else [])
+
+    def a_bytes(self) -> bytes:
+        """Serialización para ESTADO: n_actual, si hay generación anterior y los bits."""
+        cabecera = struct.pack("<IB", self.n_actual, self.anterior is not None)
+        return cabecera + bytes(self.actual) + (bytes(self.anterior) if self.anterior is not None else b"")
+
+    @classmethod
+    def desde_bytes(cls, capacidad: int, fp: float, dato: Optional[bytes]) -> '_BloomRotativo':
+        """Inverso de a_bytes. Si no hay dato o cambió el tamaño (otra configuración), filtro vacío."""
+        filtro = cls(capacidad, fp)
+        largo = len(filtro.actual)
+        if not dato or len(dato) not in (5 + largo, 5 + 2 * largo):
+            return filtro
+        n_actual, hay_anterior = struct.unpack_from("<IB", dato)
+        filtro.n_actual = n_actual
+        filtro.actual = bytearray(dato[5:5 + largo])
+        filtro.anterior = bytearray(dato[5 + largo:]) if hay_anterior else None
+        return filtro
+
+class _RegistroExposicion:
+    """
+    Ítems vistos por estudiante. Cada filtro vive en ESTADO (clave "exposicion:<id>", TTL):
+    con varios workers todos ven la misma exposición; marcar es una actualización atómica.
+    Las consultas van contra una copia local (`cargar`, una lectura de ESTADO por petición),
+    no contra ESTADO ítem por ítem.
+    """
+    def __init__(self, capacidad: int, fp: float, ttl_s: float):
+        self.capacidad, self.fp, self.ttl_s = capacidad, fp, ttl_s
+        self._bytes_filtro = 5 + 2 * len(_BloomRotativo(capacidad, fp).actual)
+
+    def cargar(self, id_estudiante: Optional[str]) -> Optional[_BloomRotativo]:
+        """
+        Copia del filtro del estudiante (None si no hay estudiante o aún no vio nada). Se lee una
+        vez al empezar la petición; lo que la misma petición sirve se excluye aparte (excluir).
+        """
+        if not id_estudiante:
+            return None
+        dato = ESTADO.obtener(f"exposicion:{id_estudiante}")
+        return None if dato is None else _BloomRotativo.desde_bytes(self.capacidad, self.fp, dato)
+
+    def marcar(self, id_estudiante: Optional[str], hashes: List[int]) -> None:
+        if not id_estudiante or not hashes:
+            return
+
+        def agregar(dato: Optional[bytes]) -> bytes:
+            filtro = _BloomRotativo.desde_bytes(self.capacidad, self.fp, dato)
+            for h in hashes:
+                filtro.agregar(h)
+            return filtro.a_bytes()
+
+        ESTADO.actualizar(f"exposicion:{id_estudiante}", agregar, ttl_s=self.ttl_s)
+
+    def snapshot(self) -> dict:
+        n = ESTADO.contar("exposicion:")
+        return {
+            "estudiantes": n,
+            "capacidad_por_generacion": self.capacidad,
+            "fp_objetivo": self.fp,
+            "ttl_s": self.ttl_s,
+            "memoria_aprox_bytes": n * self._bytes_filtro,
+        }
+
+EXPOSICION = _RegistroExposicion(EXPOSICION_CAPACIDAD, EXPOSICION_FP, EXPOSICION_TTL_S)
+
+# ===================== Banco de preguntas =====================
+_BANCO_SINCRONIZAR_S = 5.0  # cada cuánto se indexa lo que otros workers agregaron al JSONL
+
+class _Banco:
+    """
+    Ítems ya generados, deduplicados por hash_item y persistidos en BANCO_PATH (JSONL).
+    Las lecturas van por IndiceBanco (banco_indice.py): arreglos memory-mapped por
+    (área, subtema, estilo_kolb); no se cargan los ítems en memoria.
+    Con varios workers el JSONL es compartido: el dedup usa un conjunto de ESTADO y las filas
+    escritas por otros procesos se indexan a lo sumo _BANCO_SINCRONIZAR_S después (más lo que
+    tarde la reconstrucción). La reconstrucción del índice nunca corre en el camino de una
+    petición: se lanza en un hilo y los lectores cambian a los arreglos nuevos al terminar.
+    """
+    def __init__(self, path: str):
+        # BANCO_PATH vacío: banco temporal del proceso (no sobrevive reinicios; se borra al salir)
+        if not path:
+            tmp = tempfile.mkdtemp(prefix="banco_")
+            atexit.register(shutil.rmtree, tmp, True)
+            path = os.path.join(tmp, "banco.jsonl")
+        self.path = path
+        self._lock = threading.Lock()
+        self.indice = IndiceBanco(self.path, clave_fn=_clave_celda_banco, hash_fn=hash_item, norm_fn=_norm,
+                                  plantillas=PLANTILLAS_EXPLICACION)
+        self._fin_conocido = self._tamano()
+        self._ultima_sync = time.monotonic()
+        # Al arrancar solo se agregan los hashes del JSONL: los demás workers siguen escribiendo en el
+        # conjunto y vaciarlo abriría una ventana de duplicados. Se rehace solo si el archivo cambió
+        # (otro inode que el de la siembra anterior: reemplazado o borrado entre ejecuciones).
+        self._conjunto = "banco:" + os.path.abspath(self.path)
+        if ESTADO.sembrar_conjunto(self._conjunto, (f"{h:016x}" for h in self.indice.hashes().tolist()),
+                                   self._origen()):
+            _dbg(f"BANCO>> {self.path} cambió desde la última siembra: conjunto de dedup reconstruido")
+
+    def _origen(self) -> str:
+        """Identidad del JSONL (dispositivo:inode); vacío si aún no existe."""
+        if not os.path.exists(self.path):
+            return ""
+        st = os.stat(self.path)
+        return f"{st.st_dev}:{st.st_ino}"
+
+    def _tamano(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def _sincronizar(self) -> None:
+        """
+        Lanza en segundo plano la indexación de las filas que otros procesos agregaron al JSONL
+        (como mucho cada _BANCO_SINCRONIZAR_S); quien llama no espera.
+        """
+        if time.monotonic() - self._ultima_sync < _BANCO_SINCRONIZAR_S:
+            return
+        with self._lock:
+            self._ultima_sync = time.monotonic()
+            tam = self._tamano()
+            if tam != self._fin_conocido and self.indice.actualizar_en_segundo_plano():
+                self._fin_conocido = tam
+
+    def agregar(self, item: dict) -> bool:
+        """Agrega un ítem (dict de ItemOut). Devuelve False si ya estaba en el banco."""
+        if not BANCO_GUARDAR:
+            return False
+        item = json.loads(json.dumps(item, ensure_ascii=False))
+        item.get("meta", {}).pop("source", None)
+        h = hash_item(item)
+        item.setdefault("meta", {})["hash"] = f"{h:016x}"
+        with self._lock:
+            if not ESTADO.agregar_si_nuevo(self._conjunto, f"{h:016x}"):
+                return False
+            linea = (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+            # O_APPEND: la línea queda entera al final aunque otro worker escriba a la vez
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, linea)
+                offset = os.lseek(fd, 0, os.SEEK_CUR) - len(linea)
+            finally:
+                os.close(fd)
+            if offset == self._fin_conocido:
+                self._fin_conocido += len(linea)
+            self.indice.anexar(offset, _clave_celda_banco(item), h, self.indice.puntuar(item))
+            if self.indice.pendientes() >= BANCO_INDICE_FLUSH:
+                self.indice.actualizar_en_segundo_plano()
+        return True
+
+    def muestrear(self, area: str, subtema: str, estilo_kolb: str, n: int,
+                  exposicion: Optional[_BloomRotativo] = None, excluir: Optional[set] = None) -> List[dict]:
+        """
+        Hasta n ítems aleatorios de la celda, sin los que el estudiante ya vio, sin los de `excluir`
+        (hashes) y sin los de calidad < BANCO_CALIDAD_MIN. Devuelve copias con meta.source = "banco".
+        """
+        self._sincronizar()
+        offsets = self.indice.muestrear(f"{area}|{subtema}|{estilo_kolb}", n, excluir=excluir,
+                                        bloom=exposicion.generaciones() if exposicion is not None else None,
+                                        calidad_min=BANCO_CALIDAD_MIN)
+        out = self.indice.leer(offsets)
+        for item in out:
+            item.setdefault("meta", {})["source"] = "banco"
+        return out
+
+    def conteos(self) -> Dict[str, int]:
+        self._sincronizar()
+        return self.indice.conteos()
+
+    def __len__(self) -> int:
+        self._sincronizar()
+        return len(self.indice)
+
+def _clave_celda_banco(item: dict) -> str:
+    return f"{item['area']}|{item['subtema']}|{item.get('estilo_kolb') or 'Convergente'}"
+
+BANCO = _Banco(BANCO_PATH)
+# Índice invertido del mismo JSONL; se pone al día en cada búsqueda (lee solo lo nuevo)
+BUSQUEDA = IndiceBusqueda(BANCO.path, norm_fn=_norm)
+# La primera pasada sobre un banco grande toma segundos: se hace en segundo plano al arrancar
+threading.Thread(target=BUSQUEDA.actualizar, name="busqueda-indice", daemon=True).start()
+_GENERACION_POOL = ThreadPoolExecutor(max_workers=GENERACION_WORKERS, thread_name_prefix="gen")
+
 # ===================== Generación de Preguntas =====================
-def generar_una(cfg: 'GenInput') -> Tuple['ItemOut', Dict[str, int]]:
+def _sumar_usage(a: Dict[str, int], b: Dict[str, int]) -> Dict[str, int]:
+    """Suma dos diccionarios de uso de tokens."""
+    return {
+        "prompt_tokens": a["prompt_tokens"] + b["prompt_tokens"],
+        "completion_tokens": a["completion_tokens"] + b["completion_tokens"],
+        "total_tokens": a["total_tokens"] + b["total_tokens"]
+    }
+
+def reparar_item(data: dict, errores: List[str], cfg: 'GenInput', modelo: str,
+                 max_tokens_pregunta: int) -> Tuple[dict, Dict[str, int]]:
     """
-    Genera una pregunta usando OpenAI.
-    Retorna una tupla: (ItemOut, información de tokens usados)
+    Pide al modelo SOLO los campos que fallan (instrucción fija y corta + JSON roto) y los
+    fusiona sobre `data`. No reenvía el prompt del sistema ni la conversación original.
+    """
+    campos = sorted({e.split(":", 1)[0].split(".", 1)[0] for e in errores})
+    max_tokens = max_tokens_pregunta if "pregunta" in campos else REPARACION_MAX_TOKENS
+    msgs = [
+        {"role": "system", "content":
+            "Corriges ítems JSON tipo ICFES. Devuelve SOLO un objeto JSON con los campos pedidos, "
+            "ya corregidos y coherentes con el resto del ítem. No repitas los demás campos."},
+        {"role": "user", "content":
+            f"Ítem ({cfg.area} / {cfg.subtema}):\n{json.dumps(data, ensure_ascii=False)}\n"
+            "Errores:\n" + "\n".join(f"- {e}" for e in errores) + "\n"
+            f"Devuelve solo: {', '.join(campos)}"},
+    ]
+    raw, usage = chat_openai(msgs, max_tokens=max_tokens, temperature=0.0, modelo=modelo)
+    parche = normalize_keys_es(parse_json_min(raw))
+    for campo in campos:
+        if campo not in parche:
+            continue
+        if campo == "opciones" and isinstance(parche["opciones"], dict) and isinstance(data.get("opciones"), dict):
+            data["opciones"].update(parche["opciones"])
+        else:
+            data[campo] = parche[campo]
+    if isinstance(data.get("opciones"), dict):
+        data["opciones"] = {k: v for k, v in data["opciones"].items() if k in ("A", "B", "C", "D")}
+    return data, usage
+
+def _intentar_reparacion(data: dict, errores: List[str], cfg: 'GenInput', modelo: str, max_tokens: int,
+                        costo_generacion: int) -> Tuple[dict, Dict[str, int]]:
+    """
+    reparar_item con sus métricas. Si la llamada de reparación falla, devuelve `data` sin cambios
+    (y uso en cero) para que el llamador decida con el diagnóstico original.
+    """
+    _metrica_inc("reparaciones_intentadas")
+    try:
+        data, usage_rep = reparar_item(data, errores, cfg, modelo, max_tokens)
+    except (DeadlineExcedido, GeneracionCancelada):
+        raise
+    except Exception as e_rep:
+        _dbg(f"REPARACION>> falló la llamada de reparación: {e_rep}")
+        return data, {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    _metrica_inc("reparacion_tokens", usage_rep["total_tokens"])
+    if not diagnosticar_item(data):
+        _metrica_inc("reparaciones_exitosas")
+        # Una regeneración completa habría costado aproximadamente lo mismo que la original
+        _metrica_inc("reparacion_tokens_ahorrados", max(0, costo_generacion - usage_rep["total_tokens"]))
+    return data, usage_rep
+
+class ItemInvalido(ValueError):
+    """La salida del modelo no cumple el esquema (o la verificación); lleva los tokens ya pagados."""
+    def __init__(self, mensaje: str, usage: Dict[str, int]):
+        super().__init__(mensaje)
+        self.usage = usage
+
+def _generar_con_modelo(cfg: 'GenInput', modelo: str) -> Tuple[dict, Dict[str, int]]:
+    """
+    Una generación completa con un modelo concreto: llamada, parseo y validación de esquema.
+    Lanza ItemInvalido si la salida no cumple el esquema (candidata a escalar de modelo).
     """
     msgs = [
         {"role": "system", "content": system_prompt(cfg.area)},
         {"role": "user", "content": user_prompt(cfg)},
     ]
-    raw, usage1 = chat_openai(msgs, max_tokens=cfg.max_tokens_item, temperature=cfg.temperatura)
-    total_tokens = usage1["total_tokens"]
-
-    if "{" not in raw or "pregunta" not in raw:
+    clave = f"{cfg.area}|{modelo}"
+    max_tokens = max_tokens_para(cfg)
+    with etiqueta_corpus(tipo="una", cfg=cfg.model_dump()):
+        raw, usage1 = chat_openai_hedged(msgs, max_tokens=max_tokens, temperature=cfg.temperatura,
+                                         clave=clave, modelo=modelo)
+    truncado = usage1.get("finish_reason") == "length"
+    TOKENS_COMPLETION.registrar(cfg, usage1["completion_tokens"], truncado)
+
+    if truncado and max_tokens < 4000:
+        # Salida cortada por max_tokens: el JSON quedaría incompleto. Se repite con más margen
+        # en lugar de dejar que falle el parseo y se reintente el ítem completo desde el pack.
+        _metrica_inc("truncaciones")
+        max_tokens = min(4000, max_tokens * 2)
+        raw, usage2 = chat_openai_hedged(msgs, max_tokens=max_tokens, temperature=cfg.temperatura,
+                                         clave=clave, modelo=modelo)
+        TOKENS_COMPLETION.registrar(cfg, usage2["completion_tokens"], usage2.get("finish_reason") == "length")
+        usage1 = _sumar_usage(usage1, usage2)
+    elif truncado:
+        _metrica_inc("truncaciones")
+
+    if "{" not in raw or ("pregunta" not in raw and not REPARACION_ENABLED):
+        # Sin JSON que reparar: se reenvía la conversación con el recordatorio de formato
         msgs.append({"role": "user", "content":
             "RECUERDA: devuelve SOLO UN OBJETO JSON EXACTO del esquema indicado. "
             "No escribas nada fuera del JSON. No uses 'items'. Incluye la clave 'pregunta'."})
-        raw, usage2 = chat_openai(msgs, max_tokens=cfg.max_tokens_item, temperature=0.0)
-        total_tokens += usage2["total_tokens"]
-        usage1 = {
-            "prompt_tokens": usage1["prompt_tokens"] + usage2["prompt_tokens"],
-            "completion_tokens": usage1["completion_tokens"] + usage2["completion_tokens"],
-            "total_tokens": total_tokens
-        }
+        raw, usage2 = chat_openai_hedged(msgs, max_tokens=max_tokens, temperature=0.0,
+                                         clave=clave, modelo=modelo)
+        usage1 = _sumar_usage(usage1, usage2)
 
-    data = parse_json_min(raw)
-    data = coerce_single_item(data)
-    data = normalize_keys_es(data)
-    ensure_schema(data)
+    try:
+        data = parse_json_min(raw)
+        data = coerce_single_item(data)
+        data = normalize_keys_es(data)
+        errores = diagnosticar_item(data)
+        if errores and REPARACION_ENABLED and isinstance(data, dict):
+            data, usage_rep = _intentar_reparacion(data, errores, cfg, modelo, max_tokens, usage1["total_tokens"])
+            usage1 = _sumar_usage(usage1, usage_rep)
+        ensure_schema(data)
+        verificar_clave(data, cfg)
+    except ValueError as e:
+        raise ItemInvalido(str(e), usage1) from e
+    return data, usage1
+
+def verificar_clave(data: dict, cfg: 'GenInput') -> None:
+    """
+    Matemáticas: recalcula la respuesta localmente (sin LLM). Si el cálculo coincide con el
+    resultado de la explicación, corrige respuesta_correcta cuando exactamente una opción coincide
+    y lanza ValueError si ninguna o varias coinciden. El resultado queda en meta.verificacion
+    ("no_verificable" cuando no hay cantidades extraíbles o la explicación no respalda el cálculo).
+    """
+    if not VERIFICAR_MATEMATICAS or "matem" not in _norm(cfg.area):
+        return
+    original = data.get("respuesta_correcta", "A")
+    v = verificar_matematicas(data.get("pregunta", ""), data.get("opciones", {}), original,
+                              data.get("explicacion", ""), cfg.subtema, norm_fn=_norm)
+    _metrica_inc(f"verificacion_{v.estado}")
+    if v.estado == "rechazado":
+        raise ValueError(f"Verificación matemática ({v.metodo}): {v.detalle}")
+    if v.correcta:
+        data["respuesta_correcta"] = v.correcta
+    meta = data.get("meta")
+    if not isinstance(meta, dict):
+        meta = data["meta"] = {}
+    meta["verificacion"] = v.meta(original)
 
-    # Post-procesamiento
+def generar_una(cfg: 'GenInput') -> Tuple['ItemOut', Dict[str, int]]:
+    """
+    Genera una pregunta usando OpenAI.
+    El modelo sale de MODEL_ROUTING; si la salida no cumple el esquema se escala a un nivel más fuerte.
+    Retorna una tupla: (ItemOut, información de tokens usados)
+    """
+    nivel = nivel_modelo(cfg.area, cfg.subtema)
+    nivel_inicial = nivel
+    usage1 = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    while True:
+        modelo = MODEL_TIERS[nivel]
+        t0 = time.perf_counter()
+        try:
+            data, usage = _generar_con_modelo(cfg, modelo)
+        except ItemInvalido as e:
+            usage1 = _sumar_usage(usage1, e.usage)
+            RUTAS.registrar(cfg.area, cfg.subtema, modelo, (time.perf_counter() - t0) * 1000, e.usage, ok=False)
+            siguiente = nivel_superior(nivel)
+            if siguiente is None:
+                raise ItemInvalido(str(e), usage1) from e
+            _metrica_inc("escalados_modelo")
+            _dbg(f"ROUTING>> {cfg.area}/{cfg.subtema}: {modelo} falló el esquema ({e}); escalando a {MODEL_TIERS[siguiente]}")
+            nivel = siguiente
+            continue
+        usage1 = _sumar_usage(usage1, usage)
+        RUTAS.registrar(cfg.area, cfg.subtema, modelo, (time.perf_counter() - t0) * 1000, usage, ok=True)
+        break
+
+    ruta = {"nivel_inicial": nivel_inicial, "nivel": nivel, "escalado": nivel != nivel_inicial}
+    return _finalizar_item(data, cfg, modelo, ruta, usage1), usage1
+
+def _finalizar_item(data: dict, cfg: 'GenInput', modelo: str, ruta: dict, usage: Dict[str, int]) -> 'ItemOut':
+    """Post-procesamiento común de un ítem ya validado por esquema y construcción de ItemOut."""
     data["pregunta"] = pad_to_range(data.get("pregunta", ""), cfg.longitud_min, cfg.longitud_max)
     data["pregunta"] = remove_plus_on_positive(data["pregunta"])
     data["opciones"] = clean_options_signs(data.get("opciones", {}))
@@ -1029,13 +2475,131 @@ def generar_una(cfg: 'GenInput') -> Tuple['ItemOut', Dict[str, int]]:
     meta = data.get("meta", {})
     if not isinstance(meta, dict):
         meta = {}
-    meta.setdefault("modelo", OPENAI_MODEL)
+    meta["modelo"] = modelo
+    meta["ruta"] = ruta
+    meta["hash"] = f"{hash_item(data):016x}"
+    meta["longitud"] = [cfg.longitud_min, cfg.longitud_max]
     meta.setdefault("seed_randomize", SEED_RANDOMIZE)
     # Agregar información de tokens usados
-    meta.setdefault("tokens_usados", usage1)
+    meta.setdefault("tokens_usados", usage)
     data["meta"] = meta
 
-    return ItemOut(**data), usage1
+    return ItemOut(**data)
+
+def generar_lote(cfg: 'GenInput', n: int) -> Tuple[List['ItemOut'], Dict[str, int]]:
+    """
+    Genera n preguntas de la misma celda en UNA sola llamada ({"items": [...]}).
+    Los ítems que no cumplen el esquema se descartan; lanza ValueError si no queda ninguno.
+    """
+    if n <= 1:
+        item, usage = generar_una(cfg)
+        return [item], usage
+    modelo = MODEL_TIERS[nivel_modelo(cfg.area, cfg.subtema)]
+    msgs = mensajes_lote(cfg, n)
+    with etiqueta_corpus(tipo="lote", cfg=cfg.model_dump(), n=n):
+        raw, usage = chat_openai_hedged(msgs, max_tokens=min(16000, max_tokens_para(cfg) * n),
+                                        temperature=cfg.temperatura, clave=f"{cfg.area}|{modelo}|lote", modelo=modelo)
+    return items_desde_lote(raw, cfg, modelo, usage), usage
+
+def mensajes_lote(cfg: 'GenInput', n: int) -> List[dict]:
+    """Mensajes para pedir n ítems de una celda en una sola llamada."""
+    return [
+        {"role": "system", "content": system_prompt(cfg.area)},
+        {"role": "user", "content": user_prompt(cfg, cantidad=n)},
+    ]
+
+def items_desde_lote(raw: str, cfg: 'GenInput', modelo: str, usage: Dict[str, int]) -> List['ItemOut']:
+    """Parsea y valida la salida de un lote; descarta ítems inválidos y reparte el uso entre los válidos."""
+    nivel = next((k for k, v in MODEL_TIERS.items() if v == modelo), "fuerte")
+    obj = parse_json_min(raw)
+    crudos = obj["items"] if isinstance(obj.get("items"), list) else [obj]
+    por_item = {k: usage[k] // max(len(crudos), 1) for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+    ruta = {"nivel_inicial": nivel, "nivel": nivel, "escalado": False}
+    items = []
+    for crudo in crudos:
+        data = normalize_keys_es(crudo) if isinstance(crudo, dict) else crudo
+        if diagnosticar_item(data):
+            continue
+        ensure_schema(data)
+        try:
+            verificar_clave(data, cfg)
+        except ValueError:
+            continue
+        items.append(_finalizar_item(data, cfg, modelo, ruta, dict(por_item)))
+    if not items:
+        raise ItemInvalido("El lote no contiene ningún ítem válido", usage)
+    return items
+
+def mensajes_kolb(cfg: 'GenInput', estilos: List[str]) -> List[dict]:
+    """Mensajes para pedir una variante por estilo Kolb en una sola llamada."""
+    return [
+        {"role": "system", "content": system_prompt(cfg.area)},
+        {"role": "user", "content": user_prompt_kolb(cfg, estilos)},
+    ]
+
+def generar_kolb(cfg: 'GenInput', estilos: List[str]) -> Tuple[List['ItemOut'], Dict[str, int], List[str]]:
+    """
+    Una pregunta por estilo de `estilos` en UNA sola llamada. Cada ítem se asigna por su
+    'estilo_kolb' (o por posición si falta o se repite) y se valida como en generar_lote; un
+    ítem con errores de esquema pasa antes por la reparación dirigida, como en generar_una.
+    Los estilos sin ítem válido (o todos, si la salida no se puede parsear) se completan con
+    generar_una. Devuelve (ítems en el orden de `estilos`, tokens totales, estilos completados aparte).
+    """
+    modelo = MODEL_TIERS[nivel_modelo(cfg.area, cfg.subtema)]
+    nivel = next((k for k, v in MODEL_TIERS.items() if v == modelo), "fuerte")
+    with etiqueta_corpus(tipo="kolb", cfg=cfg.model_dump(), estilos=list(estilos)):
+        raw, usage = chat_openai_hedged(mensajes_kolb(cfg, estilos),
+                                        max_tokens=min(16000, max_tokens_para(cfg) * len(estilos)),
+                                        temperature=cfg.temperatura, clave=f"{cfg.area}|{modelo}|kolb", modelo=modelo)
+    try:
+        obj = parse_json_min(raw)
+    except ValueError as e:
+        # p. ej. salida truncada: todos los estilos se completan aparte
+        _metrica_inc("kolb_parse_fallidos")
+        _dbg(f"KOLB>> salida no parseable ({e}); se completa cada estilo con generar_una")
+        obj = {"items": []}
+    crudos = [c for c in (obj["items"] if isinstance(obj.get("items"), list) else [obj]) if isinstance(c, dict)]
+    por_item = {k: usage[k] // max(len(crudos), 1) for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+    ruta = {"nivel_inicial": nivel, "nivel": nivel, "escalado": False}
+
+    asignados: Dict[str, dict] = {}
+    sin_estilo: List[dict] = []
+    for crudo in crudos:
+        data = normalize_keys_es(crudo)
+        estilo, _ = validar_kolb(data.get("estilo_kolb")) if data.get("estilo_kolb") else (None, None)
+        if estilo in estilos and estilo not in asignados:
+            asignados[estilo] = data
+        else:
+            sin_estilo.append(data)
+    for estilo in estilos:
+        if estilo not in asignados and sin_estilo:
+            asignados[estilo] = sin_estilo.pop(0)
+
+    por_estilo: Dict[str, 'ItemOut'] = {}
+    for estilo, data in asignados.items():
+        cfg_e = cfg.model_copy(update={"estilo_kolb": estilo})
+        errores = diagnosticar_item(data)
+        if errores and REPARACION_ENABLED:
+            data, usage_rep = _intentar_reparacion(data, errores, cfg_e, modelo, max_tokens_para(cfg_e),
+                                                   por_item["total_tokens"])
+            usage = _sumar_usage(usage, usage_rep)
+            errores = diagnosticar_item(data)
+        if errores:
+            continue
+        try:
+            ensure_schema(data)
+            verificar_clave(data, cfg_e)
+        except ValueError:
+            continue
+        por_estilo[estilo] = _finalizar_item(data, cfg_e, modelo, ruta, dict(por_item))
+
+    faltantes = [e for e in estilos if e not in por_estilo]
+    for estilo in faltantes:
+        _metrica_inc("kolb_completados_aparte")
+        item, u = generar_una(cfg.model_copy(update={"estilo_kolb": estilo}))
+        por_estilo[estilo] = item
+        usage = _sumar_usage(usage, u)
+    return [por_estilo[e] for e in estilos], usage, faltantes
 
 def fallback_rule_based(cfg: 'GenInput') -> 'ItemOut':
     """Genera una pregunta de fallback si falla la generación con AI."""
@@ -1064,10 +2628,416 @@ def fallback_rule_based(cfg: 'GenInput') -> 'ItemOut':
         meta={"source": "fallback", "modelo": OPENAI_MODEL}
     )
 
-# ===================== Endpoints FastAPI =====================
-@app.get("/")
-def root():
-    """Endpoint raíz con información de la API."""
+# ===================== Coalescencia (single-flight) =====================
+def clave_coalescencia(cfg: 'GenInput') -> str:
+    """Clave de una petición ya normalizada por validar_input (solo campos que afectan al ítem)."""
+    campos = ("area", "subtema", "estilo_kolb", "longitud_min", "longitud_max", "max_tokens_item", "temperatura")
+    return json.dumps({k: getattr(cfg, k) for k in campos}, sort_keys=True, ensure_ascii=False)
+
+class _Vuelo:
+    """Una generación en curso compartida por todas las peticiones idénticas que lleguen."""
+    def __init__(self):
+        self.evento = threading.Event()
+        self.participantes = 1
+        self.items: List['ItemOut'] = []
+        self.usage: Dict[str, int] = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        self.error: Optional[BaseException] = None
+
+class CoalescedorGeneraciones:
+    """
+    Single-flight para /icfes/generar. El líder del vuelo genera; los seguidores esperan su
+    resultado. Con SEED_RANDOMIZE cada seguidor necesita un ítem distinto, así que el líder pide
+    un lote del tamaño de la demanda vista en el vuelo anterior de la misma clave; si el lote no
+    alcanza, el seguidor sin ítem abre un vuelo nuevo. Cada seguidor espera con su propio deadline
+    y cancelación; si el líder falla por los suyos (DeadlineExcedido, GeneracionCancelada), los
+    seguidores no heredan el error: uno de ellos abre un vuelo nuevo como líder.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vuelos: Dict[str, _Vuelo] = {}
+        self._demanda: Dict[str, int] = {}
+
+    def _tomar_sobrante(self, clave: str) -> Optional['ItemOut']:
+        # Los sobrantes viven en ESTADO: los aprovecha cualquier worker, cada uno una sola vez
+        dato = ESTADO.desencolar(f"sobrantes:{clave}")
+        return None if dato is None else ItemOut.model_validate(dato)
+
+    def sobrante(self, cfg: 'GenInput') -> Optional[dict]:
+        """Un ítem que sobró de un lote anterior de la misma celda (None si no queda ninguno)."""
+        return ESTADO.desencolar(f"sobrantes:{clave_coalescencia(cfg)}") if SEED_RANDOMIZE else None
+
+    def devolver_sobrantes(self, cfg: 'GenInput', datos: List[dict]) -> None:
+        """Reencola sobrantes tomados con sobrante() que este llamador no pudo usar (ya pagados)."""
+        if datos:
+            ESTADO.encolar(f"sobrantes:{clave_coalescencia(cfg)}", datos, COALESCE_TTL_S)
+
+    def generar(self, cfg: 'GenInput') -> Tuple['ItemOut', Dict[str, int], bool]:
+        """Devuelve (ítem, tokens gastados por ESTA petición, compartido)."""
+        _metrica_inc("coalescencia_solicitudes")
+        return self._generar(cfg, clave_coalescencia(cfg))
+
+    def _generar(self, cfg: 'GenInput', clave: str) -> Tuple['ItemOut', Dict[str, int], bool]:
+        with self._lock:
+            if SEED_RANDOMIZE:
+                sobrante = self._tomar_sobrante(clave)
+                if sobrante is not None:
+                    _metrica_inc("coalescencia_compartidas")
+                    return sobrante, {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}, True
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+                n = min(COALESCE_LOTE_MAX, max(1, self._demanda.get(clave, 1))) if SEED_RANDOMIZE else 1
+            else:
+                vuelo.participantes += 1
+
+        if lider:
+            try:
+                vuelo.items, vuelo.usage = generar_lote(cfg, n)
+            except Exception as e:
+                vuelo.error = e
+            finally:
+                with self._lock:
+                    self._vuelos.pop(clave, None)
+                    self._demanda[clave] = vuelo.participantes
+                    if SEED_RANDOMIZE and len(vuelo.items) > vuelo.participantes:
+                        ESTADO.encolar(f"sobrantes:{clave}",
+                                       [it.model_dump() for it in vuelo.items[vuelo.participantes:]],
+                                       COALESCE_TTL_S)
+                vuelo.evento.set()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.items[0], vuelo.usage, False
+
+        self._esperar(vuelo, clave)
+        if isinstance(vuelo.error, (DeadlineExcedido, GeneracionCancelada)):
+            _metrica_inc("coalescencia_relevos")
+            return self._generar(cfg, clave)
+        if vuelo.error is not None:
+            raise vuelo.error
+        if not SEED_RANDOMIZE:
+            _metrica_inc("coalescencia_compartidas")
+            return vuelo.items[0], {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}, True
+        with self._lock:
+            # El ítem 0 es del líder; los seguidores se reparten el resto del lote en orden de llegada
+            item = vuelo.items.pop(1) if len(vuelo.items) > 1 else None
+        if item is None:
+            return self._generar(cfg, clave)
+        _metrica_inc("coalescencia_compartidas")
+        return item, {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}, True
+
+    def _esperar(self, vuelo: _Vuelo, clave: str) -> None:
+        """Espera el vuelo respetando el deadline y la cancelación de ESTA petición."""
+        while True:
+            restante = tiempo_restante_s()
+            espera = _DESCONEXION_POLL_S if restante is None else max(0.0, min(_DESCONEXION_POLL_S, restante))
+            if vuelo.evento.wait(timeout=espera):
+                return
+            restante = tiempo_restante_s()
+            vencido = restante is not None and restante <= 0
+            if not (vencido or peticion_cancelada()):
+                continue
+            with self._lock:
+                if self._vuelos.get(clave) is not vuelo:
+                    continue  # el líder ya terminó: el resultado está por publicarse
+                vuelo.participantes -= 1  # su ítem del lote queda como sobrante
+            if vencido:
+                _metrica_inc("deadline_excedidos")
+                raise DeadlineExcedido("Deadline excedido esperando una generación coalescida")
+            raise GeneracionCancelada("Generación cancelada esperando una generación coalescida")
+
+COALESCEDOR = CoalescedorGeneraciones()
+
+# ===================== Simulacro completo =====================
+def cuotas_simulacro(total: int, areas: List[str]) -> Dict[str, int]:
+    """
+    Reparte `total` preguntas entre las áreas en proporción al número oficial de preguntas de
+    cada prueba (ICFES_SABER11_FUENTES), por el método del mayor residuo. Mínimo 1 por área.
+    """
+    pesos = {a: ICFES_SABER11_FUENTES[ICFES_AREA_ALIAS[a]]["numero_preguntas"] for a in areas}
+    suma = sum(pesos.values())
+    exactas = {a: total * p / suma for a, p in pesos.items()}
+    cuotas = {a: max(1, int(v)) for a, v in exactas.items()}
+    restantes = sorted(areas, key=lambda a: exactas[a] - int(exactas[a]), reverse=True)
+    i = 0
+    while sum(cuotas.values()) < total:
+        cuotas[restantes[i % len(restantes)]] += 1
+        i += 1
+    return cuotas
+
+def plan_area_simulacro(area: str, cuota: int) -> List[Tuple[str, str]]:
+    """
+    Lista de (subtema, eje) para las `cuota` preguntas de un área. El eje es la competencia oficial
+    o, si el área se describe por partes (Inglés), la parte de la prueba; ambos se reparten en ronda.
+    """
+    info = ICFES_SABER11_FUENTES[ICFES_AREA_ALIAS[area]]
+    ejes = [c["nombre"] for c in info.get("competencias") or []] or list((info.get("estructura") or {}).get("partes") or [])
+    ejes = ejes or [""]
+    subtemas = ALLOWED[area]
+    return [(subtemas[i % len(subtemas)], ejes[i % len(ejes)]) for i in range(cuota)]
+
+_PATRON_LETRA = re.compile(
+    r"(?P<pre>\b(?:opci[oó]n|literal|letra|respuesta|option|la)\s+|\(\s*)(?P<l1>[ABCD])\b"
+    r"|(?P<ini>^|\s)(?P<l2>[ABCD])(?=\s*[:)])",
+    re.I,
+)
+
+def _intercambiar_letras(texto: str, x: str, y: str) -> str:
+    """Intercambia las referencias a las opciones x e y dentro de una explicación."""
+    def repl(m):
+        letra = m.group("l1") or m.group("l2")
+        nueva = {x: y, y: x}.get(letra, letra)
+        if m.group("l1"):
+            return m.group("pre") + nueva
+        return m.group("ini") + nueva
+    return _PATRON_LETRA.sub(repl, texto or "")
+
+def balancear_respuestas(items: List[dict]) -> Dict[str, int]:
+    """
+    Reparte la letra correcta de forma pareja entre A–D (misma cantidad ±1, en orden aleatorio)
+    intercambiando opciones y las referencias de la explicación. Devuelve la distribución final.
+    """
+    letras = ["A", "B", "C", "D"]
+    objetivos = (letras * (len(items) // 4 + 1))[:len(items)]
+    random.shuffle(objetivos)
+    for item, destino in zip(items, objetivos):
+        actual = item["respuesta_correcta"]
+        if actual == destino:
+            continue
+        op = item["opciones"]
+        op[actual], op[destino] = op[destino], op[actual]
+        item["respuesta_correcta"] = destino
+        item["explicacion"] = _intercambiar_letras(item.get("explicacion", ""), actual, destino)
+    return {l: sum(1 for it in items if it["respuesta_correcta"] == l) for l in letras}
+
+def _generar_para_slot(cfg: 'GenInput', excluir: set, exposicion: Optional[_BloomRotativo],
+                       lock: threading.Lock) -> Tuple[Optional[dict], Dict[str, int], Optional[str]]:
+    """Genera un ítem único (no repetido en el simulacro ni visto por el estudiante); 2 intentos."""
+    usage_total = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    error = None
+    for _ in range(2):
+        if peticion_cancelada():
+            return None, usage_total, "Cancelada: el cliente se desconectó"
+        try:
+            it, usage = generar_una(cfg)
+        except (DeadlineExcedido, GeneracionCancelada) as e:
+            return None, usage_total, str(e)
+        except Exception as e:
+            error = str(e)
+            continue
+        usage_total = _sumar_usage(usage_total, usage)
+        it_dict = it.model_dump()
+        h = hash_item(it_dict)
+        with lock:
+            if h in excluir or (exposicion is not None and h in exposicion):
+                error = "No se pudo generar pregunta única después de múltiples intentos"
+                continue
+            excluir.add(h)
+        return it_dict, usage_total, None
+    return None, usage_total, error
+
+# ===================== Packs mixtos =====================
+def _tomar_unicos(candidatos: List[dict], n: int, excluir: set, exposicion: Optional[_BloomRotativo],
+                  lock: threading.Lock) -> List[dict]:
+    """Hasta n ítems de `candidatos` que no estén en `excluir` ni los haya visto el estudiante."""
+    out = []
+    with lock:
+        for it in candidatos:
+            if len(out) >= n:
+                break
+            h = hash_item(it)
+            if h in excluir or (exposicion is not None and h in exposicion):
+                continue
+            excluir.add(h)
+            out.append(it)
+    return out
+
+def _generar_tramo(cfg: 'GenInput', n: int, excluir: set, exposicion: Optional[_BloomRotativo],
+                   lock: threading.Lock) -> Tuple[List[dict], Dict[str, int], Optional[str]]:
+    """Un lote de n ítems de una celda (una llamada); descarta repetidos y ya vistos."""
+    if peticion_cancelada():
+        return [], {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}, "Cancelada: el cliente se desconectó"
+    try:
+        items, usage = generar_lote(cfg, n)
+    except (DeadlineExcedido, GeneracionCancelada) as e:
+        return [], {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}, str(e)
+    except ItemInvalido as e:
+        return [], {k: e.usage[k] for k in ("prompt_tokens", "completion_tokens", "total_tokens")}, str(e)
+    except Exception as e:
+        return [], {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}, str(e)
+    usage = {k: usage[k] for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+    return _tomar_unicos([it.model_dump() for it in items], n, excluir, exposicion, lock), usage, None
+
+def planificar_mixto(cfgs: List['GenInput'], cantidades: List[int], usar_banco: bool,
+                     exposicion: Optional[_BloomRotativo], excluir: set, lock: threading.Lock
+                     ) -> Tuple[List[List[dict]], List[dict]]:
+    """
+    Reparte cada entrada entre stock (sobrantes de la coalescencia), banco y proveedor, en ese
+    orden. Devuelve (ítems ya resueltos por entrada, plan por entrada con lo que falta generar).
+    """
+    grupos, plan = [], []
+    for cfg, n in zip(cfgs, cantidades):
+        stock, rechazados = [], []
+        while len(stock) < n:
+            dato = COALESCEDOR.sobrante(cfg)
+            if dato is None:
+                break
+            tomados = _tomar_unicos([dato], 1, excluir, exposicion, lock)
+            if not tomados:
+                rechazados.append(dato)  # repetido o ya visto por ESTE estudiante: sirve a otros
+            for it in tomados:
+                it["meta"]["source"] = "stock"
+                stock.append(it)
+        COALESCEDOR.devolver_sobrantes(cfg, rechazados)
+        banco = []
+        if (usar_banco or _DEGRADADO.get()) and len(stock) < n:
+            with lock:
+                excluidos = set(excluir)
+            candidatos = BANCO.muestrear(cfg.area, cfg.subtema, cfg.estilo_kolb, n - len(stock), exposicion, excluidos)
+            banco = _tomar_unicos(candidatos, n - len(stock), excluir, exposicion, lock)
+            for it in banco:
+                it["meta"]["source"] = "banco"
+        grupos.append(stock + banco)
+        plan.append({"area": cfg.area, "subtema": cfg.subtema, "estilo_kolb": cfg.estilo_kolb, "cantidad": n,
+                     "stock": len(stock), "banco": len(banco), "proveedor": n - len(stock) - len(banco)})
+    return grupos, plan
+
+# ===================== Estimación previa =====================
+_PATRON_PIEZAS = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+def estimar_tokens(texto: str) -> int:
+    """
+    Aproximación local de tokens BPE (sin red ni tokenizador): palabras cortas = 1 token, largas
+    ~1 token cada 5 caracteres, +1 si llevan tildes/ñ; cada signo de puntuación = 1 token.
+    En español el error típico frente al tokenizador real ronda ±15 %.
+    """
+    total = 0
+    for pieza in _PATRON_PIEZAS.findall(texto or ""):
+        if not pieza[0].isalnum() and pieza[0] != "_":
+            total += 1
+            continue
+        n = 1 if len(pieza) <= 6 else math.ceil(len(pieza) / 5)
+        if not pieza.isascii():
+            n += 1
+        total += n
+    return total
+
+def estimar_tokens_mensajes(messages: List[dict]) -> int:
+    """Tokens de prompt de una lista de mensajes (incluye el relleno fijo por mensaje del chat)."""
+    return sum(estimar_tokens(m["content"]) + 4 for m in messages) + 3
+
+def estimar_generacion(cfg: 'GenInput', cantidad: int) -> dict:
+    """Estimación de tokens, costo y tiempo para `cantidad` ítems de una celda, con los prompts reales."""
+    modelo = MODEL_TIERS[nivel_modelo(cfg.area, cfg.subtema)]
+    prompt_tokens = estimar_tokens_mensajes([
+        {"role": "system", "content": system_prompt(cfg.area)},
+        {"role": "user", "content": user_prompt(cfg)},
+    ])
+
+    p50 = TOKENS_COMPLETION.percentil(cfg, 0.5)
+    p95 = TOKENS_COMPLETION.percentil(cfg, 0.95)
+    if p50 is not None:
+        fuente_completion = "historial"
+    else:
+        # Sin historial: palabras objetivo del enunciado + opciones, explicación y claves JSON
+        p50 = int((cfg.longitud_min + cfg.longitud_max) / 2 * 1.4) + 180
+        p95 = int(cfg.longitud_max * 1.4) + 260
+        fuente_completion = "heuristica"
+
+    lat = RUTAS.latencias(cfg.area, cfg.subtema, modelo)
+    if lat:
+        lat_p50, lat_p90, fuente_latencia = _percentil(lat, 0.5), _percentil(lat, 0.9), "historial"
+    else:
+        # Sin historial: ~0,5 s de primer token + ~60 tokens/s de salida
+        lat_p50, lat_p90, fuente_latencia = 500 + p50 * 16, 500 + p95 * 16, "heuristica"
+
+    entrada, salida = PRECIOS_MODELO.get(modelo, (0.0, 0.0))
+    costo_item = (prompt_tokens * entrada + p50 * salida) / 1_000_000
+
+    # Lote: ítems por llamada que caben con holgura en 4000 tokens de salida
+    lote = max(1, min(COALESCE_LOTE_MAX, cantidad, int(4000 // max(p95, 1))))
+    concurrencia = max(1, min(cantidad, SCHED_MAX_POR_TENANT))
+    llamadas = math.ceil(cantidad / lote)
+    return {
+        "modelo": modelo,
+        "por_item": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens_p50": int(p50),
+            "completion_tokens_p95": int(p95),
+            "fuente_completion": fuente_completion,
+            "latencia_p50_ms": round(lat_p50, 1),
+            "latencia_p90_ms": round(lat_p90, 1),
+            "fuente_latencia": fuente_latencia,
+            "costo_usd": round(costo_item, 6),
+        },
+        "pack": {
+            "prompt_tokens": prompt_tokens * cantidad,
+            "completion_tokens": int(p50 * cantidad),
+            "total_tokens": int((prompt_tokens + p50) * cantidad),
+            "costo_usd": round(costo_item * cantidad, 6),
+            "tiempo_secuencial_ms": round(lat_p50 * cantidad, 1),
+            "tiempo_con_concurrencia_ms": round(lat_p50 * math.ceil(cantidad / concurrencia), 1),
+        },
+        "sugerencia": {
+            "concurrencia": concurrencia,
+            "lote": lote,
+            "llamadas_con_lote": llamadas,
+            "prompt_tokens_con_lote": prompt_tokens * llamadas,
+            "max_tokens_item": max_tokens_para(cfg),
+        },
+    }
+
+# ===================== Respuestas estáticas precalculadas =====================
+# /, /icfes/catalogo y /icfes/doc_justificacion no cambian mientras corre el proceso: se serializan
+# y comprimen con gzip una sola vez al arrancar. Cada representación (identidad / gzip) lleva su
+# ETag fuerte; con If-None-Match se responde 304 sin cuerpo (el sondeo del catálogo desde la app).
+ESTATICOS_MAX_AGE_S = int(os.getenv("ESTATICOS_MAX_AGE_S", "300"))
+ESTATICOS_GZIP_MIN_BYTES = 512  # por debajo gzip no compensa la cabecera
+
+def _acepta_gzip(accept_encoding: str) -> bool:
+    for parte in (accept_encoding or "").lower().split(","):
+        nombre, _, params = parte.strip().partition(";")
+        if nombre.strip() in ("gzip", "*"):
+            q = params.strip()
+            return not (q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"))
+    return False
+
+class RespuestaEstatica:
+    """Cuerpo JSON fijo, precomprimido, con ETag por representación."""
+    def __init__(self, payload: dict):
+        # Mismos bytes que produciría JSONResponse
+        self.cuerpo = json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None,
+                                 separators=(",", ":")).encode("utf-8")
+        huella = hashlib.sha256(self.cuerpo).hexdigest()[:32]
+        self.etag = f'"{huella}"'
+        self.gzip: Optional[bytes] = None
+        self.etag_gzip = self.etag
+        if len(self.cuerpo) >= ESTATICOS_GZIP_MIN_BYTES:
+            self.gzip = gzip.compress(self.cuerpo, compresslevel=9, mtime=0)
+            self.etag_gzip = f'"{huella}-gz"'
+
+    def _coincide(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        etags = {e.strip().removeprefix("W/") for e in if_none_match.split(",")}
+        return "*" in etags or self.etag in etags or self.etag_gzip in etags
+
+    def responder(self, request: Request) -> Response:
+        usar_gzip = self.gzip is not None and _acepta_gzip(request.headers.get("accept-encoding", ""))
+        cabeceras = {
+            "ETag": self.etag_gzip if usar_gzip else self.etag,
+            "Cache-Control": f"public, max-age={ESTATICOS_MAX_AGE_S}",
+            "Vary": "Accept-Encoding",
+        }
+        if self._coincide(request.headers.get("if-none-match")):
+            _metrica_inc("estaticos_304")
+            return Response(status_code=304, headers=cabeceras)
+        if usar_gzip:
+            cabeceras["Content-Encoding"] = "gzip"
+            return Response(self.gzip, media_type="application/json", headers=cabeceras)
+        return Response(self.cuerpo, media_type="application/json", headers=cabeceras)
+
+def _payload_root() -> dict:
     return {
         "nombre": "EduExcel - Generador de Preguntas ICFES",
         "version": "1.0.0",
@@ -1078,26 +3048,110 @@ def root():
             "generar": "/icfes/generar",
             "generar_pack": "/icfes/generar_pack",
             "debug": "/debug/raw",
-            "doc_justificacion": "/icfes/doc_justificacion"
+            "doc_justificacion": "/icfes/doc_justificacion",
+            "metricas": "/icfes/metricas",
+            "rutas": "/icfes/rutas",
+            "banco": "/icfes/banco",
+            "simulacro": "/icfes/simulacro",
+            "estimar": "/icfes/estimar",
+            "buscar": "/icfes/buscar",
+            "generar_kolb": "/icfes/generar_kolb",
+            "generar_mixto": "/icfes/generar_mixto",
+            "debug_profile": "/debug/profile"
         }
     }
 
+ESTATICOS: Dict[str, RespuestaEstatica] = {
+    "root": RespuestaEstatica(_payload_root()),
+    "catalogo": RespuestaEstatica({"ok": True, "catalogo": catalogo()}),
+    "doc_justificacion": RespuestaEstatica({
+        "ok": True,
+        "formato": "markdown_confluence",
+        "documentacion": ICFES_DOC_CONFLUENCE,
+    }),
+}
+
+# ===================== Endpoints FastAPI =====================
+@app.get("/")
+def root(request: Request):
+    """Endpoint raíz con información de la API."""
+    return ESTATICOS["root"].responder(request)
+
 @app.get("/icfes/catalogo")
-def icfes_catalogo():
+def icfes_catalogo(request: Request):
     """Lista las 5 áreas, sus subtemas y estilos Kolb con descripciones."""
-    return {"ok": True, "catalogo": catalogo()}
+    return ESTATICOS["catalogo"].responder(request)
 
 @app.get("/icfes/doc_justificacion")
-def icfes_doc_justificacion():
+def icfes_doc_justificacion(request: Request):
     """
     Devuelve la documentación interna (en formato Markdown/Confluence)
     que justifica el uso de la información oficial del ICFES para la
     generación automática de preguntas tipo Saber 11 con IA.
     """
+    return ESTATICOS["doc_justificacion"].responder(request)
+
+@app.get("/icfes/metricas")
+def icfes_metricas():
+    """Contadores del proceso: llamadas al modelo, hedging (tasa, ganadas y tokens extra)."""
+    return {"ok": True, "metricas": metricas_snapshot()}
+
+@app.get("/icfes/rutas")
+def icfes_rutas():
+    """Tabla de enrutamiento de modelos y estadísticas por ruta (latencia, costo y fallos)."""
     return {
         "ok": True,
-        "formato": "markdown_confluence",
-        "documentacion": ICFES_DOC_CONFLUENCE,
+        "habilitado": ROUTING_ENABLED,
+        "niveles": MODEL_TIERS,
+        "tabla": MODEL_ROUTING,
+        "estadisticas": RUTAS.snapshot(),
+    }
+
+@app.get("/icfes/banco")
+def icfes_banco():
+    """Cantidad de ítems del banco local por (área|subtema|estilo_kolb)."""
+    return {"ok": True, "total": len(BANCO), "por_celda": BANCO.conteos(), "calidad": BANCO.indice.resumen_calidad(),
+            "busqueda": BUSQUEDA.snapshot()}
+
+@app.get("/icfes/buscar")
+def icfes_buscar(
+    q: str = Query(..., min_length=2, max_length=200, description="Texto a buscar (sin importar tildes ni mayúsculas)"),
+    area: Optional[str] = Query(None, description="Filtrar por área"),
+    subtema: Optional[str] = Query(None, description="Filtrar por subtema (requiere área)"),
+    estilo_kolb: Optional[str] = Query(None, description="Filtrar por estilo Kolb"),
+    limite: int = Query(20, ge=1, le=100, description="Máximo de resultados"),
+):
+    """Busca en el banco por enunciado, opciones y explicación; resultados ordenados por BM25."""
+    errores = []
+    if area is not None:
+        area, err = validar_area(area)
+        if err:
+            errores.append(err)
+    if subtema is not None:
+        if area is None:
+            errores.append("El filtro de subtema requiere el área.")
+        else:
+            subtema, err = validar_subtema(area, subtema)
+            if err:
+                errores.append(err)
+    if estilo_kolb is not None:
+        estilo_kolb, err = validar_kolb(estilo_kolb)
+        if err:
+            errores.append(err)
+    if errores:
+        return {"ok": False, "errores": errores, "sugerencias": catalogo()}
+
+    t0 = time.perf_counter()
+    BUSQUEDA.actualizar()
+    encontrados, total = BUSQUEDA.buscar(q, limite, area=area, subtema=subtema, estilo_kolb=estilo_kolb)
+    items = BANCO.indice.leer([off for off, _ in encontrados])
+    return {
+        "ok": True,
+        "consulta": q,
+        "filtros": {"area": area, "subtema": subtema, "estilo_kolb": estilo_kolb},
+        "total": total,
+        "resultados": [{"puntaje": round(p, 4), "item": it} for (_, p), it in zip(encontrados, items)],
+        "tiempo_ms": round((time.perf_counter() - t0) * 1000, 2),
     }
 
 @app.post("/icfes/validar")
@@ -1108,20 +3162,39 @@ def icfes_validar(cfg: GenInput):
         return {"ok": False, "errores": errores, "sugerencias": catalogo()}
     return {"ok": True, "normalizado": cfg2.model_dump(), "mensaje": "Parámetros válidos."}
 
+@app.post("/icfes/estimar")
+def icfes_estimar(cfg: GenInput, cantidad: int = Query(5, ge=1, le=100, description="Cantidad de preguntas del pack (1-100)")):
+    """Estima tokens, costo y tiempo de un pack sin llamar al proveedor (prompts exactos + historial)."""
+    cfg2, errores = validar_input(cfg)
+    if errores:
+        return {"ok": False, "errores": errores, "sugerencias": catalogo()}
+    return {"ok": True, "normalizado": cfg2.model_dump(), "cantidad": cantidad, **estimar_generacion(cfg2, cantidad)}
+
 @app.post("/icfes/generar")
 def icfes_generar(cfg: GenInput):
     """Genera 1 ítem con validación estricta. No hay fallback en modo rígido."""
+    _PRIORIDAD.set("interactiva")
+    fijar_deadline(cfg.deadline_ms)
     cfg2, errores = validar_input(cfg)
     if errores:
         return {"ok": False, "generadas": 0, "resultados": [], "errores": [{"index": 0, "aviso": e} for e in errores]}
+    banco = _desde_banco_degradado(cfg2, 1)
+    if banco:
+        return {"ok": True, "generadas": 1, "resultados": banco, "errores": [], "degradado": True,
+                "tokens": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
     try:
-        item, tokens_info = generar_una(cfg2)
+        if COALESCE_ENABLED:
+            item, tokens_info, compartido = COALESCEDOR.generar(cfg2)
+        else:
+            (item, tokens_info), compartido = generar_una(cfg2), False
         # Validación estricta de la salida
         item_dict = item.model_dump()
+        item_dict["meta"]["coalescido"] = compartido
         if not item_dict.get("pregunta") or len(item_dict["pregunta"]) < 10:
             raise ValueError("Pregunta generada no cumple con el mínimo de caracteres")
         if not all(k in item_dict.get("opciones", {}) for k in ["A", "B", "C", "D"]):
             raise ValueError("Faltan opciones en la respuesta generada")
+        BANCO.agregar(item_dict)
         return {
             "ok": True,
             "generadas": 1,
@@ -1137,9 +3210,69 @@ def icfes_generar(cfg: GenInput):
         # En modo rígido, NO hay fallback - siempre se retorna error
         return {"ok": False, "generadas": 0, "resultados": [], "errores": [{"index": 0, "aviso": str(e)}]}
 
+@app.post("/icfes/generar_kolb")
+def icfes_generar_kolb(cfg: GenInput, estilos: Optional[List[str]] = Query(None, description="Estilos Kolb (por defecto los 4)")):
+    """
+    Una pregunta del mismo subtema por cada estilo Kolb en UNA sola llamada al modelo
+    (un solo system prompt en vez de uno por estilo). Ignora cfg.estilo_kolb.
+    """
+    _PRIORIDAD.set("interactiva")
+    fijar_deadline(cfg.deadline_ms)
+    cfg2, errores = validar_input(cfg)
+    elegidos: List[str] = []
+    for e in estilos or KOLB_STYLES:
+        k, err = validar_kolb(e)
+        if err:
+            errores.append(err)
+        elif k not in elegidos:
+            elegidos.append(k)
+    if errores:
+        return {"ok": False, "generadas": 0, "resultados": [], "errores": [{"index": 0, "aviso": e} for e in errores]}
+
+    banco = [_desde_banco_degradado(cfg2.model_copy(update={"estilo_kolb": e}), 1) for e in elegidos]
+    if banco and all(banco):
+        return {"ok": True, "generadas": len(elegidos), "resultados": [b[0] for b in banco], "errores": [],
+                "degradado": True, "tokens": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+    try:
+        items, usage, aparte = generar_kolb(cfg2, elegidos)
+    except Exception as e:
+        return {"ok": False, "generadas": 0, "resultados": [], "errores": [{"index": 0, "aviso": str(e)}]}
+    resultados = [it.model_dump() for it in items]
+    for it in resultados:
+        BANCO.agregar(it)
+    por_separado = sum(
+        estimar_tokens_mensajes([{"role": "system", "content": system_prompt(cfg2.area)},
+                                 {"role": "user", "content": user_prompt(cfg2.model_copy(update={"estilo_kolb": e}))}])
+        for e in elegidos
+    )
+    return {
+        "ok": True,
+        "generadas": len(resultados),
+        "resultados": resultados,
+        "errores": [],
+        "llamadas": 1 + len(aparte),
+        "completados_aparte": aparte,
+        "tokens": {k: usage[k] for k in ("prompt_tokens", "completion_tokens", "total_tokens")},
+        "prompt_tokens_estimados": {
+            "una_llamada": estimar_tokens_mensajes(mensajes_kolb(cfg2, elegidos)),
+            "por_separado": por_separado,
+        },
+    }
+
 @app.post("/icfes/generar_pack")
-def icfes_generar_pack(cfg: GenInput, cantidad: int = Query(5, ge=1, le=100, description="Cantidad de preguntas a generar (1-100)")):
-    """Genera N ítems (hasta 100) con validación estricta. Sin fallback en modo rígido."""
+async def icfes_generar_pack(request: Request, cfg: GenInput,
+                             cantidad: int = Query(5, ge=1, le=100, description="Cantidad de preguntas a generar (1-100)"),
+                             id_estudiante: Optional[str] = Query(None, max_length=100, description="Omite ítems que el estudiante ya vio")):
+    """
+    Genera N ítems (hasta 100) con validación estricta. Sin fallback en modo rígido.
+    Con deadline_ms (o X-Deadline-Ms), al agotarse el tiempo devuelve lo generado hasta ese
+    momento con ok=false y `truncado` en lugar de descartarlo. Si el cliente se desconecta,
+    se cancela lo pendiente y los ítems ya generados quedan en el banco.
+    """
+    return await ejecutar_cancelable(request, _generar_pack, cfg, cantidad, id_estudiante)
+
+def _generar_pack(cfg: GenInput, cantidad: int, id_estudiante: Optional[str]) -> dict:
+    fijar_deadline(cfg.deadline_ms)
     cfg2, errores = validar_input(cfg)
     if errores:
         return {"ok": False, "generadas": 0, "resultados": [], "errores": [{"index": 0, "aviso": e} for e in errores]}
@@ -1148,20 +3281,32 @@ def icfes_generar_pack(cfg: GenInput, cantidad: int = Query(5, ge=1, le=100, des
     if not isinstance(cantidad, int) or cantidad < 1 or cantidad > 100:
         return {"ok": False, "generadas": 0, "resultados": [], "errores": [{"index": 0, "aviso": "cantidad debe estar entre 1 y 100"}]}
     
-    resultados, errs, vistos = [], [], set()
+    resultados, errs, vistos, hashes = [], [], set(), []
     max_reintentos = 2  # Máximo 2 reintentos por pregunta en modo rígido
+    exposicion = EXPOSICION.cargar(id_estudiante)
+    
+    # Servicio saturado: primero lo que haya en el banco, solo se genera el faltante
+    for it_dict in _desde_banco_degradado(cfg2, cantidad, exposicion):
+        vistos.add(it_dict["pregunta"])
+        hashes.append(int(it_dict["meta"]["hash"], 16))
+        resultados.append(it_dict)
     
     # Contadores de tokens totales
     total_prompt_tokens = 0
     total_completion_tokens = 0
     total_tokens = 0
     
-    for i in range(cantidad):
+    truncado = None
+    for i in range(len(resultados), cantidad):
         intentos = 0
         generado = False
         
+        if peticion_cancelada():
+            truncado = {"motivo": "cliente_desconectado", "faltantes": cantidad - len(resultados)}
+            break
         while intentos < max_reintentos and not generado:
             try:
+                timeout_llamada()
                 it, tokens_info = generar_una(cfg2)
                 it_dict = it.model_dump()
                 
@@ -1177,8 +3322,12 @@ def icfes_generar_pack(cfg: GenInput, cantidad: int = Query(5, ge=1, le=100, des
                 if not all(k in it_dict.get("opciones", {}) for k in ["A", "B", "C", "D"]):
                     raise ValueError("Faltan opciones en la respuesta generada")
                 
-                # Verificar duplicados
-                if it_dict["pregunta"] in vistos:
+                # Verificar duplicados (en el pack y en lo que el estudiante ya vio)
+                h = hash_item(it_dict)
+                ya_visto = exposicion is not None and h in exposicion
+                if ya_visto:
+                    _metrica_inc("exposicion_descartes")
+                if it_dict["pregunta"] in vistos or ya_visto:
                     if intentos < max_reintentos - 1:
                         time.sleep(0.1)
                         intentos += 1
@@ -1187,23 +3336,39 @@ def icfes_generar_pack(cfg: GenInput, cantidad: int = Query(5, ge=1, le=100, des
                         raise ValueError("No se pudo generar pregunta única después de múltiples intentos")
                 
                 vistos.add(it_dict["pregunta"])
+                hashes.append(h)
+                BANCO.agregar(it_dict)
                 resultados.append(it_dict)
                 generado = True
                 
+            except DeadlineExcedido as e:
+                truncado = {"motivo": "deadline", "aviso": str(e), "faltantes": cantidad - len(resultados)}
+                break
+            except GeneracionCancelada:
+                truncado = {"motivo": "cliente_desconectado", "faltantes": cantidad - len(resultados)}
+                break
             except Exception as e:
                 intentos += 1
                 if intentos >= max_reintentos:
                     errs.append({"index": i, "aviso": str(e), "intentos": intentos})
                     # En modo rígido, no continuamos con fallback
+        if truncado:
+            break
+    if truncado and truncado["motivo"] == "cliente_desconectado":
+        _contar_cancelados(cfg2, truncado["faltantes"])
+    
+    EXPOSICION.marcar(id_estudiante, hashes)
     
     # En modo rígido, solo retornamos OK si NO hay errores
-    ok = (len(errs) == 0 and len(resultados) == cantidad)
+    ok = (len(errs) == 0 and len(resultados) == cantidad and truncado is None)
     return {
         "ok": ok,
         "solicitadas": cantidad,
         "generadas": len(resultados),
         "resultados": resultados,
         "errores": errs,
+        "truncado": truncado,
+        "degradado": _DEGRADADO.get(),
         "tokens": {
             "prompt_tokens": total_prompt_tokens,
             "completion_tokens": total_completion_tokens,
@@ -1212,6 +3377,215 @@ def icfes_generar_pack(cfg: GenInput, cantidad: int = Query(5, ge=1, le=100, des
         }
     }
 
+@app.post("/icfes/simulacro")
+async def icfes_simulacro(request: Request, cfg: SimulacroInput):
+    """
+    Ensambla un simulacro completo: cuotas por área según la estructura oficial, ítems del banco
+    primero y el faltante generado en paralelo entre áreas. Letras correctas repartidas A–D.
+    Si el cliente se desconecta no se generan más ítems; los ya generados quedan en el banco.
+    """
+    return await ejecutar_cancelable(request, _ensamblar_simulacro, cfg)
+
+def _ensamblar_simulacro(cfg: SimulacroInput) -> dict:
+    fijar_deadline(cfg.deadline_ms)
+    errores, areas = [], []
+    for a in (cfg.areas or list(ALLOWED.keys())):
+        area_ok, err = validar_area(a)
+        if err:
+            errores.append(err)
+        elif area_ok not in areas:
+            areas.append(area_ok)
+    kolb_ok, err = validar_kolb(cfg.estilo_kolb)
+    if err:
+        errores.append(err)
+    if cfg.longitud_min >= cfg.longitud_max:
+        errores.append(f"longitud_min ({cfg.longitud_min}) debe ser menor que longitud_max ({cfg.longitud_max})")
+    if not errores and cfg.cantidad_total < len(areas):
+        errores.append(f"cantidad_total ({cfg.cantidad_total}) debe ser al menos el número de áreas ({len(areas)})")
+    if errores:
+        return {"ok": False, "generadas": 0, "resultados": [], "errores": [{"index": 0, "aviso": e} for e in errores]}
+
+    t0 = time.time()
+    cuotas = cuotas_simulacro(cfg.cantidad_total, areas)
+    usados: set = set()
+    lock = threading.Lock()
+    exposicion = EXPOSICION.cargar(cfg.id_estudiante)
+    secciones: Dict[str, List[Optional[dict]]] = {}
+    ejes: Dict[str, List[str]] = {}
+    pendientes = []
+
+    for area in areas:
+        plan = plan_area_simulacro(area, cuotas[area])
+        slots: List[Optional[dict]] = [None] * len(plan)
+        if cfg.usar_banco or _DEGRADADO.get():
+            por_subtema: Dict[str, List[int]] = {}
+            for i, (sub, _) in enumerate(plan):
+                por_subtema.setdefault(sub, []).append(i)
+            for sub, idxs in por_subtema.items():
+                for i, it in zip(idxs, BANCO.muestrear(area, sub, kolb_ok, len(idxs), exposicion, usados)):
+                    usados.add(int(it["meta"]["hash"], 16))
+                    slots[i] = it
+        for i, (sub, _) in enumerate(plan):
+            if slots[i] is None:
+                cfg_item = GenInput(area=area, subtema=sub, estilo_kolb=kolb_ok,
+                                    longitud_min=cfg.longitud_min, longitud_max=cfg.longitud_max,
+                                    temperatura=cfg.temperatura)
+                pendientes.append((area, i, cfg_item))
+        secciones[area] = slots
+        ejes[area] = [eje for _, eje in plan]
+
+    # Faltante: todas las áreas en paralelo (el tiempo total ≈ el del área más lenta)
+    del_banco = cfg.cantidad_total - len(pendientes)
+    futuros = {
+        _enviar(_GENERACION_POOL, _generar_para_slot, c, usados, exposicion, lock): (area, i, c)
+        for area, i, c in pendientes
+    }
+    errs = []
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for fut, (area, i, c) in futuros.items():
+        item, usage, error = fut.result()
+        tokens = _sumar_usage(tokens, usage)
+        if item is None:
+            errs.append({"index": i, "area": area, "aviso": error})
+            if peticion_cancelada():
+                _contar_cancelados(c, 1)
+            continue
+        item["meta"]["source"] = "generada"
+        BANCO.agregar(item)
+        secciones[area][i] = item
+
+    todas = []
+    for area in areas:
+        for item, eje in zip(secciones[area], ejes[area]):
+            if item is not None:
+                item["meta"]["eje_icfes"] = eje
+                todas.append(item)
+    distribucion = balancear_respuestas(todas)
+    EXPOSICION.marcar(cfg.id_estudiante, [hash_item(it) for it in todas])
+
+    return {
+        "ok": not errs and len(todas) == cfg.cantidad_total,
+        "truncado": (
+            None if len(todas) == cfg.cantidad_total
+            else {"motivo": "cliente_desconectado", "faltantes": cfg.cantidad_total - len(todas)} if peticion_cancelada()
+            else {"motivo": "deadline", "faltantes": cfg.cantidad_total - len(todas)} if (tiempo_restante_s() or 1.0) <= 0
+            else None
+        ),
+        "solicitadas": cfg.cantidad_total,
+        "total": len(todas),
+        "del_banco": del_banco,
+        "generadas": len(todas) - del_banco,
+        "cuotas": cuotas,
+        "secciones": [
+            {
+                "area": area,
+                "area_oficial": ICFES_AREA_ALIAS.get(area, area),
+                "preguntas": [it for it in secciones[area] if it is not None],
+            }
+            for area in areas
+        ],
+        "distribucion_respuestas": distribucion,
+        "errores": errs,
+        "tokens": tokens,
+        "tiempo_ms": int((time.time() - t0) * 1000),
+    }
+
+@app.post("/icfes/generar_mixto")
+async def icfes_generar_mixto(request: Request, cfg: MixtoInput):
+    """
+    Pack con varias celdas (área, subtema, estilo_kolb, cantidad) en una sola petición. Se valida
+    todo junto; cada entrada se cubre con stock (sobrantes de la coalescencia), banco y, lo que
+    falte, con lotes al proveedor que corren en paralelo entre entradas. Resultados agrupados
+    por entrada y en el orden pedido.
+    """
+    return await ejecutar_cancelable(request, _generar_mixto, cfg)
+
+def _generar_mixto(cfg: MixtoInput) -> dict:
+    fijar_deadline(cfg.deadline_ms)
+    errores, cfgs = [], []
+    for i, e in enumerate(cfg.entradas):
+        c, errs_entrada = validar_input(GenInput(area=e.area, subtema=e.subtema, estilo_kolb=e.estilo_kolb,
+                                                 longitud_min=cfg.longitud_min, longitud_max=cfg.longitud_max,
+                                                 temperatura=cfg.temperatura))
+        errores.extend({"index": i, "aviso": x} for x in errs_entrada)
+        cfgs.append(c)
+    cantidades = [e.cantidad for e in cfg.entradas]
+    if sum(cantidades) > 100:
+        errores.append({"index": 0, "aviso": f"La suma de cantidades ({sum(cantidades)}) no puede superar 100"})
+    if errores:
+        return {"ok": False, "generadas": 0, "grupos": [], "errores": errores, "sugerencias": catalogo()}
+
+    t0 = time.time()
+    excluir: set = set()
+    lock = threading.Lock()
+    exposicion = EXPOSICION.cargar(cfg.id_estudiante)
+    grupos, plan = planificar_mixto(cfgs, cantidades, cfg.usar_banco, exposicion, excluir, lock)
+    for grupo in grupos:
+        for it in grupo:
+            if it["meta"]["source"] == "stock":
+                BANCO.agregar(it)
+
+    # Lo que falta va al proveedor en lotes de hasta MIXTO_LOTE_MAX, todos en paralelo;
+    # una segunda ronda repone lo descartado por repetido o inválido.
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    ultimo_error: Dict[int, str] = {}
+    for _ in range(2):
+        tramos = []
+        for i, (c, n) in enumerate(zip(cfgs, cantidades)):
+            falta = n - len(grupos[i])
+            while falta > 0:
+                tramos.append((i, c, min(falta, MIXTO_LOTE_MAX)))
+                falta -= MIXTO_LOTE_MAX
+        if not tramos or peticion_cancelada() or (tiempo_restante_s() or 1.0) <= 0:
+            break
+        futuros = {
+            _enviar(_GENERACION_POOL, _generar_tramo, c, k, excluir, exposicion, lock): i
+            for i, c, k in tramos
+        }
+        for fut, i in futuros.items():
+            items, usage, error = fut.result()
+            tokens = _sumar_usage(tokens, usage)
+            if error:
+                ultimo_error[i] = error
+            for it in items:
+                it["meta"]["source"] = "generada"
+                BANCO.agregar(it)
+            grupos[i].extend(items)
+
+    errs = []
+    for i, (c, n) in enumerate(zip(cfgs, cantidades)):
+        faltantes = n - len(grupos[i])
+        if faltantes > 0:
+            errs.append({"index": i, "faltantes": faltantes,
+                         "aviso": ultimo_error.get(i, "No se pudo generar pregunta única después de múltiples intentos")})
+            if peticion_cancelada():
+                _contar_cancelados(c, faltantes)
+    todas = [it for grupo in grupos for it in grupo]
+    EXPOSICION.marcar(cfg.id_estudiante, [hash_item(it) for it in todas])
+    solicitadas = sum(cantidades)
+
+    return {
+        "ok": not errs,
+        "truncado": (
+            None if len(todas) == solicitadas
+            else {"motivo": "cliente_desconectado", "faltantes": solicitadas - len(todas)} if peticion_cancelada()
+            else {"motivo": "deadline", "faltantes": solicitadas - len(todas)} if (tiempo_restante_s() or 1.0) <= 0
+            else None
+        ),
+        "solicitadas": solicitadas,
+        "generadas": len(todas),
+        "plan": plan,
+        "grupos": [
+            {"index": i, "area": c.area, "subtema": c.subtema, "estilo_kolb": c.estilo_kolb,
+             "solicitadas": n, "preguntas": grupos[i]}
+            for i, (c, n) in enumerate(zip(cfgs, cantidades))
+        ],
+        "errores": errs,
+        "degradado": _DEGRADADO.get(),
+        "tokens": tokens,
+        "tiempo_ms": int((time.time() - t0) * 1000),
+    }
+
 @app.post("/debug/raw")
 def debug_raw(cfg: GenInput):
     """Muestra salida RAW del modelo (para depurar formato). Valida/normaliza antes."""
@@ -1222,14 +3596,16 @@ def debug_raw(cfg: GenInput):
         {"role": "system", "content": system_prompt(cfg2.area)},
         {"role": "user", "content": user_prompt(cfg2)},
     ]
-    raw1, tokens1 = chat_openai(msgs, max_tokens=cfg2.max_tokens_item, temperature=cfg2.temperatura)
+    modelo = MODEL_TIERS[nivel_modelo(cfg2.area, cfg2.subtema)]
+    raw1, tokens1 = chat_openai(msgs, max_tokens=cfg2.max_tokens_item, temperature=cfg2.temperatura, modelo=modelo)
     if "{" not in raw1 or "pregunta" not in raw1:
         msgs.append({"role": "user", "content":
             "RECUERDA: devuelve SOLO UN OBJETO JSON EXACTO del esquema indicado. "
             "No escribas nada fuera del JSON. No uses 'items'. Incluye la clave 'pregunta'."})
-        raw2, tokens2 = chat_openai(msgs, max_tokens=cfg2.max_tokens_item, temperature=0.0)
+        raw2, tokens2 = chat_openai(msgs, max_tokens=cfg2.max_tokens_item, temperature=0.0, modelo=modelo)
         return {
             "ok": True,
+            "modelo": modelo,
             "raw1": raw1,
             "raw2": raw2,
             "tokens1": tokens1,
@@ -1240,7 +3616,35 @@ def debug_raw(cfg: GenInput):
                 "total_tokens": tokens1["total_tokens"] + tokens2["total_tokens"]
             }
         }
-    return {"ok": True, "raw": raw1, "tokens": tokens1}
+    return {"ok": True, "modelo": modelo, "raw": raw1, "tokens": tokens1}
+
+PERFILADOR = PerfiladorMuestreo()
+
+@app.get("/debug/profile")
+def debug_profile(
+    request: Request,
+    segundos: float = Query(5.0, gt=0, le=60, description="Duración del muestreo"),
+    intervalo_ms: float = Query(10.0, ge=1, le=1000, description="Intervalo entre muestras"),
+    formato: str = Query("json", pattern="^(json|collapsed)$", description="json o collapsed (texto para flamegraph.pl)"),
+    incluir_ociosos: bool = Query(False, description="Incluir hilos sin código del proyecto en la pila"),
+    top: int = Query(40, ge=1, le=500, description="Funciones en el resumen"),
+):
+    """
+    Perfila el proceso (todas las peticiones en vivo) durante `segundos` tomando las pilas de
+    todos los hilos. Devuelve pilas "collapsed" y, por función, tiempo de pared vs CPU.
+    """
+    if not DEBUG_TOKEN:
+        return JSONResponse(status_code=404, content={"ok": False, "errores": ["DEBUG_TOKEN no configurado"]})
+    token = request.headers.get("X-Debug-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), DEBUG_TOKEN.encode("utf-8")):
+        return JSONResponse(status_code=403, content={"ok": False, "errores": ["X-Debug-Token inválido"]})
+    try:
+        perfil = PERFILADOR.perfilar(segundos, intervalo_ms / 1000.0, incluir_ociosos, top)
+    except PerfiladorOcupado as e:
+        return JSONResponse(status_code=409, content={"ok": False, "errores": [str(e)]})
+    if formato == "collapsed":
+        return Response(perfil["collapsed"] + "\n", media_type="text/plain; charset=utf-8")
+    return {"ok": True, "perfil": perfil}
 
 if __name__ == "__main__":
     import uvicorn
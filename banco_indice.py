@@ -0,0 +1,345 @@
+# banco_indice.py — Índice en arreglos (NumPy, memory-mapped) del banco de preguntas
+# ------------------------------------------------------------
+# Índice de solo lectura junto al JSONL del banco (directorio <banco>.idx/):
+# - offsets.npy (int64): posición en bytes de cada línea del JSONL
+# - hashes.npy (uint64): hash del ítem (meta.hash) para exclusión y exposición
+# - celdas.npy (int32): id de la celda (área|subtema|estilo_kolb) de cada fila
+# - orden.npy (int32) + ptr.npy (int64): filas agrupadas por celda (estilo CSR)
+# - calidad_base.npy / letras.npy / calidad.npy: puntaje de calidad_banco.py; el sampler puede
+#   descartar ítems débiles (calidad_min) o ponderar por calidad sin leer el JSONL
+# - meta.json: celdas conocidas y bytes del JSONL ya indexados
+# Los arreglos se abren con mmap_mode="r": los procesos (workers de uvicorn, generar_banco.py)
+# comparten las mismas páginas del sistema operativo y no cargan ítems en diccionarios.
+# El muestreo (uniforme, ponderado, estratificado, con exclusión y filtro de Bloom) es vectorizado;
+# solo se leen del disco las líneas elegidas.
+# ------------------------------------------------------------
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from calidad_banco import calidad_base, extraer_rasgos, factor_letras
+
+VERSION_INDICE = 2
+COLUMNAS = {"offsets": np.int64, "hashes": np.uint64, "celdas": np.int32,
+            "calidad_base": np.float32, "letras": np.int8}
+LOTE_RASGOS = 10_000
+
+# ===================== Filtro de Bloom vectorizado =====================
+
+def bloom_contiene(bits: bytes, m: int, k: int, hashes: np.ndarray) -> np.ndarray:
+    """
+    Versión vectorizada de la consulta del filtro de Bloom de EduExce (doble hashing h1 + i*h2).
+    Devuelve una máscara booleana: True si el hash (probablemente) está en el filtro.
+    """
+    if hashes.size == 0:
+        return np.zeros(0, dtype=bool)
+    arr = np.frombuffer(bits, dtype=np.uint8)
+    h = hashes.astype(np.uint64, copy=False)
+    h1 = h & np.uint64(0xFFFFFFFF)
+    h2 = (h >> np.uint64(32)) | np.uint64(1)
+    pos = (h1[:, None] + np.arange(k, dtype=np.uint64)[None, :] * h2[:, None]) % np.uint64(m)
+    return ((arr[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1).all(axis=1)
+
+# ===================== Índice =====================
+
+class IndiceBanco:
+    """
+    Índice del JSONL del banco. `clave_fn(item) -> "área|subtema|kolb"`, `hash_fn(item) -> int` y
+    `norm_fn` (para el puntaje de calidad) vienen de EduExce para no duplicar la normalización.
+    Las filas agregadas en este proceso quedan pendientes en memoria (ya se pueden muestrear)
+    hasta `actualizar()`, que indexa la cola del JSONL y reescribe el directorio de forma atómica.
+    En un servidor se usa `actualizar_en_segundo_plano()`: la reescritura es O(N) y no debe
+    correr en el camino de una petición.
+    """
+    def __init__(self, banco_path: str, clave_fn: Callable[[dict], str], hash_fn: Callable[[dict], int],
+                 norm_fn: Callable[[str], str], plantillas: Optional[Set[str]] = None):
+        self.banco_path = banco_path
+        self.dir = banco_path + ".idx"
+        self.clave_fn = clave_fn
+        self.hash_fn = hash_fn
+        self.norm_fn = norm_fn
+        self.plantillas = plantillas or set()
+        self._lock = threading.Lock()
+        self._col: Dict[str, np.ndarray] = {}
+        self._celdas: List[str] = []
+        self._id_celda: Dict[str, int] = {}
+        self._bytes = 0
+        self._pend: Dict[str, List[Tuple[int, int, float]]] = {}
+        self._reconstruyendo = False
+        os.makedirs(self.dir, exist_ok=True)
+        self.actualizar()
+
+    # ---------- Persistencia ----------
+
+    @contextmanager
+    def _bloqueo(self, exclusivo: bool):
+        with open(os.path.join(self.dir, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _vacio() -> Dict[str, np.ndarray]:
+        col = {n: np.zeros(0, dtype=t) for n, t in COLUMNAS.items()}
+        col.update(calidad=np.zeros(0, dtype=np.float32), orden=np.zeros(0, dtype=np.int32),
+                   ptr=np.zeros(1, dtype=np.int64))
+        return col
+
+    def _meta_valida(self) -> bool:
+        ruta_meta = os.path.join(self.dir, "meta.json")
+        if not os.path.exists(ruta_meta):
+            return False
+        with open(ruta_meta, "r", encoding="utf-8") as f:
+            return json.load(f).get("version") == VERSION_INDICE
+
+    def _cargar(self) -> Tuple[Dict[str, np.ndarray], List[str], int]:
+        if not self._meta_valida():  # sin índice o de una versión anterior: reconstruir
+            return self._vacio(), [], 0
+        with open(os.path.join(self.dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        col = {n: np.load(os.path.join(self.dir, f"{n}.npy"), mmap_mode="r")
+               for n in list(COLUMNAS) + ["calidad", "orden", "ptr"]}
+        return col, meta["celdas"], int(meta["bytes"])
+
+    def _guardar(self, col: Dict[str, np.ndarray], celdas: List[str], nbytes: int) -> None:
+        for nombre, arr in col.items():
+            tmp = os.path.join(self.dir, f"{nombre}.tmp.npy")
+            np.save(tmp, arr)
+            os.replace(tmp, os.path.join(self.dir, f"{nombre}.npy"))
+        tmp = os.path.join(self.dir, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": VERSION_INDICE, "celdas": celdas, "bytes": nbytes,
+                       "filas": int(len(col["offsets"]))}, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.dir, "meta.json"))
+
+    def _filas_nuevas(self, desde: int) -> Tuple[Dict[str, list], int]:
+        """Lee el JSONL desde el byte `desde` y devuelve las columnas de las filas completas."""
+        nuevas: Dict[str, list] = {"offsets": [], "hashes": [], "claves": [], "calidad_base": [], "letras": []}
+        fin = desde
+        if not os.path.exists(self.banco_path):
+            return nuevas, desde
+        lote: List[dict] = []
+
+        def puntuar_lote() -> None:
+            r = extraer_rasgos(lote, self.norm_fn, self.plantillas)
+            nuevas["calidad_base"].append(calidad_base(r))
+            nuevas["letras"].append(r["letras"])
+            lote.clear()
+
+        with open(self.banco_path, "rb") as f:
+            f.seek(desde)
+            for linea in f:
+                if not linea.endswith(b"\n"):
+                    break  # línea a medio escribir: se indexa en la próxima actualización
+                if linea.strip():
+                    item = json.loads(linea)
+                    h = item.get("meta", {}).get("hash")
+                    nuevas["offsets"].append(fin)
+                    nuevas["hashes"].append(int(h, 16) if h else self.hash_fn(item))
+                    nuevas["claves"].append(self.clave_fn(item))
+                    lote.append(item)
+                    if len(lote) >= LOTE_RASGOS:
+                        puntuar_lote()
+                fin += len(linea)
+        if lote:
+            puntuar_lote()
+        return nuevas, fin
+
+    def actualizar(self) -> int:
+        """
+        Indexa lo agregado al JSONL desde la última vez (por cualquier proceso). Devuelve filas nuevas.
+        Costo O(N) en filas del banco, no en filas nuevas: calidad (término por celda), orden y ptr se
+        recalculan sobre todo el banco y cada .npy se reescribe completo (tmp + os.replace, para que
+        los lectores con mmap no vean un arreglo a medias). Unos 33 bytes por fila: con 1e6 filas,
+        ~33 MB escritos por actualización; por eso EduExce agrupa BANCO_INDICE_FLUSH filas por llamada
+        y la lanza con actualizar_en_segundo_plano(). Las filas anexadas mientras tanto (más allá de
+        los bytes indexados) siguen pendientes después del cambio de arreglos.
+        """
+        with self._bloqueo(exclusivo=True):
+            col, celdas, nbytes = self._cargar()
+            tam = os.path.getsize(self.banco_path) if os.path.exists(self.banco_path) else 0
+            if tam < nbytes:  # el JSONL fue reemplazado: reconstruir desde cero
+                col, celdas, nbytes = self._vacio(), [], 0
+            nuevas, fin = self._filas_nuevas(nbytes)
+            n = len(nuevas["offsets"])
+            if n or not self._meta_valida():
+                id_celda = {c: i for i, c in enumerate(celdas)}
+                for c in nuevas["claves"]:
+                    if c not in id_celda:
+                        id_celda[c] = len(celdas)
+                        celdas.append(c)
+                nuevo = {
+                    "offsets": np.concatenate([col["offsets"], np.asarray(nuevas["offsets"], dtype=np.int64)]),
+                    "hashes": np.concatenate([col["hashes"], np.asarray(nuevas["hashes"], dtype=np.uint64)]),
+                    "celdas": np.concatenate([col["celdas"],
+                                              np.asarray([id_celda[c] for c in nuevas["claves"]], dtype=np.int32)]),
+                    "calidad_base": np.concatenate([col["calidad_base"]] + nuevas["calidad_base"]),
+                    "letras": np.concatenate([col["letras"]] + nuevas["letras"]).astype(np.int8),
+                }
+                # El término de letras es por celda: se recalcula sobre todo el banco (vectorizado)
+                nuevo["calidad"] = (nuevo["calidad_base"] * factor_letras(nuevo["celdas"], nuevo["letras"])
+                                    ).astype(np.float32)
+                nuevo["orden"] = np.argsort(nuevo["celdas"], kind="stable").astype(np.int32)
+                nuevo["ptr"] = np.concatenate([[0], np.cumsum(np.bincount(nuevo["celdas"], minlength=len(celdas)))]
+                                              ).astype(np.int64)
+                self._guardar(nuevo, celdas, fin)
+                col, celdas, nbytes = self._cargar()
+        with self._lock:
+            self._col, self._celdas, self._bytes = col, celdas, nbytes
+            self._id_celda = {c: i for i, c in enumerate(celdas)}
+            self._pend = {c: resto for c, filas in self._pend.items()
+                          if (resto := [f for f in filas if f[0] >= nbytes])}
+        return n
+
+    def actualizar_en_segundo_plano(self) -> bool:
+        """
+        actualizar() en un hilo aparte, uno a la vez. Mientras corre, los lectores siguen con los
+        arreglos actuales más las filas pendientes. Devuelve False si ya había uno en curso.
+        """
+        with self._lock:
+            if self._reconstruyendo:
+                return False
+            self._reconstruyendo = True
+
+        def correr() -> None:
+            try:
+                self.actualizar()
+            finally:
+                with self._lock:
+                    self._reconstruyendo = False
+
+        threading.Thread(target=correr, name="banco-indice", daemon=True).start()
+        return True
+
+    # ---------- Escritura en caliente ----------
+
+    def anexar(self, offset: int, clave: str, h: int, calidad: float = 1.0) -> None:
+        """Registra una fila recién escrita en el JSONL (visible para muestrear antes de actualizar())."""
+        with self._lock:
+            self._pend.setdefault(clave, []).append((offset, h, calidad))
+
+    def puntuar(self, item: dict) -> float:
+        """Calidad de un ítem suelto (sin el término por celda)."""
+        return float(calidad_base(extraer_rasgos([item], self.norm_fn, self.plantillas))[0])
+
+    def pendientes(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self._pend.values())
+
+    # ---------- Lectura ----------
+
+    def hashes(self) -> np.ndarray:
+        with self._lock:
+            extra = [h for v in self._pend.values() for _, h, _ in v]
+            return np.concatenate([self._col["hashes"], np.asarray(extra, dtype=np.uint64)])
+
+    def conteos(self) -> Dict[str, int]:
+        with self._lock:
+            ptr = self._col["ptr"]
+            out = {c: int(ptr[i + 1] - ptr[i]) for i, c in enumerate(self._celdas)}
+            for c, filas in self._pend.items():
+                out[c] = out.get(c, 0) + len(filas)
+        return {c: n for c, n in out.items() if n}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(len(self._col["offsets"])) + sum(len(v) for v in self._pend.values())
+
+    def resumen_calidad(self) -> dict:
+        with self._lock:
+            cal = self._col.get("calidad")
+        if cal is None or len(cal) == 0:
+            return {"items_indexados": 0}
+        return {"items_indexados": int(len(cal)), "media": round(float(cal.mean()), 4),
+                "p10_p50_p90": [round(float(x), 4) for x in np.percentile(cal, [10, 50, 90])]}
+
+    def _filas_celda(self, clave: str) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(columnas, filas base de la celda, offsets / hashes / calidad pendientes)."""
+        with self._lock:
+            col = self._col
+            i = self._id_celda.get(clave)
+            filas = col["orden"][col["ptr"][i]:col["ptr"][i + 1]] if i is not None else np.zeros(0, dtype=np.int32)
+            pend = self._pend.get(clave, [])
+            p_off = np.asarray([o for o, _, _ in pend], dtype=np.int64)
+            p_h = np.asarray([h for _, h, _ in pend], dtype=np.uint64)
+            p_cal = np.asarray([c for _, _, c in pend], dtype=np.float32)
+        return col, filas, p_off, p_h, p_cal
+
+    def muestrear(self, clave: str, n: int, excluir: Optional[Iterable[int]] = None,
+                  bloom: Optional[Tuple[int, int, Sequence[bytes]]] = None,
+                  pesos: Union[None, str, np.ndarray] = None, calidad_min: float = 0.0,
+                  rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """
+        Hasta n offsets distintos de la celda `clave`, sin los hashes de `excluir`, sin los que
+        el filtro `bloom` = (m, k, [bits...]) ya contiene y sin ítems con calidad < `calidad_min`.
+        `pesos` (arreglo por fila base, o "calidad") activa muestreo ponderado sin reemplazo
+        (Efraimidis–Spirakis); las filas pendientes pesan 1 (o su calidad).
+        """
+        rng = rng or np.random.default_rng()
+        col, filas, p_off, p_h, p_cal = self._filas_celda(clave)
+        total = len(filas) + len(p_off)
+        if n <= 0 or total == 0:
+            return np.zeros(0, dtype=np.int64)
+        excl = np.fromiter((int(h) for h in excluir), dtype=np.uint64) if excluir else None
+        filtra = (excl is not None and excl.size > 0) or bloom is not None or calidad_min > 0
+
+        def candidatos(pos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+            base = pos < len(filas)
+            idx_base = filas[pos[base]]
+            offs = np.concatenate([col["offsets"][idx_base], p_off[pos[~base] - len(filas)]])
+            hs = np.concatenate([col["hashes"][idx_base], p_h[pos[~base] - len(filas)]])
+            cal = np.concatenate([col["calidad"][idx_base], p_cal[pos[~base] - len(filas)]])
+            w = None
+            if isinstance(pesos, str):
+                w = cal
+            elif pesos is not None:
+                w = np.concatenate([np.asarray(pesos)[idx_base], np.ones(int((~base).sum()))])
+            ok = cal >= calidad_min
+            if excl is not None and excl.size > 0:
+                ok &= ~np.isin(hs, excl)
+            if bloom is not None:
+                m, k, generaciones = bloom
+                for bits in generaciones:
+                    ok &= ~bloom_contiene(bits, m, k, hs)
+            if w is not None:
+                ok &= w > 0
+                return offs[ok], w[ok]
+            return offs[ok], None
+
+        # Camino rápido: sobre-muestrear pocas posiciones y filtrar solo esas
+        if pesos is None and total > 4 * n + 32:
+            pos = rng.choice(total, size=2 * n + 16 if filtra else n, replace=False)
+            offs, _ = candidatos(pos)
+            if len(offs) >= n:
+                return offs[:n]
+        offs, w = candidatos(np.arange(total))
+        if len(offs) <= n:
+            return rng.permutation(offs)
+        if w is None:
+            return offs[rng.choice(len(offs), size=n, replace=False)]
+        claves = np.log(rng.random(len(offs))) / w
+        top = np.argpartition(-claves, n - 1)[:n]
+        return offs[top[np.argsort(-claves[top])]]
+
+    def muestrear_estratificado(self, cuotas: Dict[str, int], **kwargs) -> Dict[str, np.ndarray]:
+        """Muestreo por estratos: `cuotas` = {clave de celda: n}; mismos filtros que muestrear()."""
+        return {clave: self.muestrear(clave, n, **kwargs) for clave, n in cuotas.items()}
+
+    def leer(self, offsets: Sequence[int]) -> List[dict]:
+        """Lee del JSONL solo las líneas indicadas (en el orden dado)."""
+        out = []
+        if len(offsets) == 0:
+            return out
+        with open(self.banco_path, "rb") as f:
+            for off in offsets:
+                f.seek(int(off))
+                out.append(json.loads(f.readline()))
+        return out
@@ -0,0 +1,152 @@
+# busqueda_banco.py — Búsqueda de texto completo (BM25) sobre el banco de preguntas
+# ------------------------------------------------------------
+# Índice invertido en memoria sobre el JSONL del banco (enunciado, opciones y explicación):
+# - término -> postings (ids de documento en array('I') y frecuencias en array('H'))
+# - por documento: offset en el JSONL, largo en términos e ids de área, subtema y estilo Kolb
+# Los términos se normalizan con la misma función que EduExce (_norm: minúsculas, sin tildes),
+# aplicada una vez por forma de palabra distinta (caché) y no sobre cada texto completo.
+# El índice se actualiza de forma incremental leyendo la cola del JSONL (lo que agregó este u
+# otro proceso desde la última consulta). El puntaje BM25 se acumula en un arreglo denso de NumPy
+# por consulta: a 100k+ ítems la consulta toma pocos milisegundos.
+# ------------------------------------------------------------
+
+import json
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_CACHE_NORM = 200_000  # formas de palabra ya normalizadas (se vacía al llenarse)
+_PATRON_TERMINO = re.compile(r"\w+", re.UNICODE)
+# Palabras demasiado frecuentes para aportar al ranking (ya normalizadas, sin tildes)
+STOPWORDS = frozenset("""
+a al algo ante como con cual cuando de del desde donde e el ella ellos en entre era es esta este esto
+fue ha hay la las le les lo los mas mi muy no o para pero por que se segun si sin sobre su sus tambien
+te tiene un una uno unos unas y ya the of and to in is are was an it on for that with as at be by this
+""".split())
+
+class IndiceBusqueda:
+    """
+    Índice invertido del JSONL del banco. `norm_fn` viene de EduExce para no duplicar la
+    normalización. Las consultas llaman a `actualizar()` antes de buscar (solo lee lo nuevo).
+    """
+    def __init__(self, banco_path: str, norm_fn: Callable[[str], str]):
+        self.banco_path = banco_path
+        self.norm_fn = norm_fn
+        self._lock = threading.Lock()
+        self._cache_norm: Dict[str, str] = {}
+        self._reiniciar()
+
+    def _reiniciar(self) -> None:
+        self._bytes = 0
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._offsets = array("q")
+        self._largos = array("I")
+        self._area, self._subtema, self._kolb = array("i"), array("i"), array("i")
+        self._categorias: Dict[str, Dict[str, int]] = {"area": {}, "subtema": {}, "kolb": {}}
+        self._total_terminos = 0
+
+    def _normalizar(self, palabra: str) -> str:
+        t = self._cache_norm.get(palabra)
+        if t is None:
+            if len(self._cache_norm) >= MAX_CACHE_NORM:
+                self._cache_norm.clear()
+            t = self._cache_norm[palabra] = self.norm_fn(palabra)
+        return t
+
+    def terminos(self, texto: str) -> List[str]:
+        terminos = (self._normalizar(p) for p in _PATRON_TERMINO.findall((texto or "").lower()))
+        return [t for t in terminos if t not in STOPWORDS]
+
+    def _categoria(self, campo: str, valor: str) -> int:
+        ids = self._categorias[campo]
+        return ids.setdefault(valor, len(ids))
+
+    def _indexar(self, offset: int, item: dict) -> None:
+        textos = [item.get("pregunta") or "", item.get("explicacion") or ""]
+        textos += [str(v) for v in (item.get("opciones") or {}).values()]
+        # Se cuenta por forma de palabra y se normaliza cada forma distinta una sola vez
+        frecuencias: Dict[str, int] = {}
+        for palabra, n in Counter(_PATRON_TERMINO.findall(" ".join(textos).lower())).items():
+            t = self._normalizar(palabra)
+            if t not in STOPWORDS:
+                frecuencias[t] = frecuencias.get(t, 0) + n
+        doc = len(self._offsets)
+        for t, tf in frecuencias.items():
+            ids, tfs = self._postings.setdefault(t, (array("I"), array("H")))
+            ids.append(doc)
+            tfs.append(min(tf, 0xFFFF))
+        largo = sum(frecuencias.values())
+        self._offsets.append(offset)
+        self._largos.append(largo)
+        self._total_terminos += largo
+        self._area.append(self._categoria("area", item.get("area") or ""))
+        self._subtema.append(self._categoria("subtema", item.get("subtema") or ""))
+        self._kolb.append(self._categoria("kolb", item.get("estilo_kolb") or "Convergente"))
+
+    def actualizar(self) -> int:
+        """Indexa las líneas completas agregadas al JSONL desde la última vez. Devuelve cuántas."""
+        with self._lock:
+            tam = os.path.getsize(self.banco_path) if os.path.exists(self.banco_path) else 0
+            if tam < self._bytes:  # el JSONL fue reemplazado: reconstruir desde cero
+                self._reiniciar()
+            if tam == self._bytes:
+                return 0
+            n = 0
+            with open(self.banco_path, "rb") as f:
+                f.seek(self._bytes)
+                offset = self._bytes
+                for linea in f:
+                    if not linea.endswith(b"\n"):  # otro proceso la está escribiendo
+                        break
+                    if linea.strip():
+                        self._indexar(offset, json.loads(linea))
+                        n += 1
+                    offset += len(linea)
+            self._bytes = offset
+            return n
+
+    def buscar(self, consulta: str, limite: int = 20, area: Optional[str] = None,
+               subtema: Optional[str] = None, estilo_kolb: Optional[str] = None) -> Tuple[List[Tuple[int, float]], int]:
+        """
+        Devuelve ([(offset, puntaje), ...] ordenados por BM25, total de coincidencias).
+        Los filtros son valores exactos (ya validados contra el catálogo).
+        """
+        terminos = list(dict.fromkeys(self.terminos(consulta)))
+        with self._lock:
+            n_docs = len(self._offsets)
+            if not terminos or not n_docs:
+                return [], 0
+            largos = np.frombuffer(self._largos, dtype=np.uint32)
+            norma = BM25_K1 * (1 - BM25_B + BM25_B * largos / (self._total_terminos / n_docs))
+            puntajes = np.zeros(n_docs, dtype=np.float32)
+            for t in terminos:
+                postings = self._postings.get(t)
+                if postings is None:
+                    continue
+                ids = np.frombuffer(postings[0], dtype=np.uint32)
+                tf = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+                idf = np.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+                puntajes[ids] += idf * tf * (BM25_K1 + 1) / (tf + norma[ids])
+            mascara = puntajes > 0
+            for campo, valor, col in (("area", area, self._area), ("subtema", subtema, self._subtema),
+                                      ("kolb", estilo_kolb, self._kolb)):
+                if valor is not None:
+                    cid = self._categorias[campo].get(valor, -1)
+                    mascara &= np.frombuffer(col, dtype=np.int32) == cid
+            candidatos = np.flatnonzero(mascara)
+            if len(candidatos) > limite:
+                candidatos = candidatos[np.argpartition(-puntajes[candidatos], limite - 1)[:limite]]
+            candidatos = candidatos[np.argsort(-puntajes[candidatos], kind="stable")]
+            offsets = np.frombuffer(self._offsets, dtype=np.int64)
+            return [(int(offsets[d]), float(puntajes[d])) for d in candidatos], int(mascara.sum())
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"documentos": len(self._offsets), "terminos": len(self._postings), "bytes_indexados": self._bytes}
@@ -0,0 +1,149 @@
+# calidad_banco.py — Puntaje de calidad vectorizado (NumPy) para los ítems del banco
+# ------------------------------------------------------------
+# ensure_schema / ItemOut validan un ítem a la vez (estructura). Aquí se puntúa el banco completo
+# de una sola pasada: una extracción en Python de números por ítem y el resto en arreglos.
+# Señales (cada una en [0, 1], 1 = bien):
+# - longitud: palabras del enunciado dentro de [longitud_min, longitud_max] (meta.longitud o 200–350)
+# - balance: dispersión (coef. de variación) de la longitud de las cuatro opciones
+# - correcta_larga: la correcta es claramente la opción más larga (pista para el estudiante)
+# - explicacion: explicación vacía o plantilla de build_explanation_per_area
+# - duplicadas: opciones repetidas tras normalizar (factor multiplicativo)
+# - letras (por celda): la letra correcta está sobrerrepresentada en su celda
+# calidad = promedio ponderado de las señales de ítem × duplicadas × factor de letras de la celda
+#
+# Uso:  python calidad_banco.py banco_preguntas.jsonl
+# ------------------------------------------------------------
+
+import json
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+LETRAS = "ABCD"
+LONGITUD_DEFECTO = (200, 350)
+PESOS_SENALES = {"longitud": 0.35, "balance": 0.25, "correcta_larga": 0.2, "explicacion": 0.2}
+RAZON_CORRECTA_LARGA = 1.2   # la correcta "delata" si supera en 20% a la segunda más larga
+MIN_ITEMS_CELDA_LETRAS = 8   # por debajo no se penaliza la distribución de letras
+
+# ===================== Extracción =====================
+
+def extraer_rasgos(items: Iterable[dict], norm_fn: Callable[[str], str],
+                   plantillas: Optional[Set[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    Única pasada en Python: números por ítem que luego se puntúan de forma vectorizada.
+    `norm_fn` viene de EduExce (_norm) para que "opciones duplicadas" coincida con el dedup.
+    """
+    plantillas = plantillas or set()
+    palabras, lmin, lmax, largos, letras, plantilla, duplicadas = [], [], [], [], [], [], []
+    for it in items:
+        lo, hi = (it.get("meta") or {}).get("longitud") or LONGITUD_DEFECTO
+        op = it.get("opciones") or {}
+        textos = [str(op.get(L, "")) for L in LETRAS]
+        expl = (it.get("explicacion") or "").strip()
+        palabras.append(len((it.get("pregunta") or "").split()))
+        lmin.append(lo)
+        lmax.append(hi)
+        largos.append([len(t) for t in textos])
+        letras.append(LETRAS.find((it.get("respuesta_correcta") or "A").upper()[:1]))
+        plantilla.append(not expl or expl in plantillas)
+        duplicadas.append(len({norm_fn(t) for t in textos}) < 4)
+    return {
+        "palabras": np.asarray(palabras, dtype=np.int32),
+        "lmin": np.asarray(lmin, dtype=np.int32),
+        "lmax": np.asarray(lmax, dtype=np.int32),
+        "largos": np.asarray(largos, dtype=np.float32).reshape(-1, 4),
+        "letras": np.asarray(letras, dtype=np.int8),
+        "plantilla": np.asarray(plantilla, dtype=bool),
+        "duplicadas": np.asarray(duplicadas, dtype=bool),
+    }
+
+# ===================== Puntaje =====================
+
+def senales(r: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Señales por ítem en [0, 1]."""
+    w, lo, hi = r["palabras"], r["lmin"], r["lmax"]
+    desvio = np.where(w < lo, (lo - w) / np.maximum(lo, 1), np.where(w > hi, (w - hi) / np.maximum(hi, 1), 0.0))
+    largos = r["largos"]
+    cv = largos.std(axis=1) / np.maximum(largos.mean(axis=1), 1.0)
+    n = len(largos)
+    letra = np.clip(r["letras"], 0, 3).astype(np.intp)
+    correcta = largos[np.arange(n), letra]
+    otras = largos.copy()
+    otras[np.arange(n), letra] = -1.0
+    es_larga = correcta > RAZON_CORRECTA_LARGA * otras.max(axis=1) if n else np.zeros(0, dtype=bool)
+    return {
+        "longitud": np.clip(1.0 - desvio, 0.0, 1.0),
+        "balance": np.clip(1.0 - cv, 0.0, 1.0),
+        "correcta_larga": np.where(es_larga, 0.0, 1.0),
+        "explicacion": np.where(r["plantilla"], 0.3, 1.0),
+    }
+
+def calidad_base(r: Dict[str, np.ndarray]) -> np.ndarray:
+    """Puntaje por ítem (sin el término por celda), float32 en [0, 1]."""
+    s = senales(r)
+    total = sum(PESOS_SENALES.values())
+    base = sum(PESOS_SENALES[k] * s[k] for k in PESOS_SENALES) / total
+    base = np.where(r["duplicadas"], base * 0.2, base)
+    return np.asarray(base, dtype=np.float32)
+
+def factor_letras(celdas: np.ndarray, letras: np.ndarray) -> np.ndarray:
+    """
+    Penaliza las letras sobrerrepresentadas dentro de cada celda: factor = 0.25 / frecuencia,
+    acotado a [0.5, 1]. Celdas con pocos ítems no se penalizan.
+    """
+    if len(celdas) == 0:
+        return np.ones(0, dtype=np.float32)
+    letras = np.clip(letras, 0, 3).astype(np.int64)
+    n_celdas = int(celdas.max()) + 1
+    conteo = np.bincount(celdas.astype(np.int64) * 4 + letras, minlength=n_celdas * 4).reshape(n_celdas, 4)
+    total = conteo.sum(axis=1)
+    frec = conteo[celdas, letras] / np.maximum(total[celdas], 1)
+    f = np.clip(0.25 / np.maximum(frec, 1e-9), 0.5, 1.0)
+    return np.where(total[celdas] >= MIN_ITEMS_CELDA_LETRAS, f, 1.0).astype(np.float32)
+
+def resumen(r: Dict[str, np.ndarray], calidad: np.ndarray) -> dict:
+    """Estadísticas agregadas del banco (para /icfes/banco y la CLI)."""
+    if len(calidad) == 0:
+        return {"items": 0}
+    s = senales(r)
+    dist = np.bincount(np.clip(r["letras"], 0, 3).astype(np.int64), minlength=4) / len(calidad)
+    return {
+        "items": int(len(calidad)),
+        "calidad_media": round(float(calidad.mean()), 4),
+        "calidad_p10_p50_p90": [round(float(x), 4) for x in np.percentile(calidad, [10, 50, 90])],
+        "fuera_de_longitud": round(float((s["longitud"] < 1.0).mean()), 4),
+        "correcta_es_la_mas_larga": round(float((s["correcta_larga"] == 0.0).mean()), 4),
+        "explicacion_plantilla": round(float(r["plantilla"].mean()), 4),
+        "opciones_duplicadas": round(float(r["duplicadas"].mean()), 4),
+        "distribucion_letras": {L: round(float(p), 4) for L, p in zip(LETRAS, dist)},
+    }
+
+# ===================== CLI =====================
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("Uso: python calidad_banco.py banco_preguntas.jsonl")
+        return 2
+    import EduExce as gen
+
+    t0 = time.perf_counter()
+    with open(argv[0], "r", encoding="utf-8") as f:
+        items = [json.loads(linea) for linea in f if linea.strip()]
+    t1 = time.perf_counter()
+    r = extraer_rasgos(items, gen._norm, gen.PLANTILLAS_EXPLICACION)
+    claves = [gen._clave_celda_banco(it) for it in items]
+    ids = {c: i for i, c in enumerate(dict.fromkeys(claves))}
+    celdas = np.asarray([ids[c] for c in claves], dtype=np.int32)
+    t2 = time.perf_counter()
+    calidad = calidad_base(r) * factor_letras(celdas, r["letras"])
+    t3 = time.perf_counter()
+    out = resumen(r, calidad)
+    out["tiempos_s"] = {"lectura": round(t1 - t0, 3), "extraccion": round(t2 - t1, 3), "puntaje": round(t3 - t2, 4)}
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+# corpus_replay.py — Banco de pruebas sobre un corpus grabado de respuestas del proveedor
+# ------------------------------------------------------------
+# Reproduce cada llamada grabada (GRABAR_CORPUS, ver corpus_respuestas.py) por el mismo camino que
+# en producción — generar_una, generar_lote, generar_kolb o IaPreguntasService.generar_preguntas —
+# pero con el cliente de replay: sin red, así que lo que se mide es parseo, reparación, validación
+# y post-proceso con salidas reales del modelo. La respuesta grabada se fuerza para la primera
+# llamada de cada registro (aunque el prompt haya cambiado); las siguientes (reintentos,
+# reparaciones, estilos completados aparte) se buscan por huella de mensajes en modo estricto.
+#
+# Uso:
+#   python corpus_replay.py bench    corpus.jsonl.gz [--repeticiones 3]
+#   python corpus_replay.py snapshot corpus.jsonl.gz salida.json
+#   python corpus_replay.py comparar corpus.jsonl.gz salida.json   # exit 1 si algo cambió
+#   python corpus_replay.py prompts  corpus.jsonl.gz
+#     prompt de sistema completo vs compacto (IA_PROMPT_COMPACTO) de IaPreguntasService: tokens
+#     estimados por área y, con los registros grabados en cada modo, tokens reales y calidad
+#     (calidad_banco.py) de los ítems resultantes
+# ------------------------------------------------------------
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+TIPOS_REPRODUCIBLES = ("una", "lote", "kolb", "servicio")
+
+def _preparar(corpus: str) -> Tuple[Any, Any, List[Tuple[int, dict]]]:
+    """Importa EduExce en modo replay estricto y devuelve (gen, servicio, registros reproducibles)."""
+    os.environ["REPLAY_CORPUS"] = corpus
+    os.environ.pop("GRABAR_CORPUS", None)  # no volver a grabar lo que se reproduce
+    import EduExce as gen
+    from ia_preguntas_service import IaPreguntasService
+
+    gen.client.estricto = True
+    servicio = IaPreguntasService()
+    servicio.client = gen.client
+    entradas = [(i, r) for i, r in enumerate(gen.client.registros)
+                if (r.get("etiqueta") or {}).get("tipo") in TIPOS_REPRODUCIBLES]
+    return gen, servicio, entradas
+
+def reproducir(gen, servicio, registro: dict, semilla: int) -> dict:
+    """Pasa un registro por su camino de generación. Devuelve {ok, items | error}."""
+    random.seed(semilla)  # shuffle_options y semillas: misma salida en cada corrida
+    et = registro["etiqueta"]
+    with gen.client.servir(registro):
+        try:
+            if et["tipo"] == "servicio":
+                preguntas = servicio.generar_preguntas(et["area"], et["subtema"], et["estilo_kolb"], et["cantidad"])
+                return {"ok": True, "items": servicio.preparar_para_jsonb(preguntas)}
+            cfg = gen.GenInput(**et["cfg"])
+            if et["tipo"] == "una":
+                item, _ = gen.generar_una(cfg)
+                items = [item]
+            elif et["tipo"] == "lote":
+                items, _ = gen.generar_lote(cfg, et["n"])
+            else:
+                items, _, _ = gen.generar_kolb(cfg, et["estilos"])
+            return {"ok": True, "items": [it.model_dump() for it in items]}
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+def _percentil(valores: List[float], q: float) -> float:
+    orden = sorted(valores)
+    return orden[min(len(orden) - 1, int(round(q * (len(orden) - 1))))] if orden else 0.0
+
+# ===================== Subcomandos =====================
+
+def cmd_bench(args: argparse.Namespace) -> int:
+    gen, servicio, entradas = _preparar(args.corpus)
+    if not entradas:
+        print("El corpus no tiene registros reproducibles")
+        return 1
+    por_tipo: Dict[str, List[float]] = {}
+    ok = total = 0
+    t0 = time.perf_counter()
+    for rep in range(args.repeticiones):
+        for i, r in entradas:
+            t = time.perf_counter()
+            res = reproducir(gen, servicio, r, i)
+            ms = (time.perf_counter() - t) * 1000
+            if rep or args.repeticiones == 1:  # la primera vuelta calienta cachés
+                por_tipo.setdefault(r["etiqueta"]["tipo"], []).append(ms)
+            ok += res["ok"]
+            total += 1
+    duracion = time.perf_counter() - t0
+    out = {
+        "registros": len(entradas),
+        "repeticiones": args.repeticiones,
+        "duracion_s": round(duracion, 3),
+        "registros_por_s": round(total / duracion, 1) if duracion else None,
+        "ok": round(ok / total, 4),
+        "por_tipo": {
+            tipo: {"n": len(v), "p50_ms": round(_percentil(v, 0.5), 3), "p95_ms": round(_percentil(v, 0.95), 3),
+                   "media_ms": round(sum(v) / len(v), 3)}
+            for tipo, v in sorted(por_tipo.items())
+        },
+        "latencia_grabada_ms_media": round(sum(r["latencia_ms"] for _, r in entradas) / len(entradas), 1),
+        "replay": gen.client.snapshot(),
+    }
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return 0
+
+def _resultados(corpus: str) -> List[dict]:
+    gen, servicio, entradas = _preparar(corpus)
+    salida = []
+    for i, r in entradas:
+        res = reproducir(gen, servicio, r, i)
+        salida.append(dict(res, i=i, clave=r["clave"], tipo=r["etiqueta"]["tipo"]))
+    return salida
+
+def cmd_snapshot(args: argparse.Namespace) -> int:
+    resultados = _resultados(args.corpus)
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump({"corpus": os.path.basename(args.corpus), "resultados": resultados}, f, ensure_ascii=False, indent=1)
+    ok = sum(r["ok"] for r in resultados)
+    print(f"{len(resultados)} registros ({ok} ok) -> {args.salida}")
+    return 0
+
+def _diferencias(antes: dict, ahora: dict) -> Optional[str]:
+    if antes["ok"] != ahora["ok"]:
+        return f"ok {antes['ok']} -> {ahora['ok']} ({ahora.get('error') or antes.get('error')})"
+    if not ahora["ok"]:
+        return None if antes["error"] == ahora["error"] else f"error: {antes['error']!r} -> {ahora['error']!r}"
+    if len(antes["items"]) != len(ahora["items"]):
+        return f"items {len(antes['items'])} -> {len(ahora['items'])}"
+    for k, (a, b) in enumerate(zip(antes["items"], ahora["items"])):
+        campos = sorted(c for c in set(a) | set(b) if a.get(c) != b.get(c))
+        if campos:
+            return f"item {k}: cambian {', '.join(campos)}"
+    return None
+
+def cmd_comparar(args: argparse.Namespace) -> int:
+    with open(args.snapshot, "r", encoding="utf-8") as f:
+        previos = {r["i"]: r for r in json.load(f)["resultados"]}
+    actuales = _resultados(args.corpus)
+    cambios = []
+    for r in actuales:
+        antes = previos.get(r["i"])
+        if antes is None:
+            cambios.append(f"#{r['i']} ({r['tipo']}): no está en el snapshot")
+            continue
+        diff = _diferencias(antes, r)
+        if diff:
+            cambios.append(f"#{r['i']} ({r['tipo']}): {diff}")
+    for c in cambios:
+        print(c)
+    print(f"{len(actuales)} registros comparados, {len(cambios)} con cambios")
+    return 1 if cambios else 0
+
+def _media(valores: List[float]) -> Optional[float]:
+    return round(sum(valores) / len(valores), 1) if valores else None
+
+def cmd_prompts(args: argparse.Namespace) -> int:
+    gen, servicio, entradas = _preparar(args.corpus)
+    import calidad_banco
+
+    estimados = {}
+    for area in gen.ALLOWED:
+        completo, compacto = (
+            gen.estimar_tokens(servicio._construir_system_prompt("Convergente", area, compacto=c))
+            for c in (False, True)
+        )
+        estimados[area] = {"completo": completo, "compacto": compacto,
+                           "ahorro": round(1 - compacto / completo, 4) if completo else 0.0}
+
+    por_modo: Dict[str, dict] = {}
+    for i, r in entradas:
+        et = r["etiqueta"]
+        if et["tipo"] != "servicio":
+            continue
+        acc = por_modo.setdefault(et.get("prompt", "completo"), {
+            "registros": 0, "ok": 0, "items": [], "prompt_tokens": [], "completion_tokens": [], "latencia_ms": []})
+        res = reproducir(gen, servicio, r, i)
+        acc["registros"] += 1
+        acc["ok"] += res["ok"]
+        acc["items"] += res.get("items", [])
+        acc["prompt_tokens"].append(r["usage"]["prompt_tokens"])
+        acc["completion_tokens"].append(r["usage"]["completion_tokens"])
+        acc["latencia_ms"].append(r["latencia_ms"])
+
+    grabados = {}
+    for modo, acc in sorted(por_modo.items()):
+        rasgos = calidad_banco.extraer_rasgos(acc["items"], gen._norm, gen.PLANTILLAS_EXPLICACION)
+        grabados[modo] = {
+            "registros": acc["registros"],
+            "ok": round(acc["ok"] / acc["registros"], 4),
+            "prompt_tokens_medio": _media(acc["prompt_tokens"]),
+            "completion_tokens_medio": _media(acc["completion_tokens"]),
+            "latencia_ms_media": _media(acc["latencia_ms"]),
+            "calidad": calidad_banco.resumen(rasgos, calidad_banco.calidad_base(rasgos)),
+        }
+    print(json.dumps({"prompt_sistema_tokens_estimados": estimados, "corpus_por_modo": grabados},
+                     ensure_ascii=False, indent=2))
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay de un corpus grabado de respuestas del proveedor")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("bench", help="Mide parseo y validación reproduciendo el corpus")
+    p.add_argument("corpus")
+    p.add_argument("--repeticiones", type=int, default=3)
+    p.set_defaults(fn=cmd_bench)
+
+    p = sub.add_parser("snapshot", help="Guarda el resultado de procesar cada registro")
+    p.add_argument("corpus")
+    p.add_argument("salida")
+    p.set_defaults(fn=cmd_snapshot)
+
+    p = sub.add_parser("comparar", help="Compara el procesamiento actual con un snapshot")
+    p.add_argument("corpus")
+    p.add_argument("snapshot")
+    p.set_defaults(fn=cmd_comparar)
+
+    p = sub.add_parser("prompts", help="Prompt de sistema completo vs compacto: tokens y calidad")
+    p.add_argument("corpus")
+    p.set_defaults(fn=cmd_prompts)
+
+    args = parser.parse_args(argv)
+    return args.fn(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+# corpus_respuestas.py — Grabación y reproducción (cassette) de las respuestas del proveedor
+# ------------------------------------------------------------
+# - ClienteGrabador envuelve al cliente de OpenAI: cada chat.completions.create que termina bien
+#   (con o sin streaming) se agrega como una línea JSON a un corpus gzip (GRABAR_CORPUS), con los
+#   mensajes, el contenido crudo, el uso de tokens, la latencia y la etiqueta de quién llamó
+#   (tipo de generación y cfg). Claves de API, tokens Bearer y campos sensibles se redactan.
+# - ClienteReplay imita a chat.completions.create leyendo ese corpus (REPLAY_CORPUS): responde
+#   al instante, así que parseo, reparación y validación corren a velocidad de CPU y con salidas
+#   reales del modelo. Busca por huella de los mensajes; `servir(registro)` fuerza la próxima
+#   respuesta del hilo (lo usa corpus_replay.py para reproducir un registro aunque el prompt cambie).
+# El gzip se escribe como miembros sucesivos con flush por registro: un corte no pierde lo anterior.
+# ------------------------------------------------------------
+
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+VERSION_CORPUS = 1
+_ETIQUETA: ContextVar[Optional[dict]] = ContextVar("etiqueta_corpus", default=None)
+# Parámetros de la llamada que se guardan (el resto, p. ej. timeout o seed, no afecta el replay)
+_KWARGS_GRABADOS = ("model", "messages", "temperature", "max_tokens", "response_format")
+
+# ===================== Redacción =====================
+_PATRONES_SECRETOS = [
+    (re.compile(r"sk-(?:proj-)?[A-Za-z0-9_\-]{8,}"), "sk-***"),
+    (re.compile(r"(?i)\bBearer\s+[A-Za-z0-9._\-]+"), "Bearer ***"),
+    (re.compile(r"(?i)\b(api[_-]?key|token|password|secret)(\s*[=:]\s*)[^\s\"',;]+"), r"\1\2***"),
+]
+_CLAVES_SENSIBLES = re.compile(r"(?i)(api[_-]?key|authorization|password|secret|token$|^user$)")
+
+def redactar(valor: Any) -> Any:
+    """Copia de `valor` sin secretos (en textos y en claves de diccionario sensibles)."""
+    if isinstance(valor, str):
+        for patron, reemplazo in _PATRONES_SECRETOS:
+            valor = patron.sub(reemplazo, valor)
+        return valor
+    if isinstance(valor, dict):
+        return {k: ("***" if _CLAVES_SENSIBLES.search(str(k)) else redactar(v)) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [redactar(v) for v in valor]
+    return valor
+
+def huella_mensajes(messages: List[dict]) -> str:
+    """Clave de búsqueda del replay: solo los mensajes (no el modelo, que depende del enrutamiento)."""
+    crudo = json.dumps(messages, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(crudo.encode("utf-8")).hexdigest()[:24]
+
+@contextmanager
+def etiqueta_corpus(**datos):
+    """Adjunta `datos` (tipo de generación, cfg, ...) a las llamadas grabadas dentro del bloque."""
+    token = _ETIQUETA.set(datos)
+    try:
+        yield
+    finally:
+        _ETIQUETA.reset(token)
+
+def leer_corpus(path: str) -> List[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+def _usage_dict(usage) -> Dict[str, int]:
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "total_tokens": getattr(usage, "total_tokens", 0) or 0,
+    }
+
+# ===================== Grabación =====================
+class GrabadorCorpus:
+    """Escritor gzip JSONL compartido por los hilos del proceso."""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._f = gzip.open(path, "ab")
+        self.registros = 0
+
+    def grabar(self, origen: str, kwargs: dict, contenido: str, finish_reason: Optional[str],
+               usage: Dict[str, int], latencia_ms: float, stream: bool) -> None:
+        registro = {
+            "v": VERSION_CORPUS,
+            "ts": round(time.time(), 3),
+            "origen": origen,
+            "etiqueta": redactar(_ETIQUETA.get()),
+            "clave": huella_mensajes(kwargs.get("messages") or []),
+            "kwargs": redactar({k: kwargs[k] for k in _KWARGS_GRABADOS if k in kwargs}),
+            "contenido": redactar(contenido),
+            "finish_reason": finish_reason,
+            "usage": usage,
+            "latencia_ms": round(latencia_ms, 1),
+            "stream": stream,
+        }
+        linea = (json.dumps(registro, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            self._f.write(linea)
+            self._f.flush()
+            self.registros += 1
+
+    def cerrar(self) -> None:
+        with self._lock:
+            self._f.close()
+
+_GRABADORES: Dict[str, GrabadorCorpus] = {}
+_GRABADORES_LOCK = threading.Lock()
+
+def abrir_grabador(path: str) -> GrabadorCorpus:
+    """Un grabador por ruta y proceso (EduExce e IaPreguntasService comparten el archivo)."""
+    with _GRABADORES_LOCK:
+        if path not in _GRABADORES:
+            _GRABADORES[path] = GrabadorCorpus(path)
+        return _GRABADORES[path]
+
+class _StreamGrabado:
+    """Itera el stream original y graba al agotarlo (un stream cortado no se graba)."""
+    def __init__(self, stream, grabar):
+        self._stream = stream
+        self._grabar = grabar
+
+    def __iter__(self):
+        partes, usage, finish_reason = [], None, None
+        for chunk in self._stream:
+            if chunk.choices:
+                delta = chunk.choices[0].delta
+                if delta is not None and delta.content:
+                    partes.append(delta.content)
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            yield chunk
+        self._grabar("".join(partes), finish_reason, _usage_dict(usage))
+
+    def close(self) -> None:
+        self._stream.close()
+
+class _CompletionsGrabador:
+    def __init__(self, completions, grabador: GrabadorCorpus, origen: str):
+        self._completions = completions
+        self._grabador = grabador
+        self._origen = origen
+
+    def create(self, **kwargs):
+        t0 = time.perf_counter()
+        respuesta = self._completions.create(**kwargs)
+        stream = bool(kwargs.get("stream"))
+
+        def grabar(contenido, finish_reason, usage):
+            self._grabador.grabar(self._origen, kwargs, contenido or "", finish_reason, usage,
+                                  (time.perf_counter() - t0) * 1000, stream)
+
+        if stream:
+            return _StreamGrabado(respuesta, grabar)
+        if respuesta is not None and respuesta.choices:
+            grabar(respuesta.choices[0].message.content, respuesta.choices[0].finish_reason,
+                   _usage_dict(getattr(respuesta, "usage", None)))
+        return respuesta
+
+class ClienteGrabador:
+    """Mismo uso que OpenAI(...) para chat.completions.create; graba cada respuesta en el corpus."""
+    def __init__(self, cliente, grabador: GrabadorCorpus, origen: str):
+        self.chat = SimpleNamespace(completions=_CompletionsGrabador(cliente.chat.completions, grabador, origen))
+
+# ===================== Replay =====================
+class SinGrabacion(Exception):
+    """El corpus no tiene una respuesta para estos mensajes (replay estricto)."""
+
+class _StreamReplay:
+    def __init__(self, registro: dict):
+        self._registro = registro
+
+    def __iter__(self) -> Iterator[Any]:
+        r = self._registro
+        delta = SimpleNamespace(content=r["contenido"])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=r.get("finish_reason"))],
+                              usage=None)
+        yield SimpleNamespace(choices=[], usage=SimpleNamespace(**r["usage"]))
+
+    def close(self) -> None:
+        pass
+
+class _CompletionsReplay:
+    def __init__(self, cliente: "ClienteReplay"):
+        self._cliente = cliente
+
+    def create(self, **kwargs):
+        registro = self._cliente.buscar(kwargs.get("messages") or [])
+        if kwargs.get("stream"):
+            return _StreamReplay(registro)
+        mensaje = SimpleNamespace(content=registro["contenido"], role="assistant")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=mensaje, finish_reason=registro.get("finish_reason"), index=0)],
+            usage=SimpleNamespace(**registro["usage"]),
+            model=registro["kwargs"].get("model"),
+        )
+
+class ClienteReplay:
+    """
+    Cliente falso que responde desde un corpus grabado. Orden de búsqueda: registro forzado del
+    hilo (`servir`), huella exacta de los mensajes (rotando si hay varias) y, si no es estricto,
+    los registros en orden circular. Estricto: sin coincidencia se lanza SinGrabacion.
+    """
+    def __init__(self, path: str, estricto: bool = False):
+        self.path = path
+        self.estricto = estricto
+        self.registros = leer_corpus(path)
+        self._por_clave: Dict[str, List[dict]] = {}
+        for r in self.registros:
+            self._por_clave.setdefault(r["clave"], []).append(r)
+        self._turno: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.aciertos = self.forzados = self.sin_coincidencia = 0
+        self.chat = SimpleNamespace(completions=_CompletionsReplay(self))
+
+    @contextmanager
+    def servir(self, registro: dict):
+        """La próxima llamada de este hilo dentro del bloque recibe `registro`."""
+        self._local.forzado = registro
+        try:
+            yield
+        finally:
+            self._local.forzado = None
+
+    def buscar(self, messages: List[dict]) -> dict:
+        forzado = getattr(self._local, "forzado", None)
+        if forzado is not None:
+            self._local.forzado = None
+            with self._lock:
+                self.forzados += 1
+                # Las llamadas siguientes con los mismos mensajes (p. ej. el reintento por truncación)
+                # reciben la grabación posterior a la forzada, como ocurrió al grabar
+                candidatos = self._por_clave.get(forzado.get("clave"), [])
+                for i, r in enumerate(candidatos):
+                    if r is forzado:
+                        self._turno[forzado["clave"]] = i + 1
+                        break
+            return forzado
+        clave = huella_mensajes(messages)
+        with self._lock:
+            candidatos = self._por_clave.get(clave)
+            if candidatos:
+                self.aciertos += 1
+            else:
+                self.sin_coincidencia += 1
+                if self.estricto or not self.registros:
+                    raise SinGrabacion(f"Sin respuesta grabada para los mensajes {clave}")
+                candidatos, clave = self.registros, "*"
+            i = self._turno.get(clave, 0)
+            self._turno[clave] = i + 1
+            return candidatos[i % len(candidatos)]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"registros": len(self.registros), "aciertos": self.aciertos, "forzados": self.forzados,
+                    "sin_coincidencia": self.sin_coincidencia}
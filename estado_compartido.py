@@ -0,0 +1,365 @@
+# estado_compartido.py — Estado compartido entre workers sin servicios externos
+# ------------------------------------------------------------
+# Con `uvicorn EduExce:app --workers N` cada proceso tenía su propia exposición por estudiante,
+# su propio conjunto de hashes del banco y su propio margen de rate limit. Este módulo ofrece
+# las mismas estructuras sobre un archivo SQLite en modo WAL (seguro entre procesos) o, con un
+# solo worker, en memoria del proceso:
+# - clave/valor con TTL (filtros de exposición, cachés)
+# - colas con TTL (sobrantes de la coalescencia: cada elemento lo consume un solo proceso)
+# - conjuntos para deduplicar (insert-or-ignore atómico)
+# - cubos de tokens (rate limit hacia el proveedor), tomados todos o ninguno en una transacción
+# Los valores son bytes o datos serializables a JSON. El reloj compartido es time.time().
+#
+# Uso:  ESTADO_COMPARTIDO=memoria                      (por defecto, un worker)
+#       ESTADO_COMPARTIDO=/var/lib/eduexcel/estado.db  (varios workers en la misma máquina)
+# ------------------------------------------------------------
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+PURGA_CADA = 500           # escrituras entre purgas de claves/colas vencidas (SQLite)
+BUSY_TIMEOUT_MS = 5000     # espera máxima por el lock de escritura de otro proceso
+
+# Pedido a un cubo de tokens: (nombre, cantidad, capacidad, recarga por segundo)
+Pedido = Tuple[str, float, float, float]
+
+def _codificar(valor: Any) -> bytes:
+    if isinstance(valor, (bytes, bytearray)):
+        return b"\x00" + bytes(valor)
+    return b"\x01" + json.dumps(valor, ensure_ascii=False).encode("utf-8")
+
+def _decodificar(dato: Optional[bytes]) -> Any:
+    if dato is None:
+        return None
+    dato = bytes(dato)
+    return dato[1:] if dato[:1] == b"\x00" else json.loads(dato[1:].decode("utf-8"))
+
+def _recargar(tokens: float, t: float, ahora: float, capacidad: float, por_segundo: float) -> float:
+    return min(capacidad, tokens + max(0.0, ahora - t) * por_segundo)
+
+def _espera_cubos(estado: Dict[str, Tuple[float, float]], pedidos: List[Pedido], ahora: float) -> float:
+    """Segundos hasta que todos los cubos alcancen; 0 si ya alcanzan (estado: nombre -> (tokens, t))."""
+    espera = 0.0
+    for nombre, cantidad, capacidad, por_segundo in pedidos:
+        tokens, t = estado.get(nombre, (capacidad, ahora))
+        disponible = _recargar(tokens, t, ahora, capacidad, por_segundo)
+        falta = min(cantidad, capacidad) - disponible
+        if falta > 0:
+            espera = max(espera, falta / por_segundo if por_segundo > 0 else float("inf"))
+    return espera
+
+# ===================== Modo memoria (un worker) =====================
+
+class EstadoMemoria:
+    """Implementación en memoria del proceso. Las claves con valor forman un LRU de `max_claves`."""
+    def __init__(self, max_claves: int = 20000):
+        self.max_claves = max_claves
+        self._lock = threading.Lock()
+        self._kv: "OrderedDict[str, Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self._colas: Dict[str, deque] = {}
+        self._conjuntos: Dict[str, set] = {}
+        self._cubos: Dict[str, Tuple[float, float]] = {}
+
+    def _vigente(self, clave: str, ahora: float) -> Optional[bytes]:
+        entrada = self._kv.get(clave)
+        if entrada is None:
+            return None
+        if entrada[1] is not None and entrada[1] <= ahora:
+            del self._kv[clave]
+            return None
+        self._kv.move_to_end(clave)
+        return entrada[0]
+
+    def _poner(self, clave: str, dato: bytes, ttl_s: Optional[float], ahora: float) -> None:
+        self._kv[clave] = (dato, ahora + ttl_s if ttl_s else None)
+        self._kv.move_to_end(clave)
+        while len(self._kv) > self.max_claves:
+            self._kv.popitem(last=False)
+
+    # ---------- Clave/valor ----------
+
+    def obtener(self, clave: str) -> Any:
+        with self._lock:
+            return _decodificar(self._vigente(clave, time.time()))
+
+    def guardar(self, clave: str, valor: Any, ttl_s: Optional[float] = None) -> None:
+        dato = _codificar(valor)
+        with self._lock:
+            self._poner(clave, dato, ttl_s, time.time())
+
+    def actualizar(self, clave: str, fn: Callable[[Any], Any], ttl_s: Optional[float] = None) -> Any:
+        """Lectura-modificación-escritura atómica: guarda y devuelve fn(valor actual o None)."""
+        with self._lock:
+            ahora = time.time()
+            nuevo = fn(_decodificar(self._vigente(clave, ahora)))
+            self._poner(clave, _codificar(nuevo), ttl_s, ahora)
+            return nuevo
+
+    def contar(self, prefijo: str) -> int:
+        with self._lock:
+            ahora = time.time()
+            return sum(1 for c, (_, exp) in self._kv.items()
+                       if c.startswith(prefijo) and (exp is None or exp > ahora))
+
+    # ---------- Colas ----------
+
+    def encolar(self, clave: str, valores: Iterable[Any], ttl_s: float) -> None:
+        expira = time.time() + ttl_s
+        datos = [(expira, _codificar(v)) for v in valores]
+        with self._lock:
+            self._colas.setdefault(clave, deque()).extend(datos)
+
+    def desencolar(self, clave: str) -> Any:
+        """Primer elemento vigente de la cola (y lo elimina); None si no hay."""
+        with self._lock:
+            cola = self._colas.get(clave)
+            ahora = time.time()
+            while cola:
+                expira, dato = cola.popleft()
+                if expira > ahora:
+                    return _decodificar(dato)
+            self._colas.pop(clave, None)
+            return None
+
+    # ---------- Conjuntos ----------
+
+    def agregar_si_nuevo(self, conjunto: str, miembro: str) -> bool:
+        with self._lock:
+            s = self._conjuntos.setdefault(conjunto, set())
+            if miembro in s:
+                return False
+            s.add(miembro)
+            return True
+
+    def agregar_muchos(self, conjunto: str, miembros: Iterable[str]) -> None:
+        with self._lock:
+            self._conjuntos.setdefault(conjunto, set()).update(miembros)
+
+    def vaciar_conjunto(self, conjunto: str) -> None:
+        with self._lock:
+            self._conjuntos.pop(conjunto, None)
+
+    def sembrar_conjunto(self, conjunto: str, miembros: Iterable[str], origen: str) -> bool:
+        """
+        Agrega `miembros` (insert-or-ignore) sin borrar lo que otros ya escribieron. Solo si el
+        conjunto se sembró antes desde otro `origen` (p. ej. el archivo fue reemplazado) se vacía y
+        se vuelve a llenar, todo en una operación atómica. Un origen previo vacío (el archivo aún no
+        existía) no cuenta como cambio. Devuelve True si se reconstruyó.
+        """
+        miembros = list(miembros)
+        with self._lock:
+            ahora = time.time()
+            previo = _decodificar(self._vigente(f"origen:{conjunto}", ahora))
+            reconstruir = previo not in (None, "") and previo != origen
+            if reconstruir:
+                self._conjuntos.pop(conjunto, None)
+            self._conjuntos.setdefault(conjunto, set()).update(miembros)
+            self._poner(f"origen:{conjunto}", _codificar(origen), None, ahora)
+            return reconstruir
+
+    # ---------- Cubos de tokens ----------
+
+    def tomar(self, pedidos: List[Pedido]) -> float:
+        """
+        Toma `cantidad` de cada cubo solo si todos alcanzan. Devuelve 0.0 si se tomaron o los
+        segundos que faltan para que alcancen (sin consumir nada).
+        """
+        with self._lock:
+            ahora = time.time()
+            espera = _espera_cubos(self._cubos, pedidos, ahora)
+            if espera > 0:
+                return espera
+            for nombre, cantidad, capacidad, por_segundo in pedidos:
+                tokens, t = self._cubos.get(nombre, (capacidad, ahora))
+                self._cubos[nombre] = (_recargar(tokens, t, ahora, capacidad, por_segundo)
+                                       - min(cantidad, capacidad), ahora)
+            return 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memoria",
+                "claves": len(self._kv),
+                "max_claves": self.max_claves,
+                "colas": sum(len(c) for c in self._colas.values()),
+                "conjuntos": {k: len(v) for k, v in self._conjuntos.items()},
+            }
+
+# ===================== Modo SQLite WAL (varios workers) =====================
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS kv (clave TEXT PRIMARY KEY, valor BLOB NOT NULL, expira REAL);
+CREATE TABLE IF NOT EXISTS colas (id INTEGER PRIMARY KEY AUTOINCREMENT, clave TEXT NOT NULL,
+                                  valor BLOB NOT NULL, expira REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS colas_clave ON colas (clave, id);
+CREATE TABLE IF NOT EXISTS conjuntos (conjunto TEXT NOT NULL, miembro TEXT NOT NULL,
+                                      PRIMARY KEY (conjunto, miembro)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cubos (nombre TEXT PRIMARY KEY, tokens REAL NOT NULL, t REAL NOT NULL);
+"""
+
+class EstadoSQLite:
+    """
+    Misma interfaz que EstadoMemoria sobre un archivo SQLite en modo WAL: los lectores no
+    bloquean al escritor y cada operación de escritura es una transacción BEGIN IMMEDIATE,
+    atómica entre procesos. Una conexión por hilo (y por proceso, por si hubo fork).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._escrituras = 0
+        with self._tx() as con:
+            for sentencia in filter(str.strip, _ESQUEMA.split(";")):
+                con.execute(sentencia)
+
+    def _con(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.con, self._local.pid = con, os.getpid()
+        return con
+
+    @contextmanager
+    def _tx(self):
+        con = self._con()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+        self._escrituras += 1
+        if self._escrituras % PURGA_CADA == 0:
+            self._purgar()
+
+    def _purgar(self) -> None:
+        ahora = time.time()
+        with self._tx() as con:
+            con.execute("DELETE FROM kv WHERE expira IS NOT NULL AND expira <= ?", (ahora,))
+            con.execute("DELETE FROM colas WHERE expira <= ?", (ahora,))
+
+    # ---------- Clave/valor ----------
+
+    def obtener(self, clave: str) -> Any:
+        fila = self._con().execute(
+            "SELECT valor FROM kv WHERE clave = ? AND (expira IS NULL OR expira > ?)", (clave, time.time())
+        ).fetchone()
+        return _decodificar(fila[0]) if fila else None
+
+    def guardar(self, clave: str, valor: Any, ttl_s: Optional[float] = None) -> None:
+        with self._tx() as con:
+            con.execute("INSERT OR REPLACE INTO kv (clave, valor, expira) VALUES (?, ?, ?)",
+                        (clave, _codificar(valor), time.time() + ttl_s if ttl_s else None))
+
+    def actualizar(self, clave: str, fn: Callable[[Any], Any], ttl_s: Optional[float] = None) -> Any:
+        """Lectura-modificación-escritura atómica: guarda y devuelve fn(valor actual o None)."""
+        with self._tx() as con:
+            ahora = time.time()
+            fila = con.execute("SELECT valor FROM kv WHERE clave = ? AND (expira IS NULL OR expira > ?)",
+                               (clave, ahora)).fetchone()
+            nuevo = fn(_decodificar(fila[0]) if fila else None)
+            con.execute("INSERT OR REPLACE INTO kv (clave, valor, expira) VALUES (?, ?, ?)",
+                        (clave, _codificar(nuevo), ahora + ttl_s if ttl_s else None))
+            return nuevo
+
+    def contar(self, prefijo: str) -> int:
+        return self._con().execute(
+            "SELECT COUNT(*) FROM kv WHERE clave >= ? AND clave < ? AND (expira IS NULL OR expira > ?)",
+            (prefijo, prefijo + "\uffff", time.time()),
+        ).fetchone()[0]
+
+    # ---------- Colas ----------
+
+    def encolar(self, clave: str, valores: Iterable[Any], ttl_s: float) -> None:
+        expira = time.time() + ttl_s
+        with self._tx() as con:
+            con.executemany("INSERT INTO colas (clave, valor, expira) VALUES (?, ?, ?)",
+                            [(clave, _codificar(v), expira) for v in valores])
+
+    def desencolar(self, clave: str) -> Any:
+        """Primer elemento vigente de la cola (y lo elimina); None si no hay."""
+        with self._tx() as con:
+            fila = con.execute("SELECT id, valor FROM colas WHERE clave = ? AND expira > ? ORDER BY id LIMIT 1",
+                               (clave, time.time())).fetchone()
+            if fila is None:
+                return None
+            con.execute("DELETE FROM colas WHERE id = ?", (fila[0],))
+            return _decodificar(fila[1])
+
+    # ---------- Conjuntos ----------
+
+    def agregar_si_nuevo(self, conjunto: str, miembro: str) -> bool:
+        with self._tx() as con:
+            return con.execute("INSERT OR IGNORE INTO conjuntos (conjunto, miembro) VALUES (?, ?)",
+                               (conjunto, miembro)).rowcount == 1
+
+    def agregar_muchos(self, conjunto: str, miembros: Iterable[str]) -> None:
+        with self._tx() as con:
+            con.executemany("INSERT OR IGNORE INTO conjuntos (conjunto, miembro) VALUES (?, ?)",
+                            ((conjunto, m) for m in miembros))
+
+    def vaciar_conjunto(self, conjunto: str) -> None:
+        with self._tx() as con:
+            con.execute("DELETE FROM conjuntos WHERE conjunto = ?", (conjunto,))
+
+    def sembrar_conjunto(self, conjunto: str, miembros: Iterable[str], origen: str) -> bool:
+        """Ver EstadoMemoria.sembrar_conjunto; el borrado y la resiembra van en una sola transacción."""
+        miembros = list(miembros)
+        with self._tx() as con:
+            fila = con.execute("SELECT valor FROM kv WHERE clave = ?", (f"origen:{conjunto}",)).fetchone()
+            reconstruir = fila is not None and _decodificar(fila[0]) not in ("", origen)
+            if reconstruir:
+                con.execute("DELETE FROM conjuntos WHERE conjunto = ?", (conjunto,))
+            con.executemany("INSERT OR IGNORE INTO conjuntos (conjunto, miembro) VALUES (?, ?)",
+                            ((conjunto, m) for m in miembros))
+            con.execute("INSERT OR REPLACE INTO kv (clave, valor, expira) VALUES (?, ?, NULL)",
+                        (f"origen:{conjunto}", _codificar(origen)))
+            return reconstruir
+
+    # ---------- Cubos de tokens ----------
+
+    def tomar(self, pedidos: List[Pedido]) -> float:
+        """
+        Toma `cantidad` de cada cubo solo si todos alcanzan. Devuelve 0.0 si se tomaron o los
+        segundos que faltan para que alcancen (sin consumir nada).
+        """
+        with self._tx() as con:
+            ahora = time.time()
+            nombres = [p[0] for p in pedidos]
+            filas = con.execute(f"SELECT nombre, tokens, t FROM cubos WHERE nombre IN ({','.join('?' * len(nombres))})",
+                                nombres).fetchall()
+            estado = {n: (tok, t) for n, tok, t in filas}
+            espera = _espera_cubos(estado, pedidos, ahora)
+            if espera > 0:
+                return espera
+            for nombre, cantidad, capacidad, por_segundo in pedidos:
+                tokens, t = estado.get(nombre, (capacidad, ahora))
+                con.execute("INSERT OR REPLACE INTO cubos (nombre, tokens, t) VALUES (?, ?, ?)",
+                            (nombre, _recargar(tokens, t, ahora, capacidad, por_segundo) - min(cantidad, capacidad),
+                             ahora))
+            return 0.0
+
+    def snapshot(self) -> dict:
+        con = self._con()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "claves": con.execute("SELECT COUNT(*) FROM kv").fetchone()[0],
+            "colas": con.execute("SELECT COUNT(*) FROM colas").fetchone()[0],
+            "conjuntos": dict(con.execute("SELECT conjunto, COUNT(*) FROM conjuntos GROUP BY conjunto").fetchall()),
+        }
+
+def abrir_estado(destino: str, max_claves_memoria: int = 20000):
+    """"memoria" (o vacío) = EstadoMemoria; cualquier otro valor es la ruta del archivo SQLite."""
+    if not destino or destino.strip().lower() == "memoria":
+        return EstadoMemoria(max_claves_memoria)
+    return EstadoSQLite(destino)
@@ -0,0 +1,342 @@
+# generar_banco.py — Generación masiva offline del banco de preguntas ICFES
+# ------------------------------------------------------------
+# Llena el banco sin pasar por los endpoints HTTP:
+# - Matriz objetivo: N ítems por celda (área × subtema × estilo Kolb)
+# - Pool de procesos con número acotado de tareas en vuelo
+# - Salida en JSONL comprimido (.jsonl.gz): cada lote confirmado es un miembro gzip completo
+# - Checkpoint atómico (conteos por celda + tamaño de la salida): al reiniciar se trunca
+#   la salida al último lote confirmado y se continúa exactamente donde se detuvo
+# - Motores: "una" (generar_una), "lote" (generar_lote) y "servicio" (IaPreguntasService)
+# - Subcomando batch: escribe el archivo de peticiones de la Batch API del proveedor
+# - Subcomando importar-batch: valida la salida de la Batch API y la agrega a la misma salida
+#
+# Uso:
+#   python generar_banco.py generar --por-celda 200 --workers 4 --salida banco_offline.jsonl.gz
+#   python generar_banco.py batch --por-celda 200 --archivo batch_peticiones.jsonl
+#   python generar_banco.py importar-batch batch_salida.jsonl --salida banco_offline.jsonl.gz
+# ------------------------------------------------------------
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Tuple
+
+import EduExce as gen
+
+Celda = Tuple[str, str, str]
+
+# ===================== Matriz objetivo =====================
+
+def clave_celda(celda: Celda) -> str:
+    return "|".join(celda)
+
+def matriz_objetivo(areas: Optional[List[str]], estilos: Optional[List[str]]) -> List[Celda]:
+    """Celdas (área, subtema, estilo_kolb) a llenar; por defecto todo el catálogo ALLOWED."""
+    areas_ok, estilos_ok = [], []
+    for a in areas or gen.ALLOWED.keys():
+        area, err = gen.validar_area(a)
+        if err:
+            raise SystemExit(err)
+        areas_ok.append(area)
+    for k in estilos or gen.KOLB_STYLES:
+        estilo, err = gen.validar_kolb(k)
+        if err:
+            raise SystemExit(err)
+        estilos_ok.append(estilo)
+    return [(a, s, k) for a in areas_ok for s in gen.ALLOWED[a] for k in estilos_ok]
+
+def _cfg(celda: Celda, args: argparse.Namespace) -> gen.GenInput:
+    area, subtema, kolb = celda
+    return gen.GenInput(area=area, subtema=subtema, estilo_kolb=kolb,
+                        longitud_min=args.longitud_min, longitud_max=args.longitud_max,
+                        temperatura=args.temperatura)
+
+# ===================== Checkpoint y salida =====================
+
+class Checkpoint:
+    """
+    Estado confirmado de una corrida: cuántos ítems tiene cada celda y cuántos bytes de la salida
+    están respaldados por esos conteos. Se reescribe de forma atómica (tmp + os.replace).
+    """
+    def __init__(self, path: str, salida: str):
+        self.path = path
+        self.salida = salida
+        self.conteos: Dict[str, int] = {}
+        self.bytes = 0
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                estado = json.load(f)
+            if estado.get("salida") != salida:
+                raise SystemExit(f"El checkpoint {path} pertenece a otra salida ({estado.get('salida')})")
+            self.conteos = {k: int(v) for k, v in estado.get("conteos", {}).items()}
+            self.bytes = int(estado.get("bytes", 0))
+            self.usage.update(estado.get("usage", {}))
+
+    def guardar(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"salida": self.salida, "bytes": self.bytes, "conteos": self.conteos,
+                       "usage": self.usage, "actualizado": time.strftime("%Y-%m-%dT%H:%M:%S")},
+                      f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+class SalidaComprimida:
+    """
+    JSONL comprimido de solo anexado. Al abrir se trunca al tamaño del checkpoint: lo escrito
+    después del último lote confirmado (corrida interrumpida) se descarta y se vuelve a generar.
+    Una salida no vacía sin bytes confirmados en el checkpoint no se toca: se aborta.
+    """
+    def __init__(self, path: str, ckpt: Checkpoint):
+        self.path = path
+        self.ckpt = ckpt
+        self.hashes: set = set()
+        if os.path.exists(path):
+            tamano = os.path.getsize(path)
+            if tamano > 0 and not ckpt.bytes:
+                # Sin checkpoint (borrado, otro --checkpoint) no se sabe qué parte está confirmada:
+                # truncar a 0 borraría el banco entero
+                raise SystemExit(f"{path} ya tiene {tamano} bytes pero el checkpoint {ckpt.path} no respalda "
+                                 "ninguno; usa el --checkpoint de esa corrida o mueve la salida")
+            with open(path, "r+b") as f:
+                f.truncate(ckpt.bytes)
+            if ckpt.bytes:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    for linea in f:
+                        if linea.strip():
+                            self.hashes.add(json.loads(linea).get("meta", {}).get("hash"))
+        elif ckpt.bytes:
+            raise SystemExit(f"El checkpoint indica {ckpt.bytes} bytes pero {path} no existe")
+        self._f = open(path, "ab")
+
+    def confirmar(self, celda: Celda, items: List[dict], usage: Dict[str, int]) -> int:
+        """Escribe un miembro gzip con los ítems nuevos y actualiza el checkpoint. Devuelve cuántos entraron."""
+        nuevos = []
+        for item in items:
+            meta = item.setdefault("meta", {})
+            meta.setdefault("hash", f"{gen.hash_item(item):016x}")
+            if meta["hash"] in self.hashes:
+                continue
+            self.hashes.add(meta["hash"])
+            nuevos.append(item)
+        if nuevos:
+            datos = "".join(json.dumps(i, ensure_ascii=False) + "\n" for i in nuevos)
+            self._f.write(gzip.compress(datos.encode("utf-8")))
+            self._f.flush()
+            os.fsync(self._f.fileno())
+        k = clave_celda(celda)
+        self.ckpt.conteos[k] = self.ckpt.conteos.get(k, 0) + len(nuevos)
+        self.ckpt.bytes = self._f.tell()
+        self.ckpt.usage = gen._sumar_usage(self.ckpt.usage, usage)
+        self.ckpt.guardar()
+        return len(nuevos)
+
+    def cerrar(self) -> None:
+        self._f.close()
+
+# ===================== Trabajo en los procesos =====================
+
+_SERVICIO = None
+
+def _trabajo(motor: str, celda: Celda, n: int, cfg_dict: dict) -> Tuple[List[dict], Dict[str, int]]:
+    """Genera n ítems de una celda dentro de un proceso del pool."""
+    global _SERVICIO
+    cfg = gen.GenInput(**cfg_dict)
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    if motor == "servicio":
+        if _SERVICIO is None:
+            from ia_preguntas_service import IaPreguntasService
+            _SERVICIO = IaPreguntasService()
+        preguntas = _SERVICIO.generar_preguntas(cfg.area, cfg.subtema, cfg.estilo_kolb, n)
+        items = _SERVICIO.preparar_para_jsonb(preguntas)
+        for p in items:
+            p.pop("orden", None)
+            p["meta"] = {"modelo": _SERVICIO.model, "motor": "servicio"}
+        return items, usage
+    if motor == "lote":
+        items, usage = gen.generar_lote(cfg, n)
+        return [i.model_dump() for i in items], usage
+    items = []
+    for _ in range(n):
+        item, u = gen.generar_una(cfg)
+        usage = gen._sumar_usage(usage, u)
+        items.append(item.model_dump())
+    return items, usage
+
+# ===================== Subcomandos =====================
+
+def _pendientes(celdas: List[Celda], ckpt: Checkpoint, por_celda: int) -> Dict[Celda, int]:
+    return {c: por_celda - ckpt.conteos.get(clave_celda(c), 0)
+            for c in celdas if ckpt.conteos.get(clave_celda(c), 0) < por_celda}
+
+def cmd_generar(args: argparse.Namespace) -> int:
+    celdas = matriz_objetivo(args.areas, args.estilos)
+    ckpt = Checkpoint(args.checkpoint, args.salida)
+    salida = SalidaComprimida(args.salida, ckpt)
+    faltan = _pendientes(celdas, ckpt, args.por_celda)
+    en_curso: Dict[Celda, int] = {c: 0 for c in faltan}
+    fallos: Dict[Celda, int] = {c: 0 for c in faltan}
+    total = sum(faltan.values())
+    print(f"[banco] {len(celdas)} celdas, {len(faltan)} incompletas, {total} ítems por generar "
+          f"(motor={args.motor}, workers={args.workers})")
+
+    def siguiente_tarea() -> Optional[Tuple[Celda, int]]:
+        for c, resto in faltan.items():
+            libre = resto - en_curso[c]
+            if libre > 0 and fallos[c] < args.max_fallos:
+                n = min(args.lote, libre)
+                en_curso[c] += n
+                return c, n
+        return None
+
+    generados = 0
+    t0 = time.time()
+    vuelo = {}
+    pool = ProcessPoolExecutor(max_workers=args.workers)
+    try:
+        while True:
+            while len(vuelo) < args.workers * 2:
+                tarea = siguiente_tarea()
+                if tarea is None:
+                    break
+                c, n = tarea
+                fut = pool.submit(_trabajo, args.motor, c, n, _cfg(c, args).model_dump())
+                vuelo[fut] = tarea
+            if not vuelo:
+                break
+            hechos, _ = wait(vuelo, return_when=FIRST_COMPLETED)
+            for fut in hechos:
+                c, n = vuelo.pop(fut)
+                en_curso[c] -= n
+                try:
+                    items, usage = fut.result()
+                except Exception as e:
+                    fallos[c] += 1
+                    print(f"[banco] ✗ {clave_celda(c)}: {type(e).__name__}: {e}", file=sys.stderr)
+                    continue
+                nuevos = salida.confirmar(c, items, usage)
+                faltan[c] -= nuevos
+                if faltan[c] <= 0:
+                    del faltan[c]
+                generados += nuevos
+                print(f"[banco] ✓ {clave_celda(c)} +{nuevos} "
+                      f"({generados}/{total}, {generados / max(time.time() - t0, 1e-6):.2f} ítems/s)")
+    except KeyboardInterrupt:
+        print("[banco] Interrumpido: el checkpoint conserva el último lote confirmado", file=sys.stderr)
+        for fut in vuelo:
+            fut.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+        salida.cerrar()
+        return 130
+    pool.shutdown()
+    salida.cerrar()
+    incompletas = [clave_celda(c) for c in faltan]
+    print(f"[banco] Listo: {generados} ítems nuevos, usage={ckpt.usage}")
+    if incompletas:
+        print(f"[banco] {len(incompletas)} celdas quedaron incompletas por fallos repetidos; "
+              f"vuelve a ejecutar para reintentar", file=sys.stderr)
+        return 1
+    return 0
+
+def cmd_batch(args: argparse.Namespace) -> int:
+    """Escribe el archivo de peticiones para la Batch API (una línea por lote de una celda)."""
+    celdas = matriz_objetivo(args.areas, args.estilos)
+    ckpt = Checkpoint(args.checkpoint, args.salida) if args.checkpoint else None
+    lineas = 0
+    with open(args.archivo, "w", encoding="utf-8") as f:
+        for c in celdas:
+            resto = args.por_celda - (ckpt.conteos.get(clave_celda(c), 0) if ckpt else 0)
+            cfg = _cfg(c, args)
+            modelo = gen.MODEL_TIERS[gen.nivel_modelo(cfg.area, cfg.subtema)]
+            parte = 0
+            while resto > 0:
+                n = min(args.lote, resto)
+                body = gen.kwargs_chat(gen.mensajes_lote(cfg, n), min(16000, gen.max_tokens_para(cfg) * n),
+                                       cfg.temperatura, modelo)
+                f.write(json.dumps({"custom_id": f"{clave_celda(c)}|{parte}", "method": "POST",
+                                    "url": "/v1/chat/completions", "body": body}, ensure_ascii=False) + "\n")
+                resto -= n
+                parte += 1
+                lineas += 1
+    print(f"[banco] {lineas} peticiones escritas en {args.archivo}")
+    return 0
+
+def cmd_importar_batch(args: argparse.Namespace) -> int:
+    """Valida la salida de la Batch API con items_desde_lote y la anexa a la salida comprimida."""
+    ckpt = Checkpoint(args.checkpoint, args.salida)
+    salida = SalidaComprimida(args.salida, ckpt)
+    ok = errores = 0
+    with open(args.entrada, "r", encoding="utf-8") as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            r = json.loads(linea)
+            area, subtema, kolb, _ = r["custom_id"].split("|")
+            body = ((r.get("response") or {}).get("body") or {})
+            if r.get("error") or not body.get("choices"):
+                errores += 1
+                continue
+            celda = (area, subtema, kolb)
+            u = body.get("usage") or {}
+            usage = {k: int(u.get(k, 0)) for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+            try:
+                items = gen.items_desde_lote(body["choices"][0]["message"]["content"] or "",
+                                             _cfg(celda, args), body.get("model", ""), usage)
+            except Exception as e:
+                errores += 1
+                print(f"[banco] ✗ {r['custom_id']}: {e}", file=sys.stderr)
+                continue
+            ok += salida.confirmar(celda, [i.model_dump() for i in items], usage)
+    salida.cerrar()
+    print(f"[banco] Importados {ok} ítems ({errores} respuestas descartadas)")
+    return 0
+
+# ===================== CLI =====================
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(description="Generación masiva offline del banco de preguntas ICFES")
+    sub = p.add_subparsers(dest="comando", required=True)
+
+    def comunes(sp: argparse.ArgumentParser) -> None:
+        sp.add_argument("--areas", nargs="*", help="Áreas a generar (por defecto todas)")
+        sp.add_argument("--estilos", nargs="*", help="Estilos Kolb (por defecto los cuatro)")
+        sp.add_argument("--salida", default="banco_offline.jsonl.gz", help="JSONL comprimido de salida")
+        sp.add_argument("--checkpoint", help="Ruta del checkpoint (por defecto <salida>.ckpt.json)")
+        sp.add_argument("--longitud-min", type=int, default=200)
+        sp.add_argument("--longitud-max", type=int, default=350)
+        sp.add_argument("--temperatura", type=float, default=0.2)
+
+    g = sub.add_parser("generar", help="Genera la matriz con un pool de procesos")
+    comunes(g)
+    g.add_argument("--por-celda", type=int, default=200, help="Ítems objetivo por celda")
+    g.add_argument("--motor", choices=["una", "lote", "servicio"], default="una")
+    g.add_argument("--lote", type=int, default=5, help="Ítems por tarea (y por llamada en motor lote/servicio)")
+    g.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    g.add_argument("--max-fallos", type=int, default=5, help="Fallos tolerados por celda antes de saltarla")
+    g.set_defaults(fn=cmd_generar)
+
+    b = sub.add_parser("batch", help="Escribe el archivo de peticiones de la Batch API")
+    comunes(b)
+    b.add_argument("--por-celda", type=int, default=200)
+    b.add_argument("--lote", type=int, default=5)
+    b.add_argument("--archivo", default="batch_peticiones.jsonl")
+    b.set_defaults(fn=cmd_batch)
+
+    i = sub.add_parser("importar-batch", help="Importa la salida de la Batch API")
+    comunes(i)
+    i.add_argument("entrada", help="Archivo JSONL de salida de la Batch API")
+    i.set_defaults(fn=cmd_importar_batch)
+
+    args = p.parse_args(argv)
+    if args.comando != "batch" or args.checkpoint:
+        args.checkpoint = args.checkpoint or args.salida + ".ckpt.json"
+    return args.fn(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,13 @@
 import os
 import json
 import time
-from typing import Any, Dict, List, Optional, TypedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
 
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from corpus_respuestas import ClienteGrabador, ClienteReplay, abrir_grabador, etiqueta_corpus
 from icfes_saber11_fuentes import ICFES_AREA_ALIAS, ICFES_SABER11_FUENTES
 
 load_dotenv()
@@ -37,6 +39,51 @@ class PreguntaTransformada(TypedDict):
     estilo_kolb: str
 
 
+class EspecificacionBulk(TypedDict):
+    area: str
+    subtema: str
+    estilo_kolb: str
+    cantidad: int
+
+
+class ResultadoBulk(TypedDict):
+    area: str
+    subtema: str
+    estilo_kolb: str
+    solicitadas: int
+    preguntas: List[PreguntaTransformada]  # orden 1..n dentro de la especificación
+    errores: List[str]                     # un mensaje por tramo o pregunta fallida
+
+
+# ============================================================
+# ESTILOS DE APRENDIZAJE (KOLB)
+# ============================================================
+
+# También los usa EduExce para pedir las cuatro variantes de Kolb en una sola llamada
+CARACTERISTICAS_ESTILO: Dict[str, str] = {
+    "Divergente": (
+        "Enfócate en situaciones problema que requieran pensamiento creativo, "
+        "análisis desde múltiples perspectivas y reflexión. Usa contextos cotidianos "
+        "y preguntas abiertas que inviten a imaginar soluciones."
+    ),
+    "Asimilador": (
+        "Prioriza la comprensión de teorías, modelos conceptuales y relaciones lógicas "
+        "entre ideas. Incluye definiciones claras, explicaciones sistemáticas y preguntas "
+        "que requieran razonamiento abstracto."
+    ),
+    "Convergente": (
+        "Presenta problemas con una solución práctica y concreta. Enfócate en aplicación "
+        "directa de conocimientos, resolución eficiente de problemas y preguntas con "
+        "respuesta única y definida."
+    ),
+    "Acomodador": (
+        "Usa escenarios reales, experimentación práctica y situaciones que requieran tomar "
+        "decisiones rápidas. Incluye contextos dinámicos donde se aprende haciendo y "
+        "ajustando sobre la marcha."
+    ),
+}
+
+
 # ============================================================
 # SERVICIO
 # ============================================================
@@ -52,17 +99,33 @@ class IaPreguntasService:
         self.client: Optional[OpenAI] = None
         self.model: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
         self.timeout_ms: int = int(os.getenv("OPENAI_TIMEOUT_MS", "20000"))
+        # Generación masiva: presupuesto de salida por llamada y concurrencia del pool
+        self.max_tokens_respuesta: int = int(os.getenv("IA_MAX_TOKENS_RESPUESTA", "4096"))
+        self.tokens_por_pregunta: int = int(os.getenv("IA_TOKENS_POR_PREGUNTA", "450"))
+        self.bulk_concurrencia: int = int(os.getenv("IA_BULK_CONCURRENCIA", "4"))
+        # Prompt de sistema compacto: solo competencias y componentes del área pedida
+        self.prompt_compacto: bool = os.getenv("IA_PROMPT_COMPACTO", "0") == "1"
+        self.prompt_fuentes: bool = os.getenv("IA_PROMPT_FUENTES", "0") == "1"
 
         api_key = os.getenv("OPENAI_API_KEY", "")
-
-        if not api_key:
+        replay_corpus = os.getenv("REPLAY_CORPUS", "")
+        grabar_corpus = os.getenv("GRABAR_CORPUS", "")
+
+        if replay_corpus:
+            # Respuestas desde un corpus grabado (corpus_respuestas.py): sin red ni API key
+            self.client = ClienteReplay(replay_corpus)
+            print(f"🔁 [IA Preguntas] Replay desde corpus: {replay_corpus}")
+        elif not api_key:
             print("⚠️ [IA Preguntas] OPENAI_API_KEY no configurada - usando fallback a banco local")
             return
+        else:
+            self.client = OpenAI(
+                api_key=api_key,
+                base_url=os.getenv("OPENAI_BASE_URL") or None,
+            )
 
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=os.getenv("OPENAI_BASE_URL") or None,
-        )
+        if grabar_corpus:
+            self.client = ClienteGrabador(self.client, abrir_grabador(grabar_corpus), origen="servicio")
         self.enabled = True
 
         print("✅ [IA Preguntas] SDK de OpenAI inicializado correctamente")
@@ -102,22 +165,10 @@ class IaPreguntasService:
         print("   - Timeout:", self.timeout_ms, "ms")
         print("═══════════════════════════════════════════════════════════")
 
-        system_prompt = self._construir_system_prompt(estilo_kolb, area)
-        user_prompt = self._construir_user_prompt(area, subtema, cantidad)
-
         start_time = time.time()
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                temperature=0.2,  # Baja temperatura para respuestas más consistentes
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-                response_format={"type": "json_object"},
-                timeout=self.timeout_ms / 1000.0,  # segundos
-            )
+            preguntas, _usage = self._solicitar_preguntas(area, subtema, estilo_kolb, cantidad)
 
             duration_ms = int((time.time() - start_time) * 1000)
 
@@ -125,19 +176,10 @@ class IaPreguntasService:
             print(f"✅ [IA Preguntas] Respuesta recibida en {duration_ms}ms")
             print("═══════════════════════════════════════════════════════════")
 
-            content = response.choices[0].message.content
-            if not content:
-                raise ValueError("OpenAI no devolvió contenido")
-
-            parsed: RespuestaOpenAI = json.loads(content)
-
-            if not isinstance(parsed.get("preguntas"), list) or len(parsed["preguntas"]) == 0:
-                raise ValueError("OpenAI no devolvió preguntas válidas")
-
-            print(f"✅ [IA Preguntas] Parseadas {len(parsed['preguntas'])} preguntas correctamente")
+            print(f"✅ [IA Preguntas] Parseadas {len(preguntas)} preguntas correctamente")
 
             preguntas_transformadas: List[PreguntaTransformada] = []
-            for index, pregunta in enumerate(parsed["preguntas"], start=1):
+            for index, pregunta in enumerate(preguntas, start=1):
                 preguntas_transformadas.append(
                     self._transformar_pregunta(
                         pregunta,
@@ -165,33 +207,194 @@ class IaPreguntasService:
             raise
 
     # --------------------------------------------------------
-    # PROMPTS
+
+    def _solicitar_preguntas(
+        self,
+        area: str,
+        subtema: str,
+        estilo_kolb: str,
+        cantidad: int,
+        max_tokens: Optional[int] = None,
+    ) -> Tuple[List[PreguntaGenerada], Dict[str, int]]:
+        """
+        Una llamada a OpenAI: devuelve las preguntas crudas ya parseadas y el usage.
+        """
+        assert self.client is not None
+
+        system_prompt = self._construir_system_prompt(estilo_kolb, area)
+        user_prompt = self._construir_user_prompt(area, subtema, cantidad)
+        modo_prompt = "compacto" if self.prompt_compacto else "completo"
+
+        kwargs: Dict[str, Any] = {}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+
+        with etiqueta_corpus(tipo="servicio", area=area, subtema=subtema, estilo_kolb=estilo_kolb,
+                             cantidad=cantidad, prompt=modo_prompt):
+            response = self.client.chat.completions.create(
+                model=self.model,
+                temperature=0.2,  # Baja temperatura para respuestas más consistentes
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                response_format={"type": "json_object"},
+                timeout=self.timeout_ms / 1000.0,  # segundos
+                **kwargs,
+            )
+
+        if response.choices[0].finish_reason == "length":
+            raise ValueError("Respuesta de OpenAI truncada (max_tokens alcanzado)")
+
+        content = response.choices[0].message.content
+        if not content:
+            raise ValueError("OpenAI no devolvió contenido")
+
+        parsed: RespuestaOpenAI = json.loads(content)
+
+        if not isinstance(parsed.get("preguntas"), list) or len(parsed["preguntas"]) == 0:
+            raise ValueError("OpenAI no devolvió preguntas válidas")
+
+        u = getattr(response, "usage", None)
+        usage = {
+            "prompt_tokens": getattr(u, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(u, "completion_tokens", 0) or 0,
+            "total_tokens": getattr(u, "total_tokens", 0) or 0,
+        }
+        return parsed["preguntas"], usage
+
+    # --------------------------------------------------------
+    # GENERACIÓN MASIVA
     # --------------------------------------------------------
 
-    def _construir_system_prompt(self, estilo_kolb: str, area: str) -> str:
-        caracteristicas_estilo: Dict[str, str] = {
-            "Divergente": (
-                "Enfócate en situaciones problema que requieran pensamiento creativo, "
-                "análisis desde múltiples perspectivas y reflexión. Usa contextos cotidianos "
-                "y preguntas abiertas que inviten a imaginar soluciones."
-            ),
-            "Asimilador": (
-                "Prioriza la comprensión de teorías, modelos conceptuales y relaciones lógicas "
-                "entre ideas. Incluye definiciones claras, explicaciones sistemáticas y preguntas "
-                "que requieran razonamiento abstracto."
-            ),
-            "Convergente": (
-                "Presenta problemas con una solución práctica y concreta. Enfócate en aplicación "
-                "directa de conocimientos, resolución eficiente de problemas y preguntas con "
-                "respuesta única y definida."
-            ),
-            "Acomodador": (
-                "Usa escenarios reales, experimentación práctica y situaciones que requieran tomar "
-                "decisiones rápidas. Incluye contextos dinámicos donde se aprende haciendo y "
-                "ajustando sobre la marcha."
-            ),
+    def preguntas_por_llamada(self) -> int:
+        """Cuántas preguntas caben en una respuesta según el presupuesto de tokens."""
+        return max(1, self.max_tokens_respuesta // max(1, self.tokens_por_pregunta))
+
+    def generar_preguntas_bulk(
+        self,
+        especificaciones: List[EspecificacionBulk],
+        max_concurrencia: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Genera muchas especificaciones (área, subtema, estilo_kolb, cantidad) de una vez.
+
+        Cada cantidad se parte en tramos de a lo sumo `preguntas_por_llamada()` preguntas
+        (una completion con muchas preguntas suele truncarse), los tramos de todas las
+        especificaciones se ejecutan en paralelo en un pool acotado y luego se unen por
+        especificación, renumerando `orden` desde 1. Un tramo fallido no tumba al resto:
+        su error queda en `errores` de la especificación.
+
+        Devuelve:
+          {
+            "resultados": [ResultadoBulk, ...],   # mismo orden que `especificaciones`
+            "usage": {prompt_tokens, completion_tokens, total_tokens},
+            "tiempos": {total_ms, llamadas, llamada_ms_promedio, llamada_ms_max, secuencial_ms}
+          }
+        """
+
+        if not self.enabled or self.client is None:
+            raise RuntimeError("Servicio de IA no habilitado - API key no configurada")
+
+        por_llamada = self.preguntas_por_llamada()
+        tramos: List[Tuple[int, int]] = []  # (índice de especificación, cantidad del tramo)
+        for i, spec in enumerate(especificaciones):
+            restante = int(spec["cantidad"])
+            while restante > 0:
+                n = min(por_llamada, restante)
+                tramos.append((i, n))
+                restante -= n
+
+        workers = max(1, min(max_concurrencia or self.bulk_concurrencia, len(tramos) or 1))
+        max_tokens = min(self.max_tokens_respuesta, por_llamada * self.tokens_por_pregunta)
+
+        print(
+            f"🤖 [IA Preguntas] Bulk: {len(especificaciones)} especificaciones, "
+            f"{len(tramos)} llamadas (≤{por_llamada} preguntas c/u), concurrencia {workers}"
+        )
+
+        def ejecutar(tramo: Tuple[int, int]) -> Tuple[List[PreguntaTransformada], Dict[str, int], int, List[str]]:
+            i, n = tramo
+            spec = especificaciones[i]
+            t0 = time.time()
+            try:
+                preguntas, usage = self._solicitar_preguntas(
+                    spec["area"], spec["subtema"], spec["estilo_kolb"], n, max_tokens=max_tokens
+                )
+            except Exception as e:
+                return [], {}, int((time.time() - t0) * 1000), [f"{type(e).__name__}: {e}"]
+            # Una pregunta malformada se descarta sola: el tramo ya está pagado
+            transformadas: List[PreguntaTransformada] = []
+            errores: List[str] = []
+            for k, pregunta in enumerate(preguntas[:n], 1):
+                try:
+                    transformadas.append(
+                        self._transformar_pregunta(
+                            pregunta, orden=0, area=spec["area"], subtema=spec["subtema"],
+                            estilo_kolb=spec["estilo_kolb"],
+                        )
+                    )
+                except Exception as e:
+                    errores.append(f"Pregunta {k} descartada: {type(e).__name__}: {e}")
+            return transformadas, usage, int((time.time() - t0) * 1000), errores
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ia-bulk") as pool:
+            salidas = list(pool.map(ejecutar, tramos))
+        total_ms = int((time.time() - start_time) * 1000)
+
+        resultados: List[ResultadoBulk] = [
+            {
+                "area": spec["area"],
+                "subtema": spec["subtema"],
+                "estilo_kolb": spec["estilo_kolb"],
+                "solicitadas": int(spec["cantidad"]),
+                "preguntas": [],
+                "errores": [],
+            }
+            for spec in especificaciones
+        ]
+        usage_total = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        duraciones: List[int] = []
+
+        for (i, _n), (preguntas, usage, ms, errores) in zip(tramos, salidas):
+            res = resultados[i]
+            duraciones.append(ms)
+            for k in usage_total:
+                usage_total[k] += usage.get(k, 0)
+            res["errores"].extend(errores)
+            for pregunta in preguntas:
+                pregunta["orden"] = len(res["preguntas"]) + 1
+                res["preguntas"].append(pregunta)
+
+        fallidas = sum(len(r["errores"]) for r in resultados)
+        print(
+            f"✅ [IA Preguntas] Bulk: {sum(len(r['preguntas']) for r in resultados)} preguntas en "
+            f"{total_ms}ms ({len(tramos)} llamadas, {fallidas} errores)"
+        )
+
+        return {
+            "resultados": resultados,
+            "usage": usage_total,
+            "tiempos": {
+                "total_ms": total_ms,
+                "llamadas": len(tramos),
+                "llamada_ms_promedio": int(sum(duraciones) / len(duraciones)) if duraciones else 0,
+                "llamada_ms_max": max(duraciones, default=0),
+                "secuencial_ms": sum(duraciones),  # lo que habría tardado en serie
+            },
         }
 
+    # --------------------------------------------------------
+    # PROMPTS
+    # --------------------------------------------------------
+
+    def _construir_system_prompt(
+        self, estilo_kolb: str, area: str, compacto: Optional[bool] = None
+    ) -> str:
+        if self.prompt_compacto if compacto is None else compacto:
+            return self._construir_system_prompt_compacto(estilo_kolb, area)
+
         area_oficial = ICFES_AREA_ALIAS.get(area, area)
         info_area = ICFES_SABER11_FUENTES.get(area_oficial)
         contexto_area = ""
@@ -301,7 +504,7 @@ Debes generar preguntas que evalúen competencias, no solo memorización.
   - Subject/Object pronouns & Possessive adjectives
 
 ESTILO DE APRENDIZAJE KOLB: {estilo_kolb}
-{caracteristicas_estilo.get(estilo_kolb, "")}
+{CARACTERISTICAS_ESTILO.get(estilo_kolb, "")}
 
 CARACTERÍSTICAS DE LAS PREGUNTAS:
 - Nivel: Educación media (grado 10-11)
@@ -340,6 +543,56 @@ IMPORTANTE:
 
     # --------------------------------------------------------
 
+    def _construir_system_prompt_compacto(self, estilo_kolb: str, area: str) -> str:
+        """
+        Versión corta del prompt de sistema (IA_PROMPT_COMPACTO=1): sin la lista de las 5 áreas
+        y sus subtemas (el subtema va en el prompt de usuario), con solo las competencias y
+        componentes del área pedida; las fuentes oficiales solo si IA_PROMPT_FUENTES=1.
+        """
+        area_oficial = ICFES_AREA_ALIAS.get(area, area)
+        info_area = ICFES_SABER11_FUENTES.get(area_oficial) or {}
+
+        lineas = [
+            f'Eres experto en preguntas tipo ICFES Saber 11° (Colombia, grado 11) del área "{area_oficial}".',
+            "Evalúa competencias, no memorización.",
+        ]
+        if info_area.get("descripcion"):
+            lineas.append(f"Área: {info_area['descripcion']}")
+        lineas += [
+            "",
+            f"ESTILO KOLB {estilo_kolb}: {CARACTERISTICAS_ESTILO.get(estilo_kolb, '')}",
+        ]
+
+        competencias = info_area.get("competencias") or []
+        if competencias:
+            lineas += ["", "COMPETENCIAS:"]
+            lineas += [f"- {c.get('nombre')}: {c.get('descripcion')}" for c in competencias]
+
+        componentes = info_area.get("componentes") or []
+        if componentes:
+            lineas += ["", "COMPONENTES: " + "; ".join(componentes)]
+
+        fuentes = info_area.get("fuentes") or []
+        if self.prompt_fuentes and fuentes:
+            lineas += ["", "FUENTES (solo contexto, no las menciones):"]
+            lineas += [f"- {f.get('titulo')} ({f.get('url')})" for f in fuentes]
+
+        lineas += [
+            "",
+            "REGLAS:",
+            "- Opción múltiple con única respuesta: exactamente 4 opciones (A, B, C, D)",
+            "- Pregunta de 200-350 caracteres, contexto colombiano",
+            "- Distractores plausibles pero claramente erróneos; explicación breve de la correcta",
+            "- Todo en español; usa el subtema EXACTO solicitado; cada pregunta única",
+            "",
+            "Devuelve SOLO este JSON:",
+            '{"preguntas": [{"pregunta": "...", "opciones": {"A": "...", "B": "...", "C": "...", "D": "..."}, '
+            '"respuesta_correcta": "A", "explicacion": "..."}]}',
+        ]
+        return "\n".join(lineas)
+
+    # --------------------------------------------------------
+
     def _construir_user_prompt(
         self,
         area: str,
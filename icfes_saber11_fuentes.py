@@ -9,6 +9,7 @@
 #   - Nombre oficial de cada prueba
 #   - Descripción general por área
 #   - Competencias clave / componentes
+#   - Número de preguntas de la prueba (guía de orientación)
 #   - Lista de fuentes documentales (URL oficiales)
 # Para ser usado por EduExcel en prompts y metadatos.
 # ------------------------------------------------------------
@@ -25,6 +26,7 @@ ICFES_AREA_ALIAS = {
 ICFES_SABER11_FUENTES = {
     "Lectura Crítica": {
         "codigo_area": "LC",
+        "numero_preguntas": 41,
         "descripcion": (
             "Evalúa la capacidad del estudiante para comprender, interpretar y evaluar textos "
             "que se encuentran en la vida cotidiana y en contextos académicos no especializados. "
@@ -97,6 +99,7 @@ ICFES_SABER11_FUENTES = {
 
     "Matemáticas": {
         "codigo_area": "MAT",
+        "numero_preguntas": 50,
         "descripcion": (
             "Evalúa las competencias para enfrentar situaciones que requieren el uso de "
             "herramientas matemáticas en las categorías de álgebra y cálculo, geometría y "
@@ -160,6 +163,7 @@ ICFES_SABER11_FUENTES = {
 
     "Ciencias Naturales": {
         "codigo_area": "CN",
+        "numero_preguntas": 58,
         "descripcion": (
             "Evalúa la capacidad del estudiante para comprender y usar nociones, conceptos y "
             "teorías de las ciencias naturales en la solución de problemas, valorando de manera "
@@ -221,6 +225,7 @@ ICFES_SABER11_FUENTES = {
 
     "Inglés": {
         "codigo_area": "ING",
+        "numero_preguntas": 55,
         "descripcion": (
             "Evalúa la competencia comunicativa en lengua inglesa del estudiante, de acuerdo "
             "con el Marco Común Europeo, mediante tareas de lectura, gramática y léxico."
@@ -266,6 +271,7 @@ ICFES_SABER11_FUENTES = {
 
     "Sociales y Ciudadanas": {
         "codigo_area": "SOC",
+        "numero_preguntas": 50,
         "descripcion": (
             "Evalúa los conocimientos y habilidades que permiten comprender el mundo social "
             "desde la perspectiva de las ciencias sociales y el ejercicio de la ciudadanía."
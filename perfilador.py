@@ -0,0 +1,141 @@
+# perfilador.py — Perfilador por muestreo para diagnosticar latencia en producción
+# ------------------------------------------------------------
+# Un hilo toma cada `intervalo_s` las pilas de todos los hilos vivos (sys._current_frames) durante
+# `segundos`, sin instrumentar el código: el costo es proporcional a la frecuencia de muestreo y no
+# al tráfico. Por muestra y por hilo se atribuye:
+# - tiempo de pared: lo transcurrido desde la muestra anterior
+# - tiempo de CPU: delta del reloj de CPU del hilo (time.pthread_getcpuclockid, Linux)
+# a cada función de la pila (inclusivo) y a la hoja (propio). CPU/pared cercano a 1 indica trabajo
+# en Python (reparación de JSON, validación Pydantic); cercano a 0, espera (proveedor, locks, red).
+# Salida "collapsed" (una línea "hilo;f1;f2;...;hoja N" por pila) compatible con flamegraph.pl,
+# speedscope o inferno.
+# Se omiten los hilos que no ejecutan código del proyecto (pools ociosos, event loop en select).
+# ------------------------------------------------------------
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+_DIR_PROYECTO = os.path.dirname(os.path.abspath(__file__))
+MAX_SEGUNDOS = 60.0
+MIN_INTERVALO_S = 0.001
+MAX_PROFUNDIDAD = 128
+
+class PerfiladorOcupado(Exception):
+    """Ya hay un perfilado en curso en este proceso."""
+
+def _cpu_hilo(ident: int) -> Optional[float]:
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+def _es_del_proyecto(archivo: str) -> bool:
+    return archivo.startswith(_DIR_PROYECTO) and "site-packages" not in archivo
+
+def _etiqueta(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def _pila(frame) -> Tuple[List[str], bool]:
+    """Etiquetas de la raíz a la hoja y si algún marco es código del proyecto."""
+    etiquetas: List[str] = []
+    propio = False
+    while frame is not None and len(etiquetas) < MAX_PROFUNDIDAD:
+        code = frame.f_code
+        etiquetas.append(_etiqueta(code))
+        propio = propio or _es_del_proyecto(code.co_filename)
+        frame = frame.f_back
+    etiquetas.reverse()
+    return etiquetas, propio
+
+class PerfiladorMuestreo:
+    """Un perfilado a la vez por proceso; `perfilar` bloquea el hilo que lo llama durante `segundos`."""
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def perfilar(self, segundos: float, intervalo_s: float = 0.01, incluir_ociosos: bool = False,
+                 top: int = 40) -> dict:
+        if not self._lock.acquire(blocking=False):
+            raise PerfiladorOcupado("ya hay un perfilado en curso")
+        try:
+            return self._perfilar(min(max(segundos, 0.1), MAX_SEGUNDOS), max(intervalo_s, MIN_INTERVALO_S),
+                                  incluir_ociosos, top)
+        finally:
+            self._lock.release()
+
+    def _perfilar(self, segundos: float, intervalo_s: float, incluir_ociosos: bool, top: int) -> dict:
+        propio_ident = threading.get_ident()
+        pilas: Counter = Counter()
+        wall: Dict[str, float] = {}
+        cpu: Dict[str, float] = {}
+        wall_propio: Dict[str, float] = {}
+        cpu_propio: Dict[str, float] = {}
+        muestras_fn: Counter = Counter()
+        cpu_previo: Dict[int, float] = {}
+        hilos_vistos = set()
+        cpu_disponible = True
+
+        cpu_perfilador0 = time.thread_time()
+        inicio = anterior = time.perf_counter()
+        fin = inicio + segundos
+        n_muestras = 0
+        while True:
+            time.sleep(intervalo_s)
+            ahora = time.perf_counter()
+            dt = ahora - anterior
+            anterior = ahora
+            nombres = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == propio_ident:
+                    continue
+                etiquetas, propio = _pila(frame)
+                cpu_actual = _cpu_hilo(ident)
+                d_cpu = 0.0
+                if cpu_actual is None:
+                    cpu_disponible = False
+                else:
+                    if ident in cpu_previo:
+                        d_cpu = max(0.0, cpu_actual - cpu_previo[ident])
+                    cpu_previo[ident] = cpu_actual
+                if not etiquetas or not (propio or incluir_ociosos):
+                    continue
+                hilos_vistos.add(ident)
+                hilo = nombres.get(ident, str(ident)).replace(";", "_").replace(" ", "_")
+                pilas[";".join([hilo] + etiquetas)] += 1
+                for fn in set(etiquetas):
+                    wall[fn] = wall.get(fn, 0.0) + dt
+                    cpu[fn] = cpu.get(fn, 0.0) + d_cpu
+                    muestras_fn[fn] += 1
+                hoja = etiquetas[-1]
+                wall_propio[hoja] = wall_propio.get(hoja, 0.0) + dt
+                cpu_propio[hoja] = cpu_propio.get(hoja, 0.0) + d_cpu
+            n_muestras += 1
+            if ahora >= fin:
+                break
+        duracion = time.perf_counter() - inicio
+
+        funciones = sorted(wall, key=lambda fn: (-wall[fn], fn))[:top]
+        return {
+            "duracion_s": round(duracion, 3),
+            "intervalo_s": intervalo_s,
+            "muestras": n_muestras,
+            "hilos_muestreados": len(hilos_vistos),
+            "cpu_disponible": cpu_disponible,
+            "overhead_cpu_s": round(time.thread_time() - cpu_perfilador0, 4),
+            "funciones": [
+                {
+                    "funcion": fn,
+                    "muestras": muestras_fn[fn],
+                    "wall_s": round(wall[fn], 4),
+                    "cpu_s": round(cpu[fn], 4),
+                    "cpu_sobre_wall": round(cpu[fn] / wall[fn], 3) if wall[fn] else 0.0,
+                    "wall_propio_s": round(wall_propio.get(fn, 0.0), 4),
+                    "cpu_propio_s": round(cpu_propio.get(fn, 0.0), 4),
+                }
+                for fn in funciones
+            ],
+            "collapsed": "\n".join(f"{pila} {n}" for pila, n in sorted(pilas.items())),
+        }
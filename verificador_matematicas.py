@@ -0,0 +1,563 @@
+# verificador_matematicas.py — Verificación local de la clave en ítems de Matemáticas
+# ------------------------------------------------------------
+# La causa principal de regenerar un ítem de Matemáticas es una respuesta_correcta equivocada.
+# Aquí se extraen las cantidades del enunciado (y los cálculos de la explicación), se calcula la
+# respuesta sin llamar al modelo y se compara con las opciones:
+# - la opción de la clave es la única que coincide: se confirma ("verificado")
+# - otra opción es la única que coincide: se corrige la clave ("corregido")
+# - ninguna o varias coinciden: el ítem se rechaza ("rechazado")
+# - en cualquier otro caso el ítem pasa sin cambios ("no_verificable")
+# Corregir o rechazar exige dos fuentes: el valor calculado del enunciado debe coincidir con el
+# resultado (recalculado) de la explicación; si no hay explicación que lo respalde, no se decide.
+# Solo se verifican ítems de respuesta numérica (las cuatro opciones son cantidades).
+# Métodos por subtema de ALLOWED["Matemáticas"]:
+# - expresión aritmética (enteros), ecuación lineal y sistema 2×2 (regla de Cramer)
+# - proporción con incógnita (a/b = x/c), reparto en una razón a:b
+# - regla de tres simple directa/inversa, porcentaje de una cantidad, aumento/descuento, interés simple
+# Las expresiones que el enunciado cita ("Juan resolvió 12 - 3 × 2 y obtuvo...") y los rangos
+# ("entre 2023-2024") no se evalúan.
+# La explicación también se verifica: "a op b = c" con c mal calculado se recalcula en cadena.
+# Una coincidencia exige que el valor calculado redondee a la precisión mostrada en la opción.
+# Los textos se normalizan con la función de EduExce (`norm_fn`, la misma del dedup y la búsqueda).
+# Solo regex y aritmética de punto flotante: decenas de microsegundos por ítem.
+#
+# Casos de regresión:  python verificador_matematicas.py casos_verificador_matematicas.json
+# ------------------------------------------------------------
+
+import json
+import re
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+LETRAS = "ABCD"
+_NUM = r"\d+(?:[.,]\d+)*"
+_RE_NUM = re.compile(_NUM)
+
+def _signos(s: str) -> str:
+    """Después de norm_fn: signo menos tipográfico y guion largo como '-'."""
+    return s.replace("\u2212", "-").replace("\u2013", "-").replace("\u00a0", " ")
+
+def a_numero(tok: str) -> Tuple[float, int]:
+    """'1.200' -> (1200, 0); '3,5' -> (3.5, 1). Devuelve (valor, decimales mostrados)."""
+    t = tok
+    if "," in t and "." in t:
+        dec = "," if t.rfind(",") > t.rfind(".") else "."
+        t = t.replace("." if dec == "," else ",", "").replace(",", ".")
+    else:
+        for sep in ",.":
+            if sep in t:
+                partes = t.split(sep)
+                miles = len(partes) > 2 or (len(partes[1]) == 3 and partes[0] != "0")
+                t = t.replace(sep, "") if miles else t.replace(sep, ".")
+    _, _, frac = t.partition(".")
+    return float(t), len(frac)
+
+# ===================== Expresiones aritméticas =====================
+_RE_TOKEN = re.compile(r"\s*(?:(" + _NUM + r")\s*(%)?|([-+×x*·/÷:^()])|([²³]))")
+
+class _Parser:
+    """Descenso recursivo: + - ; × · * / ÷ : ; ^ ² ³ ; paréntesis y multiplicación implícita."""
+    def __init__(self, texto: str, sustituir: Optional[Dict[float, float]] = None):
+        self.tokens: List[Tuple[str, object]] = []
+        pos = 0
+        texto = texto.strip()
+        while pos < len(texto):
+            m = _RE_TOKEN.match(texto, pos)
+            if not m or m.end() == pos:
+                raise ValueError("token")
+            pos = m.end()
+            if m.group(1):
+                v, _ = a_numero(m.group(1))
+                if sustituir:
+                    v = sustituir.get(v, v)
+                self.tokens.append(("n", v / 100 if m.group(2) else v))
+            elif m.group(3):
+                op = m.group(3)
+                self.tokens.append(("op", {"x": "*", "×": "*", "·": "*", "÷": "/", ":": "/"}.get(op, op)))
+            else:
+                self.tokens.append(("pot", 2 if m.group(4) == "²" else 3))
+        self.i = 0
+
+    def _ver(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None)
+
+    def evaluar(self) -> float:
+        v = self._suma()
+        if self.i != len(self.tokens):
+            raise ValueError("sobrante")
+        return v
+
+    def _suma(self) -> float:
+        v = self._producto()
+        while self._ver() in (("op", "+"), ("op", "-")):
+            op = self.tokens[self.i][1]
+            self.i += 1
+            w = self._producto()
+            v = v + w if op == "+" else v - w
+        return v
+
+    def _producto(self) -> float:
+        v = self._unario()
+        while True:
+            tipo, op = self._ver()
+            if tipo == "op" and op in ("*", "/"):
+                self.i += 1
+                w = self._unario()
+                v = v * w if op == "*" else v / w
+            elif op == "(" or tipo == "n" and self.i and self.tokens[self.i - 1] == ("op", ")"):
+                v = v * self._unario()  # 2(3 + 4)
+            else:
+                return v
+
+    def _unario(self) -> float:
+        if self._ver() in (("op", "-"), ("op", "+")):
+            signo = -1.0 if self.tokens[self.i][1] == "-" else 1.0
+            self.i += 1
+            return signo * self._unario()
+        return self._potencia()
+
+    def _potencia(self) -> float:
+        v = self._atomo()
+        while True:
+            tipo, op = self._ver()
+            if tipo == "pot":
+                self.i += 1
+                v = v ** op
+            elif (tipo, op) == ("op", "^"):
+                self.i += 1
+                v = v ** self._unario()
+            else:
+                return v
+
+    def _atomo(self) -> float:
+        tipo, v = self._ver()
+        self.i += 1
+        if tipo == "n":
+            return v
+        if (tipo, v) == ("op", "("):
+            r = self._suma()
+            if self._ver() != ("op", ")"):
+                raise ValueError("paréntesis")
+            self.i += 1
+            return r
+        raise ValueError("átomo")
+
+def evaluar(expr: str, sustituir: Optional[Dict[float, float]] = None) -> Optional[float]:
+    try:
+        return _Parser(expr, sustituir).evaluar()
+    except (ValueError, ZeroDivisionError, OverflowError, IndexError):
+        return None
+
+_OPERADOR = re.compile(r"\d\s*%?\s*\)?\s*[-+×*·/÷:^]\s*\(?\s*[-(]?\s*\d|\d\s*[²³]|\d\s*\)?\s*x\s*\(?\s*-?\s*\d")
+_RE_EXPRESION = re.compile(r"[-(\d][\d\s.,+\-×x*·/÷:^()²³%]*[\d)²³%]")
+
+def _expresiones(texto: str) -> List[str]:
+    return [m.group(0) for m in _RE_EXPRESION.finditer(texto) if _OPERADOR.search(m.group(0))]
+
+# ===================== Cálculos de la explicación =====================
+_RE_CADENA = re.compile(r"[-(\d][\d\s.,+\-×x*·/÷:^()²³%$=]*=[\d\s.,+\-()$%]*\d%?")
+
+def resultado_explicacion(explicacion: str) -> Optional[float]:
+    """
+    Valor final de los cálculos 'expr = n' de la explicación (ya normalizada). Si un paso está mal
+    calculado se usa el valor correcto y se sustituye en los pasos siguientes (el error no se arrastra).
+    """
+    correcciones: Dict[float, float] = {}
+    final = None
+    for m in _RE_CADENA.finditer(explicacion.replace("$", "")):
+        partes = [p.strip(" ,.") for p in m.group(0).split("=")]
+        if len(partes) < 2 or not _OPERADOR.search(partes[0]):
+            continue
+        valor = evaluar(partes[0], correcciones)
+        if valor is None:
+            continue
+        for p in partes[1:]:
+            literal = evaluar(p)
+            if literal is not None and not _OPERADOR.search(p) and not _cerca(literal, valor, 0):
+                correcciones[literal] = valor
+        final = valor
+    return final
+
+# ===================== Opciones =====================
+def _cerca(valor: float, objetivo: float, decimales: int) -> bool:
+    tol = 0.5 * 10 ** -decimales if decimales < 6 else 1e-9
+    return abs(valor - objetivo) <= tol * (1 - 1e-9) + 1e-9 * max(1.0, abs(objetivo))
+
+_RE_FRACCION = re.compile(r"^\s*(-?)\s*(\d+)\s*/\s*(\d+)\s*$")
+_RE_NUM_OPCION = re.compile(r"(-?)\s*\$?\s*(" + _NUM + r")")
+_RE_PAREJA = re.compile(r"x\s*=\s*(-?\s*" + _NUM + r").*?y\s*=\s*(-?\s*" + _NUM + r")"
+                        r"|\(\s*(-?\s*" + _NUM + r")\s*[;,]\s*(-?\s*" + _NUM + r")\s*\)")
+
+def valor_opcion(texto: str) -> Optional[Tuple[float, int]]:
+    """Primer número de la opción (con signo) y sus decimales; las fracciones 'a/b' son exactas."""
+    t = texto
+    if "=" in t:
+        t = t.split("=")[-1]
+    m = _RE_FRACCION.match(t)
+    if m and int(m.group(3)):
+        v = int(m.group(2)) / int(m.group(3))
+        return (-v if m.group(1) else v), 9
+    m = _RE_NUM_OPCION.search(t)
+    if not m:
+        return None
+    v, dec = a_numero(m.group(2))
+    return (-v if m.group(1) else v), dec
+
+def pareja_opcion(texto: str) -> Optional[Tuple[float, float]]:
+    m = _RE_PAREJA.search(texto)
+    if not m:
+        return None
+    a, b = (m.group(1), m.group(2)) if m.group(1) else (m.group(3), m.group(4))
+    num = lambda s: (-1 if s.strip().startswith("-") else 1) * a_numero(s.replace("-", "").strip())[0]
+    return num(a), num(b)
+
+# Palabras que puede llevar una opción numérica además de la cantidad (unidades, moneda)
+_RE_RESTO_OPCION = re.compile(r"[$%°.,;:()=+\-/]|\b(?:[xy]|pesos?|cop|grados?|c|cm|m|km|kg|g|l|ml|"
+                              r"anos?|meses?|dias?|horas?|minutos?|unidades?)\b")
+
+def opciones_numericas(opciones: Dict[str, str]) -> bool:
+    """Las cuatro opciones son cantidades (con unidad a lo sumo), no frases que contienen números."""
+    for L in LETRAS:
+        texto = opciones.get(L, "")
+        if valor_opcion(texto) is None and pareja_opcion(texto) is None:
+            return False
+        if len(_RE_RESTO_OPCION.sub(" ", _RE_NUM.sub(" ", texto)).split()) > 1:
+            return False
+    return True
+
+def opciones_que_coinciden(opciones: Dict[str, str], valor) -> List[str]:
+    letras = []
+    for L in LETRAS:
+        texto = str(opciones.get(L, ""))
+        if isinstance(valor, tuple):
+            p = pareja_opcion(texto)
+            if p and _cerca(p[0], valor[0], 2) and _cerca(p[1], valor[1], 2):
+                letras.append(L)
+        else:
+            v = valor_opcion(texto)
+            if v and _cerca(valor, v[0], v[1]):
+                letras.append(L)
+    return letras
+
+# ===================== Extractores del enunciado =====================
+def _pregunta_final(texto: str) -> str:
+    i = texto.rfind("¿")
+    if i >= 0:
+        return texto[i:]
+    frases = re.split(r"(?<=[.:])\s+", texto.strip())
+    return frases[-1] if frases else texto
+
+_COEF = r"\d+(?:[.,]\d+)?"
+_TERM = rf"(?:{_COEF}(?:\s*[*·]\s*)?[xy]|[xy]|{_COEF})"  # "12 y x" no es 12·y
+_LADO = rf"[-+]?\s*{_TERM}(?:\s*[-+]\s*{_TERM})*"
+_RE_ECUACION = re.compile(rf"(?<![\w.,])({_LADO})\s*=\s*({_LADO})(?![\w])")
+_RE_TERMINO = re.compile(rf"([-+]?)\s*({_COEF})?\s*[*·]?\s*([xy])?")
+
+def _lado_lineal(lado: str) -> Optional[Tuple[float, float, float]]:
+    cx = cy = c = 0.0
+    pos = 0
+    lado = lado.replace(" ", "")
+    while pos < len(lado):
+        m = _RE_TERMINO.match(lado, pos)
+        if not m or m.end() == pos:
+            return None
+        pos = m.end()
+        signo = -1.0 if m.group(1) == "-" else 1.0
+        coef = a_numero(m.group(2))[0] if m.group(2) else 1.0
+        if m.group(3) == "x":
+            cx += signo * coef
+        elif m.group(3) == "y":
+            cy += signo * coef
+        elif m.group(2):
+            c += signo * coef
+        else:
+            return None
+    return cx, cy, c
+
+def _ecuaciones(texto: str) -> List[Tuple[float, float, float]]:
+    """Ecuaciones a·x + b·y = c del texto (con al menos una variable)."""
+    out = []
+    for m in _RE_ECUACION.finditer(texto):
+        izq, der = _lado_lineal(m.group(1)), _lado_lineal(m.group(2))
+        if izq is None or der is None:
+            continue
+        a, b, c = izq[0] - der[0], izq[1] - der[1], der[2] - izq[2]
+        if a or b:
+            out.append((a, b, c))
+    return out
+
+def _sistema(texto: str, pregunta: str, opciones: Dict[str, str]):
+    ecs = _ecuaciones(texto)
+    if not ecs:
+        return None
+    if all(b == 0 for _, b, _ in ecs):  # ecuación lineal en x
+        a, _, c = ecs[0]
+        return c / a if "valor de x" in pregunta or "x" in pregunta or len(ecs) == 1 else None
+    for i in range(len(ecs)):
+        for j in range(i + 1, len(ecs)):
+            (a1, b1, c1), (a2, b2, c2) = ecs[i], ecs[j]
+            det = a1 * b2 - a2 * b1
+            if abs(det) < 1e-12:
+                continue
+            x, y = (c1 * b2 - c2 * b1) / det, (a1 * c2 - a2 * c1) / det
+            if re.search(r"x\s*\+\s*y|suma", pregunta):
+                return x + y
+            if re.search(r"x\s*-\s*y|diferencia", pregunta):
+                return x - y
+            if re.search(r"x\s*[*·]\s*y|producto|\bxy\b", pregunta):
+                return x * y
+            if re.search(r"valor de x|cuanto vale x|\bx\s*=\s*\?", pregunta) and not re.search(r"\by\b\s*\?", pregunta):
+                return x
+            if re.search(r"valor de y|cuanto vale y", pregunta):
+                return y
+            if any(pareja_opcion(str(v)) for v in opciones.values()):
+                return (x, y)
+            return None
+    return None
+
+_RE_PROPORCION = re.compile(rf"({_NUM})\s*[/:]\s*({_NUM})\s*(?:=|::)\s*({_NUM}|x)\s*[/:]\s*({_NUM}|x)")
+
+def _proporcion(texto: str):
+    for m in _RE_PROPORCION.finditer(texto):
+        a, b, c, d = m.groups()
+        if (c == "x") == (d == "x"):
+            continue
+        a, b = a_numero(a)[0], a_numero(b)[0]
+        if c == "x":
+            return a * a_numero(d)[0] / b if b else None
+        return b * a_numero(c)[0] / a if a else None
+    return None
+
+def _cantidades(texto: str) -> Tuple[List[float], List[float], Dict[str, float]]:
+    """(porcentajes, demás números en orden, números ligados a unidades de tiempo)."""
+    pct, otros, tiempos = [], [], {}
+    for m in re.finditer(rf"({_NUM})\s*(%|por ciento)?(\s*(?:anos?|meses?|mes|dias?)\b)?", texto):
+        v = a_numero(m.group(1))[0]
+        if m.group(2):
+            pct.append(v)
+        elif m.group(3):
+            tiempos[m.group(3).strip()[:3]] = v
+        else:
+            otros.append(v)
+    return pct, otros, tiempos
+
+def _porcentajes(texto: str, pregunta: str):
+    m = re.search(rf"({_NUM})\s*(?:%|por ciento) de\s*\$?\s*({_NUM})", pregunta)
+    if m:
+        return a_numero(m.group(1))[0] * a_numero(m.group(2))[0] / 100, "porcentaje_de"
+    pct, otros, tiempos = _cantidades(texto)
+    if len(pct) != 1:
+        return None, None
+    p = pct[0] / 100
+    if "interes simple" in texto:
+        if len(otros) != 1 or len(tiempos) != 1:
+            return None, None
+        (unidad, t), = tiempos.items()
+        mensual = "mensual" in texto
+        if unidad == "mes" and not mensual:
+            t /= 12
+        elif unidad == "ano" and mensual:
+            t *= 12
+        elif unidad == "dia":
+            return None, None
+        interes = otros[0] * p * t
+        if re.search(r"monto|total|acumulad|final|recib|retira", pregunta):
+            return otros[0] + interes, "interes_simple"
+        return (interes, "interes_simple") if "interes" in pregunta else (None, None)
+    if len(otros) != 1 or tiempos:
+        return None, None
+    baja = re.search(r"descuento|rebaja|disminu|reduc|baja", texto)
+    sube = re.search(r"aument|increment|sube|subio|recargo|\biva\b|alza", texto)
+    if bool(baja) == bool(sube):
+        return None, None
+    base = otros[0]
+    if re.search(r"final|pagar|paga|nuevo|queda|despues|tendra|costara|valdra", pregunta):
+        return base * (1 - p if baja else 1 + p), "aumento_descuento"
+    if re.search(r"descuento|ahorr|aumento|cuanto (sube|aumenta|baja|disminuye)", pregunta):
+        return base * p, "aumento_descuento"
+    return None, None
+
+_INVERSA = re.compile(r"(obrer|trabajador|persona|maquina|grifo|llave|pintor|velocidad|bomba)")
+_TIEMPO = re.compile(r"(dias|horas|minutos|tiempo|tard|demor)")
+
+def _regla_de_tres(texto: str):
+    if "compuesta" in texto:
+        return None
+    if _cantidades(texto)[0]:
+        return None
+    # Orden de aparición: "si a ... b, ¿... c?"
+    orden = [a_numero(m.group(0))[0] for m in _RE_NUM.finditer(texto)]
+    if len(orden) != 3:
+        return None
+    a, b, c = orden
+    if not a or not c:
+        return None
+    if _INVERSA.search(texto) and _TIEMPO.search(texto):
+        return a * b / c
+    return b * c / a
+
+def _reparto(texto: str, pregunta: str):
+    m = re.search(rf"razon\s*(?:de\s*)?({_NUM})\s*(?::|a)\s*({_NUM})", texto)
+    if not m:
+        return None
+    r1, r2 = a_numero(m.group(1))[0], a_numero(m.group(2))[0]
+    resto = texto[:m.start()] + texto[m.end():]
+    _, otros, _ = _cantidades(resto)
+    if len(otros) != 1 or not (r1 + r2):
+        return None
+    p1, p2 = otros[0] * r1 / (r1 + r2), otros[0] * r2 / (r1 + r2)
+    if re.search(r"mayor", pregunta):
+        return max(p1, p2)
+    if re.search(r"menor", pregunta):
+        return min(p1, p2)
+    if re.search(r"primer", pregunta):
+        return p1
+    if re.search(r"segund", pregunta):
+        return p2
+    return None
+
+_RE_RANGO = re.compile(r"^(?:1\d|20)\d\d\s*-\s*(?:1\d|20)?\d\d$")  # 2023-2024, 1990-95
+# El enunciado relata un cálculo ajeno (para buscar el error, comparar procedimientos, ...)
+_RE_CITA = re.compile(r"\b(resolvio|calculo|escribio|obtuvo|afirma|afirmo|dice|dijo|propone|propuso|"
+                      r"planteo|error|equivoc)")
+
+def _expresion(texto: str, pregunta: str, subtema: str):
+    if "entero" not in subtema and not re.search(r"expresion|operacion", pregunta):
+        return None
+    citada = _RE_CITA.search(texto)
+    exprs = sorted(_expresiones(pregunta) or _expresiones(texto), key=len, reverse=True)
+    for e in exprs:
+        e = e.strip(" ,.")
+        if "=" in e or _RE_RANGO.match(e) or re.search(rf"\bentre\s*\(?{re.escape(e)}", texto):
+            continue
+        if citada and e not in pregunta:
+            continue  # expresión citada, no pedida
+        v = evaluar(e)
+        if v is not None:
+            return v
+    return None
+
+# ===================== Verificación =====================
+class Verificacion(NamedTuple):
+    estado: str                 # verificado | corregido | rechazado | no_verificable
+    metodo: Optional[str]
+    correcta: Optional[str]     # letra a usar (None si rechazado o no verificable)
+    valor: Optional[object]     # respuesta calculada (número o pareja x, y)
+    detalle: str = ""
+
+    def meta(self, original: str) -> dict:
+        out = {"estado": self.estado, "metodo": self.metodo}
+        if self.valor is not None:
+            out["valor"] = [round(v, 6) for v in self.valor] if isinstance(self.valor, tuple) else round(self.valor, 6)
+        if self.estado == "corregido":
+            out["original"] = original
+        if self.detalle:
+            out["detalle"] = self.detalle
+        return out
+
+def _calcular(texto: str, pregunta: str, subtema: str, opciones: Dict[str, str]):
+    """(valor, método) con el primer método aplicable al subtema."""
+    if "ecuacion" in subtema or "sistema" in subtema:
+        v = _sistema(texto, pregunta, opciones)
+        if v is not None:
+            return v, "sistema_lineal"
+    if "razon" in subtema or "proporcion" in subtema:
+        v = _proporcion(texto)
+        if v is not None:
+            return v, "proporcion"
+        v = _reparto(texto, pregunta)
+        if v is not None:
+            return v, "reparto"
+    if "porcentaje" in subtema or "tasa" in subtema:
+        v, metodo = _porcentajes(texto, pregunta)
+        if v is not None:
+            return v, metodo
+    if "regla de tres" in subtema:
+        v = _proporcion(texto)
+        if v is not None:
+            return v, "proporcion"
+        v = _regla_de_tres(texto)
+        if v is not None:
+            return v, "regla_de_tres"
+    v = _expresion(texto, pregunta, subtema)
+    if v is not None:
+        return v, "expresion"
+    return None, None
+
+def verificar(pregunta: str, opciones: Dict[str, str], respuesta_correcta: str,
+              explicacion: str, subtema: str, norm_fn: Callable[[str], str]) -> Verificacion:
+    """
+    Calcula la respuesta del ítem y la contrasta con las opciones y la clave actual. `norm_fn`
+    viene de EduExce (_norm). Solo corrige o rechaza si el cálculo y la explicación coinciden.
+    """
+    norm = lambda t: _signos(norm_fn(str(t or "")))
+    texto = norm(pregunta)
+    opciones = {L: norm((opciones or {}).get(L, "")) for L in LETRAS}
+    if not opciones_numericas(opciones):
+        return Verificacion("no_verificable", None, None, None, "opciones no numéricas")
+    final = _pregunta_final(texto)
+    valor, metodo = _calcular(texto, final, norm(subtema), opciones)
+    de_explicacion = resultado_explicacion(norm(explicacion))
+
+    if valor is None:
+        if de_explicacion is None:
+            return Verificacion("no_verificable", None, None, None, "sin cantidades extraíbles")
+        # Solo la explicación: puede confirmar la clave, pero una sola fuente no la cambia
+        valor, metodo, respaldo = de_explicacion, "explicacion", False
+    else:
+        respaldo = (de_explicacion is not None and not isinstance(valor, tuple)
+                    and _cerca(valor, de_explicacion, 2))
+
+    letras = opciones_que_coinciden(opciones, valor)
+    if letras == [respuesta_correcta]:
+        return Verificacion("verificado", metodo, letras[0], valor)
+    if not respaldo:
+        detalle = "ninguna opción coincide" if not letras else (
+            f"señala {letras[0]}" if len(letras) == 1 else f"coinciden {', '.join(letras)}")
+        return Verificacion("no_verificable", metodo, None, valor, f"{detalle}; sin respaldo de la explicación")
+    if len(letras) == 1:
+        return Verificacion("corregido", metodo, letras[0], valor)
+    return Verificacion("rechazado", metodo, None, valor,
+                        "ninguna opción coincide" if not letras else f"coinciden {', '.join(letras)}")
+
+# ===================== Casos de regresión =====================
+
+def comprobar_casos(casos: List[dict], norm_fn: Callable[[str], str]) -> List[str]:
+    """
+    Corre `verificar` sobre cada caso ({nombre, subtema, pregunta, opciones, respuesta_correcta,
+    explicacion, esperado: {estado, correcta?, metodo?}}) y devuelve las discrepancias.
+    """
+    fallos = []
+    for c in casos:
+        v = verificar(c["pregunta"], c["opciones"], c["respuesta_correcta"], c.get("explicacion", ""),
+                      c["subtema"], norm_fn)
+        obtenido = {"estado": v.estado, "correcta": v.correcta, "metodo": v.metodo}
+        distintos = {k: (esperado, obtenido[k]) for k, esperado in c["esperado"].items() if obtenido[k] != esperado}
+        if distintos:
+            fallos.append(f"{c['nombre']}: " + ", ".join(f"{k} {e!r} != {o!r}" for k, (e, o) in distintos.items())
+                          + (f" ({v.detalle})" if v.detalle else ""))
+    return fallos
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("Uso: python verificador_matematicas.py casos_verificador_matematicas.json")
+        return 2
+    from EduExce import _norm
+
+    with open(argv[0], "r", encoding="utf-8") as f:
+        casos = json.load(f)["casos"]
+    fallos = comprobar_casos(casos, _norm)
+    for fallo in fallos:
+        print(fallo)
+    repeticiones = 200
+    t0 = time.perf_counter()
+    for _ in range(repeticiones):
+        comprobar_casos(casos, _norm)
+    us = (time.perf_counter() - t0) / repeticiones / max(len(casos), 1) * 1e6
+    print(f"{len(casos)} casos, {len(fallos)} discrepancias, {us:.0f} µs por ítem")
+    return 1 if fallos else 0
+
+if __name__ == "__main__":
+    sys.exit(main())